@@ -0,0 +1,345 @@
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import model_core
+import reshard
+import safetensors_io
+import shards
+from module_tree import build_module_tree
+from tensor_table import TensorTable
+
+# 性能基准：生成合成的大模型（稀疏文件，数据区不占磁盘），测量打开、建树、预览和编辑保存的耗时
+# 以及峰值内存，结果输出为 JSON；每个规模在单独的子进程中运行，峰值内存互不影响
+#
+#   python bench.py --tensors 1k,100k,1M --size 20GB --output results.json
+#   python bench.py --baseline results.json      与上一次的结果比较，变慢时返回 1
+
+# 每一层的参数，名字与常见的 transformer 权重一致；True 表示二维矩阵
+LAYER_PARAMS = [
+    ("input_layernorm.weight", False),
+    ("self_attn.q_proj.weight", True),
+    ("self_attn.k_proj.weight", True),
+    ("self_attn.v_proj.weight", True),
+    ("self_attn.o_proj.weight", True),
+    ("post_attention_layernorm.weight", False),
+    ("mlp.gate_proj.weight", True),
+    ("mlp.up_proj.weight", True),
+    ("mlp.down_proj.weight", True),
+]
+
+DEFAULT_TENSORS = "1k,10k,100k,1M"
+DEFAULT_SIZE = "10GB"
+
+# 数据区超过这个大小时跳过删除/保存（会整体重写文件，稀疏文件也会被填满）
+DEFAULT_EDIT_LIMIT = "2GB"
+
+# 比较基准结果时，低于这个耗时的阶段不判断（计时噪声）
+NOISE_FLOOR = 0.01
+
+
+def parse_count(text):
+    text = text.strip().upper()
+    scale = {"K": 1000, "M": 1000 ** 2}.get(text[-1:], 1)
+    return int(float(text.rstrip("KM")) * scale)
+
+
+# 合成张量的名字和形状：按层依次排列，矩阵为 hidden x hidden，使数据区接近 data_bytes
+def synthetic_tensors(count, data_bytes, dtype="F16"):
+    matrices = sum(1 for i in range(count) if LAYER_PARAMS[i % len(LAYER_PARAMS)][1])
+    elements = data_bytes // safetensors_io.DTYPE_SIZES[dtype] // max(1, matrices)
+    hidden = max(1, math.isqrt(elements))
+    tensors = []
+    for i in range(count):
+        layer, position = divmod(i, len(LAYER_PARAMS))
+        param, matrix = LAYER_PARAMS[position]
+        shape = [hidden, hidden] if matrix else [hidden]
+        tensors.append((f"model.layers.{layer}.{param}", dtype, shape))
+    return tensors
+
+
+# 只写头部，再把文件截断到完整长度：数据区是空洞，读出来全是零
+def write_sparse_file(path, tensors, metadata, reserve=safetensors_io.HEADER_RESERVE):
+    table = {}
+    offset = 0
+    for name, dtype, shape in tensors:
+        size = safetensors_io.tensor_nbytes(dtype, shape)
+        table[name] = {"dtype": dtype, "shape": shape, "size": size, "offsets": [offset, offset + size]}
+        offset += size
+    header = safetensors_io.build_header(metadata, table)
+    # 和 write_file 一样预留头部空白，改名和追加可以原地完成
+    header = safetensors_io.build_header(metadata, table, len(header) + reserve)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        f.truncate(8 + len(header) + offset)
+    return safetensors_io.SafetensorsLayout(path, len(header), metadata, table)
+
+
+# 生成单文件或分片的合成模型，返回可以直接打开的路径（分片时为索引文件）
+def generate(out_dir, count, data_bytes, num_shards=1, dtype="F16"):
+    os.makedirs(out_dir, exist_ok=True)
+    tensors = synthetic_tensors(count, data_bytes, dtype)
+    metadata = {"format": "pt", "generator": "safetensors-viewer bench"}
+    if num_shards <= 1:
+        path = os.path.join(out_dir, "model.safetensors")
+        write_sparse_file(path, tensors, metadata)
+        return path
+
+    per_shard = math.ceil(len(tensors) / num_shards)
+    layouts = {}
+    for i in range(num_shards):
+        path = os.path.join(out_dir, reshard.SHARD_NAME.format(prefix="model", index=i + 1, count=num_shards))
+        layouts[path] = write_sparse_file(path, tensors[i * per_shard:(i + 1) * per_shard], metadata)
+    index_path = os.path.join(out_dir, "model" + shards.INDEX_SUFFIX)
+    shards.write_index(index_path, layouts)
+    return index_path
+
+
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位是 KB，macOS 上是字节
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+class Timer:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.stages = {}
+
+    # 只读的阶段重复 repeat 次取最短时间，返回最后一次的结果
+    def run(self, stage, fn, repeat=None, setup=None):
+        best = None
+        for _ in range(repeat or self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stages[stage] = {"seconds": round(best, 6), "peak_rss": peak_rss()}
+        return result
+
+    def skip(self, stage, reason):
+        self.stages[stage] = {"skipped": reason}
+
+
+def _first(table, suffix):
+    return next(name for name in table.names if name.endswith(suffix))
+
+
+def _gui_stages(timer, path, model, table, modules):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+        from tree_model import GROUP, TENSOR
+        from viewer import SafetensorsViewer
+    except ImportError as e:
+        for stage in ("gui_tree", "gui_click_module", "gui_click_tensor", "gui_rename"):
+            timer.skip(stage, f"PyQt5 unavailable: {e}")
+        return
+
+    app = QApplication.instance() or QApplication([])
+    viewer = SafetensorsViewer()
+    viewer.file_path = path
+
+    def loaded():
+        viewer.on_file_loaded(path, (model, table, modules))
+        app.processEvents()
+
+    timer.run("gui_tree", loaded)
+    tree = viewer.tree_model
+
+    # 顺着第一个模块往下找到第一个张量
+    index = tree.index(0, 0)
+    while tree.node(index).kind != GROUP:
+        index = tree.index(index.row() + 1, 0)
+    module = index
+    while tree.node(index).kind != TENSOR:
+        tree.fetch_all(index)
+        index = tree.index(0, 0, index)
+
+    timer.run("gui_click_module", lambda: viewer.on_item_clicked(module))
+
+    def click_tensor():
+        # 包括后台的预览和分块统计，直到结果显示出来
+        viewer.on_item_clicked(index)
+        viewer.workers.wait()
+        app.processEvents()
+
+    timer.run("gui_click_tensor", click_tensor)
+    viewer.workers.cancel_all()
+    viewer.workers.wait()
+
+    # 待提交的改名：只更新受影响的行和模块，不重建张量表和树；之后撤销，不影响后面的保存阶段
+    name = tree.full_name(tree.node(index))
+
+    def rename_pending():
+        viewer.transaction.rename(name, name + ".pending")
+        viewer.refresh_edits()
+        app.processEvents()
+
+    timer.run("gui_rename", rename_pending, repeat=1)
+    viewer.undo_change()
+
+
+class _CoarseImage(Exception):
+    pass
+
+
+def _stop_at_first(result, done, total):
+    raise _CoarseImage()
+
+
+# 热力图第一轮（每个像素行读一行）出图的耗时
+def _coarse_heatmap(model, name):
+    try:
+        model.heatmap(name, on_partial=_stop_at_first)
+    except _CoarseImage:
+        pass
+
+
+# 在子进程中运行一个规模的所有阶段
+def run_case(path, repeat=1, gui=True, edit_limit=None):
+    timer = Timer(repeat)
+    cache_root = tempfile.mkdtemp(prefix="bench-cache-")
+    os.environ["XDG_CACHE_HOME"] = cache_root
+    try:
+        timer.run("open_cold", lambda: model_core.Model(path),
+                  setup=lambda: shutil.rmtree(os.path.join(cache_root, "safetensors-viewer"), ignore_errors=True))
+        model = timer.run("open_cached", lambda: model_core.Model(path))
+        table = timer.run("tensor_table", lambda: TensorTable(model.layouts))
+        modules = timer.run("module_tree", lambda: build_module_tree(table))
+
+        norm = _first(table, "layernorm.weight")
+        matrix = _first(table, "q_proj.weight")
+        timer.run("preview", lambda: model_core.tensor_values(table.get(norm), model.layouts))
+        timer.run("stats", lambda: model.stats(matrix))
+        timer.run("heatmap_coarse", lambda: _coarse_heatmap(model, matrix))
+
+        if gui:
+            _gui_stages(timer, path, model, table, modules)
+
+        # 编辑会改动文件，只执行一次；改名和追加原地完成，删除会重写数据区
+        def edit(change):
+            change()
+            return model.commit()
+
+        timer.run("rename_save", lambda: edit(lambda: model.rename(matrix, matrix + ".renamed")), repeat=1)
+        timer.run("add_save", lambda: edit(lambda: model.transaction.add("bench.added", "F32", [1024])), repeat=1)
+        largest = max(layout.data_size for layout in model.layouts.values())
+        if edit_limit is not None and largest > edit_limit:
+            timer.skip("delete_save", f"data size {largest} exceeds edit limit {edit_limit}")
+        else:
+            timer.run("delete_save", lambda: edit(lambda: model.delete(norm)), repeat=1)
+    finally:
+        shutil.rmtree(cache_root, ignore_errors=True)
+    return {"stages": timer.stages, "peak_rss": peak_rss()}
+
+
+def _case_key(case):
+    return (case["tensors"], case["data_bytes"], case["shards"])
+
+
+# 找出比基准慢超过 tolerance 的阶段
+def compare(results, baseline, tolerance):
+    old_cases = {_case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        old = old_cases.get(_case_key(case))
+        if old is None:
+            continue
+        for stage, timing in case["stages"].items():
+            before = old["stages"].get(stage, {}).get("seconds")
+            after = timing.get("seconds")
+            if before is None or after is None or max(before, after) < NOISE_FLOOR:
+                continue
+            if after > before * (1 + tolerance):
+                regressions.append((case["tensors"], case["data_bytes"], stage, before, after))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the viewer on synthetic safetensors models.")
+    parser.add_argument("--tensors", default=DEFAULT_TENSORS, help="comma separated tensor counts (1k, 1M, ...)")
+    parser.add_argument("--size", default=DEFAULT_SIZE, help="data size of each generated model")
+    parser.add_argument("--shards", type=int, default=1, help="split each model into this many files")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions of the read-only stages")
+    parser.add_argument("--edit-limit", default=DEFAULT_EDIT_LIMIT,
+                        help="skip delete/save when a file holds more data than this")
+    parser.add_argument("--no-gui", action="store_true", help="skip the Qt tree and click stages")
+    parser.add_argument("--dir", help="where to generate models (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated models")
+    parser.add_argument("--output", help="write results to this JSON file instead of stdout")
+    parser.add_argument("--baseline", help="compare against an earlier results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before reporting (0.25 = 25%%)")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    edit_limit = model_core.parse_size(args.edit_limit)
+    if args.run_case:
+        result = run_case(args.run_case, args.repeat, not args.no_gui, edit_limit)
+        json.dump(result, sys.stdout)
+        return 0
+
+    data_bytes = model_core.parse_size(args.size)
+    work_dir = args.dir or tempfile.mkdtemp(prefix="safetensors-bench-")
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "cases": [],
+    }
+    try:
+        for count in (parse_count(text) for text in args.tensors.split(",")):
+            case_dir = os.path.join(work_dir, f"{count}-{data_bytes}-{args.shards}")
+            start = time.perf_counter()
+            path = generate(case_dir, count, data_bytes, args.shards)
+            generated = time.perf_counter() - start
+            print(f"{count:,} tensors: generated in {generated:.2f}s", file=sys.stderr)
+
+            command = [sys.executable, os.path.abspath(__file__), "--run-case", path,
+                       "--repeat", str(args.repeat), "--edit-limit", args.edit_limit]
+            if args.no_gui:
+                command.append("--no-gui")
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+            case = {"tensors": count, "data_bytes": data_bytes, "shards": args.shards,
+                    "generate_seconds": round(generated, 6)}
+            case.update(json.loads(output))
+            results["cases"].append(case)
+            for stage, timing in case["stages"].items():
+                print(f"  {stage:<18} {timing.get('seconds', 'skipped')}", file=sys.stderr)
+            if not args.keep:
+                shutil.rmtree(case_dir, ignore_errors=True)
+    finally:
+        if not args.keep and not args.dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for count, size, stage, before, after in regressions:
+            print(f"Regression: {count:,} tensors / {model_core.format_size(size)} {stage}: "
+                  f"{before:.4f}s -> {after:.4f}s", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
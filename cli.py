@@ -0,0 +1,290 @@
+import argparse
+import fnmatch
+import json
+import sys
+
+import numpy as np
+
+import convert
+import model_core
+import model_diff
+import reshard
+import tensor_hash
+import tensor_stats
+import tracing
+import transforms
+import validate
+
+# 命令行入口只依赖 NumPy，图形界面只在 view 子命令中导入
+
+
+def cmd_inspect(args):
+    model = model_core.Model(args.path)
+    summary = model.summary()
+    print(f"Path:       {summary['path']}")
+    print(f"Files:      {summary['files']}")
+    print(f"Tensors:    {summary['tensors']:,}")
+    print(f"Parameters: {summary['parameters']:,}")
+    print(f"Size:       {model_core.format_size(summary['bytes'])} ({summary['bytes']:,} bytes)")
+    for dtype, (count, size) in summary["dtypes"].items():
+        print(f"  {dtype:<8} {count:>8,} tensors  {model_core.format_size(size):>12}")
+    if summary["metadata"]:
+        print("Metadata:")
+        for key, value in summary["metadata"].items():
+            print(f"  {key} = {value}")
+    if model.issues:
+        print("Problems:")
+        print(validate.format_issues(model.issues))
+
+
+def cmd_ls(args):
+    table = model_core.Model(args.path).table()
+    names = table.names
+    rows = [row for row, name in enumerate(names) if args.pattern is None or fnmatch.fnmatchcase(name, args.pattern)]
+    if args.sort == "name":
+        rows.sort(key=names.__getitem__)
+    elif args.sort == "size":
+        # 稳定排序，大小相同的按文件中的顺序
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[np.argsort(-table.sizes[rows], kind="stable")].tolist()
+    for row in rows:
+        print(f"{names[row]}\t{table.dtype(row)}\t{list(table.shape(row))}\t{table.sizes[row]}")
+
+
+def cmd_stats(args):
+    model = model_core.Model(args.path)
+    for name in args.names:
+        print(f"{name}:")
+        stats = model.stats(name)
+        if args.json:
+            counts, edges = stats.pop("histogram")
+            stats["histogram"] = {"counts": counts.tolist(), "edges": edges.tolist()}
+            print(json.dumps(stats))
+        else:
+            print(tensor_stats.format_stats(stats))
+
+
+def cmd_rename(args):
+    model = model_core.Model(args.path)
+    model.rename(args.old, args.new)
+    model.commit()
+    print(f"Renamed '{args.old}' to '{args.new}'")
+
+
+def cmd_rm(args):
+    model = model_core.Model(args.path)
+    for name in args.names:
+        model.delete(name)
+    model.commit()
+    print(f"Deleted {len(args.names)} tensor(s)")
+
+
+def cmd_transform(args):
+    model = model_core.Model(args.path)
+    names = transforms.select(model, args.pattern) if args.pattern else [args.name]
+    if not names:
+        raise ValueError(f"No tensor matches '{args.pattern}'")
+    result = model.transform(names, transforms.parse_operation(" ".join(args.operation)), atomic=args.atomic)
+    print(f"Modified {result['tensors']:,} tensor(s) ({model_core.format_size(result['bytes'])}) in place")
+    for name in result["skipped"]:
+        print(f"skipped {name}: unsupported dtype")
+
+
+def cmd_diff(args):
+    result = model_diff.diff_models(model_core.Model(args.a), model_core.Model(args.b),
+                                    compare_values=args.values)
+    print(model_diff.format_diff(result))
+    return 1 if model_diff.has_changes(result) else 0
+
+
+def cmd_hash(args):
+    model = model_core.Model(args.path)
+    hashes = tensor_hash.hash_model(model, use_cache=not args.no_cache)
+    if args.verify is None:
+        for name, _, _ in model.items():
+            print(f"{hashes[name]}  {name}")
+        return 0
+
+    # 参考可以是保存下来的 .hashes.json，也可以是另一个模型（例如拷贝的来源）
+    if args.verify.endswith(tensor_hash.SIDECAR_SUFFIX):
+        reference = tensor_hash.read_hash_file(args.verify)["tensors"]
+    else:
+        reference = tensor_hash.hash_model(model_core.Model(args.verify))
+    result = tensor_hash.verify(hashes, reference)
+    for name in result["mismatched"]:
+        print(f"MISMATCH {name}")
+    for name in result["missing"]:
+        print(f"MISSING  {name}")
+    for name in result["extra"]:
+        print(f"EXTRA    {name}")
+    ok = not any(result.values())
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+def cmd_check(args):
+    model = model_core.Model(args.path)
+    issues = model.issues
+    if args.deep:
+        # 参考哈希默认取各文件的旁路缓存
+        reference = tensor_hash.read_hash_file(args.hashes)["tensors"] if args.hashes else None
+        result = validate.deep_check(model, reference, workers=args.workers)
+        issues = result["issues"]
+        print(f"Scanned {result['tensors']:,} tensors ({model_core.format_size(result['bytes'])}), "
+              f"compared {result['hashes_compared']:,} hashes")
+    print(validate.format_issues(issues))
+    return 1 if validate.has_errors(issues) else 0
+
+
+def cmd_dupes(args):
+    model = model_core.Model(args.path)
+    print(tensor_hash.format_duplicates(tensor_hash.find_duplicates(model, tensor_hash.hash_model(model))))
+
+
+def cmd_convert(args):
+    model = model_core.Model(args.path)
+    layout = convert.export(model, args.output, args.dtype, args.pattern)
+    print(f"Wrote {len(layout.tensors):,} tensors ({model_core.format_size(layout.data_size)}) to {args.output}")
+
+
+def cmd_reshard(args):
+    model = model_core.Model(args.path)
+    index_path, layouts = reshard.reshard(model, args.output_dir, args.max_size, args.prefix)
+    print(f"Wrote {len(layouts)} shard(s) and {index_path}")
+
+
+def cmd_merge(args):
+    model = model_core.Model(args.path)
+    layout = reshard.merge(model, args.output)
+    print(f"Wrote {len(layout.tensors):,} tensors ({model_core.format_size(layout.data_size)}) to {args.output}")
+
+
+def cmd_view(args):
+    from PyQt5.QtWidgets import QApplication
+    from viewer import SafetensorsViewer
+    app = QApplication(sys.argv[:1])
+    viewer = SafetensorsViewer()
+    viewer.show()
+    if args.path:
+        viewer.file_path = args.path
+        viewer.load_file(args.path)
+    return app.exec_()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="safetensors-viewer",
+        description="Inspect and edit safetensors files without loading tensor data.")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record timed spans and write them as a Chrome trace (summary on stderr)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("inspect", help="summary of a file, index or model folder")
+    p.add_argument("path")
+    p.set_defaults(func=cmd_inspect)
+
+    p = commands.add_parser("ls", help="list tensors")
+    p.add_argument("path")
+    p.add_argument("pattern", nargs="?", help="glob filter, e.g. 'model.layers.0.*'")
+    p.add_argument("--sort", choices=["file", "name", "size"], default="file")
+    p.set_defaults(func=cmd_ls)
+
+    p = commands.add_parser("stats", help="streaming statistics of tensors")
+    p.add_argument("path")
+    p.add_argument("names", nargs="+")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_stats)
+
+    p = commands.add_parser("rename", help="rename a tensor in place")
+    p.add_argument("path")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.set_defaults(func=cmd_rename)
+
+    p = commands.add_parser("rm", help="delete tensors")
+    p.add_argument("path")
+    p.add_argument("names", nargs="+")
+    p.set_defaults(func=cmd_rm)
+
+    p = commands.add_parser("transform", help="modify tensor data in place: " + ", ".join(transforms.OPERATIONS))
+    p.add_argument("path")
+    p.add_argument("operation", nargs="+", help="e.g. 'scale 0.5', 'clamp -1 1', 'zero 0:16, :', 'copy SOURCE'")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("--name")
+    target.add_argument("--pattern", help="glob, e.g. 'model.layers.*.mlp.*'")
+    p.add_argument("--atomic", action="store_true",
+                   help="roll back everything if interrupted; journals all target data first "
+                        "(needs that much free disk and doubles the I/O)")
+    p.set_defaults(func=cmd_transform)
+
+    p = commands.add_parser("diff", help="compare two models")
+    p.add_argument("a")
+    p.add_argument("b")
+    p.add_argument("--values", action="store_true",
+                   help="also stream tensor data: max abs diff, relative L2 and cosine similarity")
+    p.set_defaults(func=cmd_diff)
+
+    p = commands.add_parser("hash", help="parallel per-tensor content hashes, cached in a sidecar file")
+    p.add_argument("path")
+    p.add_argument("--verify", metavar="REFERENCE",
+                   help="compare against a .hashes.json file or another model")
+    p.add_argument("--no-cache", action="store_true")
+    p.set_defaults(func=cmd_hash)
+
+    p = commands.add_parser("check", help="validate the header against the file; --deep also scans the data")
+    p.add_argument("path")
+    p.add_argument("--deep", action="store_true",
+                   help="read all tensors in parallel: NaN/Inf counts and comparison with stored hashes")
+    p.add_argument("--hashes", metavar="FILE", help="reference .hashes.json instead of the sidecar files")
+    p.add_argument("--workers", type=int)
+    p.set_defaults(func=cmd_check)
+
+    p = commands.add_parser("dupes", help="find duplicate and tied tensors")
+    p.add_argument("path")
+    p.set_defaults(func=cmd_dupes)
+
+    p = commands.add_parser("convert", help="stream a converted copy to a new file")
+    p.add_argument("path")
+    p.add_argument("output")
+    p.add_argument("--dtype", choices=convert.TARGETS, required=True,
+                   help="I8 quantizes float tensors with >= 2 dims per output channel")
+    p.add_argument("--pattern", action="append",
+                   help="only convert matching tensors (glob, repeatable); others are copied")
+    p.set_defaults(func=cmd_convert)
+
+    p = commands.add_parser("reshard", help="split into shards of at most --max-size and write the index")
+    p.add_argument("path")
+    p.add_argument("output_dir")
+    p.add_argument("--max-size", type=model_core.parse_size, default=reshard.DEFAULT_MAX_SHARD_SIZE,
+                   help="e.g. 5GB or 2GiB")
+    p.add_argument("--prefix", default="model")
+    p.set_defaults(func=cmd_reshard)
+
+    p = commands.add_parser("merge", help="merge a sharded model into one file")
+    p.add_argument("path")
+    p.add_argument("output")
+    p.set_defaults(func=cmd_merge)
+
+    p = commands.add_parser("view", help="open the graphical viewer")
+    p.add_argument("path", nargs="?")
+    p.set_defaults(func=cmd_view)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.trace:
+        tracing.set_enabled(True)
+    try:
+        return args.func(args) or 0
+    except (OSError, KeyError, ValueError) as e:
+        message = e.args[0] if isinstance(e, KeyError) and e.args else e
+        print(f"error: {message}", file=sys.stderr)
+        return 2
+    finally:
+        if args.trace:
+            tracing.dump_chrome_trace(args.trace)
+            print(tracing.format_summary(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
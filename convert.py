@@ -0,0 +1,111 @@
+import fnmatch
+import os
+
+import numpy as np
+
+import safetensors_io
+
+# 导出时可选的目标类型，I8 为按输出通道（第 0 维）对称量化，缩放系数单独存为 F32 张量
+TARGETS = ["F16", "BF16", "I8"]
+FLOAT_DTYPES = {"F64", "F32", "F16", "BF16"}
+SCALE_SUFFIX = "_scale"
+QUANT_MAX = 127
+
+# 每次读取并转换的源数据字节数
+CONVERT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def _cast_chunks(layout, info, dtype):
+    mapped = safetensors_io.map_tensor(layout.path, layout.data_start, info).reshape(-1)
+    step = max(1, CONVERT_CHUNK_SIZE // safetensors_io.DTYPE_SIZES[info["dtype"]])
+    for start in range(0, mapped.size, step):
+        values = safetensors_io.read_window(mapped, info["dtype"], slice(start, start + step))
+        yield safetensors_io.encode_array(values, dtype)
+
+
+# 按行分块的逐通道 int8 量化：第一遍求每行有限值的绝对值最大值，第二遍量化；
+# 两个张量各自的数据在写出时才计算，缩放系数只计算一次
+class _RowQuantizer:
+    def __init__(self, layout, info):
+        self.layout = layout
+        self.info = info
+        self.channels = info["shape"][0]
+        self._scales = None
+
+    def _blocks(self):
+        # 用到时才映射，计划阶段不占用映射数；一行放得下时按整行分块，过长的行再按列切成窗口，
+        # 每块都不超过 CONVERT_CHUNK_SIZE，按行优先的顺序产出
+        dtype = self.info["dtype"]
+        mapped = safetensors_io.map_tensor(self.layout.path, self.layout.data_start, self.info)
+        rows = mapped.reshape(self.channels, -1)
+        width = rows.shape[1]
+        step = max(1, CONVERT_CHUNK_SIZE // safetensors_io.DTYPE_SIZES[dtype])
+        if width <= step:
+            step //= max(1, width)
+            for start in range(0, self.channels, step):
+                yield start, safetensors_io.read_window(rows, dtype, slice(start, start + step))
+        else:
+            for row in range(self.channels):
+                for col in range(0, width, step):
+                    yield row, safetensors_io.read_window(rows, dtype, (slice(row, row + 1), slice(col, col + step)))
+
+    def scales(self):
+        if self._scales is None:
+            absmax = np.zeros(self.channels, dtype=np.float32)
+            for start, values in self._blocks():
+                if values.size:
+                    # NaN 和 Inf 不参与缩放系数，否则整行的系数都会变成 NaN 或 Inf
+                    block = np.max(np.abs(values, where=np.isfinite(values), out=np.zeros_like(values)), axis=1)
+                    rows = slice(start, start + len(values))
+                    absmax[rows] = np.maximum(absmax[rows], block)
+            scales = absmax / QUANT_MAX
+            scales[scales == 0] = 1.0
+            self._scales = scales
+        return self._scales
+
+    def weight_chunks(self):
+        scales = self.scales()
+        for start, values in self._blocks():
+            block_scales = scales[start:start + len(values), np.newaxis]
+            # NaN 量化为 0，Inf 截断到最大值
+            quantized = np.nan_to_num(np.rint(values / block_scales), nan=0.0, posinf=QUANT_MAX, neginf=-QUANT_MAX)
+            yield np.clip(quantized, -QUANT_MAX, QUANT_MAX).astype(np.int8).tobytes()
+
+    def scale_chunks(self):
+        yield safetensors_io.encode_array(self.scales(), "F32")
+
+
+def _selected(name, patterns):
+    return not patterns or any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+# 根据源模型生成输出文件的条目列表（见 safetensors_io.write_file），此时还不读取任何数据
+def plan_export(model, target, patterns=None):
+    if target not in TARGETS:
+        raise ValueError(f"Unsupported target dtype '{target}'")
+    entries = []
+    for name, layout, info in model.items():
+        dtype, shape = info["dtype"], info["shape"]
+        convert = dtype in FLOAT_DTYPES and dtype != target and _selected(name, patterns)
+        if convert and target == "I8" and len(shape) >= 2 and shape[0] > 0:
+            quantizer = _RowQuantizer(layout, info)
+            entries.append((name, "I8", shape, quantizer.weight_chunks()))
+            entries.append((name + SCALE_SUFFIX, "F32", [shape[0]], quantizer.scale_chunks()))
+        elif convert and target != "I8":
+            entries.append((name, target, shape, _cast_chunks(layout, info, target)))
+        else:
+            # 不转换的张量（包括 I8 导出时的一维张量）原样拷贝字节
+            entries.append((name, dtype, shape, (layout.path, layout.data_start + info["offsets"][0])))
+    return entries
+
+
+def export(model, out_path, target, patterns=None, progress=None):
+    for path in model.layouts:
+        if os.path.exists(out_path) and os.path.samefile(path, out_path):
+            raise ValueError("Output file must differ from the source files")
+    # 分片模型的索引元数据（total_size 等）不属于单个文件，使用第一个分片的元数据
+    metadata = dict(next(iter(model.layouts.values())).metadata)
+    if target == "I8":
+        metadata["quantization"] = "int8_per_channel_symmetric"
+    entries = plan_export(model, target, patterns)
+    return safetensors_io.write_file(out_path, metadata, entries, progress=progress)
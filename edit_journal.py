@@ -0,0 +1,364 @@
+import copy
+import os
+from collections.abc import Mapping
+from itertools import chain
+
+import numpy as np
+
+import safetensors_io
+import tracing
+
+
+# 一次事务中排队的结构/数值修改，提交时只对文件做一次处理
+class EditTransaction:
+    def __init__(self, layout):
+        self.layout = layout
+        self.ops = []
+        self.redo_ops = []
+        self._view = None
+
+    def __bool__(self):
+        return bool(self.ops)
+
+    # ---- 排队操作 ----
+
+    def rename(self, old_name, new_name):
+        self._push(("rename", old_name, new_name))
+
+    def delete(self, name):
+        self._push(("delete", name))
+
+    def add(self, name, dtype, shape, initializer="zeros", value=0.0, seed=None):
+        # 固定随机种子，预览和提交时生成的数据一致
+        if seed is None:
+            seed = int(np.random.default_rng().integers(2 ** 63))
+        self._push(("add", name, dtype, list(shape), initializer, value, seed))
+
+    def set_values(self, name, values):
+        self._push(("set", name, np.asarray(values)))
+
+    def _push(self, op):
+        # 先在副本上重放，非法操作直接抛出，不进入日志
+        self._replay(self.ops + [op])
+        self.ops.append(op)
+        self.redo_ops.clear()
+        self._view = None
+
+    # 独立的副本：操作日志各自一份，在后台提交副本不会改动原来的事务
+    def copy(self):
+        other = copy.copy(self)
+        other.ops = list(self.ops)
+        other.redo_ops = list(self.redo_ops)
+        return other
+
+    # ---- 撤销/重做 ----
+
+    def can_undo(self):
+        return bool(self.ops)
+
+    def can_redo(self):
+        return bool(self.redo_ops)
+
+    def undo(self):
+        if self.ops:
+            self.redo_ops.append(self.ops.pop())
+            self._view = None
+
+    def redo(self):
+        if self.redo_ops:
+            self.ops.append(self.redo_ops.pop())
+            self._view = None
+
+    def describe(self, op):
+        kind = op[0]
+        if kind == "rename":
+            return f"Rename {op[1]} -> {op[2]}"
+        if kind == "delete":
+            return f"Delete {op[1]}"
+        if kind == "add":
+            return f"Add {op[1]} {op[2]}{op[3]}"
+        return f"Edit values of {op[1]}"
+
+    # ---- 虚拟张量表 ----
+
+    # 当前视图（见 TransactionView）：name -> info，info 额外带有
+    #   "file": 所在的文件
+    #   "source": 原文件中的名字（新增张量为 None）
+    #   "status": 待提交的状态集合（renamed/added/modified/deleted）
+    def view(self):
+        if self._view is None:
+            self._view = self._replay(self.ops)
+        return self._view
+
+    def _replay(self, ops):
+        view = TransactionView(self.layout)
+        for op in ops:
+            kind = op[0]
+            if kind == "add":
+                view.add(*op[1:])
+            elif kind == "rename":
+                view.rename(op[1], op[2])
+            elif kind == "delete":
+                view.delete(op[1])
+            elif kind == "set":
+                view.set_values(op[1], op[2])
+        view.finish()
+        return view
+
+    # ---- 提交 ----
+
+    # progress(done, total) 以字节为单位报告进度
+    def commit(self, progress=None):
+        view = self.view()
+        tensors = {name: info for name, info in view.items() if "deleted" not in info["status"]}
+        removed = bool(view.deleted)
+        resized = any("data" in info and len(info["data"]) != info["size"]
+                      for info in view.edited() if "deleted" not in info["status"])
+
+        with tracing.span("commit", "model", path=self.layout.path, ops=len(self.ops)) as span:
+            layout = None
+            if not (removed or resized):
+                layout = self._commit_in_place(tensors)
+            span.annotate(in_place=layout is not None)
+            if layout is None:
+                layout = self._commit_rewrite(tensors, progress)
+
+        self.layout = layout
+        self.ops.clear()
+        self.redo_ops.clear()
+        self._view = None
+        return layout
+
+    # 只有重命名、追加和等长数值修改：头部放得下时原地完成
+    def _commit_in_place(self, tensors):
+        layout = self.layout
+        data_size = layout.data_size
+        final = {}
+        appends = []
+        for name, info in tensors.items():
+            entry = {"dtype": info["dtype"], "shape": info["shape"], "size": info["size"]}
+            if info["source"] is None:
+                entry["offsets"] = [data_size, data_size + info["size"]]
+                appends.append((data_size, info))
+                data_size += info["size"]
+            else:
+                entry["offsets"] = info["offsets"]
+            final[name] = entry
+
+        # 原地提交只会追加数据；数据区变短说明大小算错了，截断会切进已有的数据甚至头部
+        if data_size < layout.data_size:
+            raise ValueError(f"In-place commit would shrink the data from {layout.data_size} to {data_size} bytes")
+        header_bytes = safetensors_io.build_header(layout.metadata, final)
+        if len(header_bytes) > layout.header_size:
+            return None
+        # 用空格填充到原长度；原头部长度不一定是 8 的倍数，不能再向上对齐
+        header_bytes += b" " * (layout.header_size - len(header_bytes))
+
+        patches = [(layout.data_start + info["offsets"][0], info["data"])
+                   for info in tensors.values() if "data" in info and info["source"] is not None]
+
+        safetensors_io.write_journal(layout.path, [(8, layout.header_size)] +
+                                     [(offset, len(data)) for offset, data in patches])
+        fd = os.open(layout.path, os.O_WRONLY)
+        try:
+            for offset, info in appends:
+                offset += layout.data_start
+                for chunk in _chunks(info):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            for offset, data in patches:
+                os.pwrite(fd, data, offset)
+            os.ftruncate(fd, layout.data_start + data_size)
+            os.fsync(fd)
+            os.pwrite(fd, header_bytes, 8)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        safetensors_io.commit_journal(layout.path)
+
+        return safetensors_io.SafetensorsLayout(layout.path, layout.header_size,
+                                                layout.metadata, final)
+
+    # 需要移动数据时：一次顺序流式重写
+    def _commit_rewrite(self, tensors, progress=None):
+        entries = {}
+        order = self.layout.data_size
+        for name, info in tensors.items():
+            entry = {"dtype": info["dtype"], "shape": info["shape"]}
+            if info["source"] is None:
+                # 新增张量排在末尾，保持原有数据的顺序
+                entry["offsets"] = [order, order]
+                entry["chunks"] = _chunks(info)
+                order += 1
+            else:
+                entry["offsets"] = info["offsets"]
+                if "data" in info:
+                    entry["data"] = info["data"]
+            entries[name] = entry
+        return safetensors_io.rewrite_file(self.layout, entries, progress=progress)
+
+
+_NO_STATUS = frozenset()
+
+
+# 事务视图：name -> info。只为改动过的张量保存字典，其余的从文件头部的列（见 safetensors_io.TensorColumns）
+# 按需生成，打开大文件后的第一次修改不必为每个张量创建字典。原有张量按行记录，重命名、修改和待删除都留在原来的行；
+# 新增张量排在最后。待删除的张量仍在视图中显示，但它们的名字可以重新使用，被占用后该行不再出现在视图中
+class TransactionView(Mapping):
+    def __init__(self, layout):
+        self.columns = layout.tensors
+        self.path = layout.path
+        # 行号 -> 改动后的 info
+        self.changed = {}
+        # 改过名的行 -> 当前的名字
+        self.renamed = {}
+        # 与头部不同的名字解析：name -> 行号，None 表示该名字已不属于任何有效的行
+        self.lookup = {}
+        # 新增张量：name -> info，按添加的顺序
+        self.added = {}
+        # 待删除的行 -> 删除时的名字
+        self.deleted = {}
+        # 仍以原名显示的待删除行：name -> 行号；名字被重新使用的待删除行不在视图中
+        self.deleted_names = {}
+        self.hidden = set()
+
+    def name(self, row):
+        return self.renamed.get(row, self.columns.names[row])
+
+    def row_info(self, row):
+        info = self.changed.get(row)
+        if info is None:
+            info = dict(self.columns.info(row), file=self.path, source=self.columns.names[row], status=_NO_STATUS)
+        return info
+
+    # 有效（未删除）的张量：(行号, info)，新增张量的行号为 None；不存在时返回 None
+    def live(self, name):
+        info = self.added.get(name)
+        if info is not None:
+            return None, info
+        row = self.lookup[name] if name in self.lookup else self.columns.index.get(name)
+        if row is None:
+            return None
+        return row, self.row_info(row)
+
+    # 有改动的 info：原有行中改过的和新增的
+    def edited(self):
+        return chain(self.changed.values(), self.added.values())
+
+    def __getitem__(self, name):
+        found = self.live(name)
+        if found is not None:
+            return found[1]
+        row = self.deleted_names.get(name)
+        if row is None:
+            raise KeyError(name)
+        return self.changed[row]
+
+    def __iter__(self):
+        if not self.renamed and not self.hidden:
+            yield from self.columns.names
+        else:
+            renamed, hidden = self.renamed, self.hidden
+            for row, name in enumerate(self.columns.names):
+                if row not in hidden:
+                    yield renamed.get(row, name)
+        yield from self.added
+
+    def __len__(self):
+        return len(self.columns) - len(self.hidden) + len(self.added)
+
+    # ---- 重放操作（见 EditTransaction._replay），非法操作抛出异常 ----
+
+    def _find(self, name):
+        found = self.live(name)
+        if found is None:
+            raise KeyError(f"Tensor '{name}' not found")
+        return found
+
+    def _check_free(self, name):
+        if self.live(name) is not None:
+            raise ValueError(f"Tensor '{name}' already exists")
+
+    # 名字不再属于原来的行
+    def _vacate(self, name):
+        if name in self.columns.index:
+            self.lookup[name] = None
+        else:
+            self.lookup.pop(name, None)
+
+    def _claim(self, name, row):
+        if self.columns.index.get(name) == row:
+            self.lookup.pop(name, None)
+        else:
+            self.lookup[name] = row
+
+    def _store(self, row, name, info):
+        if row is None:
+            self.added[name] = info
+        else:
+            self.changed[row] = info
+
+    def add(self, name, dtype, shape, initializer, value, seed):
+        self._check_free(name)
+        if dtype not in safetensors_io.DTYPE_SIZES:
+            raise ValueError(f"Unsupported dtype '{dtype}'")
+        safetensors_io.check_shape(shape)
+        self.added[name] = {
+            "dtype": dtype,
+            "shape": shape,
+            "size": safetensors_io.tensor_nbytes(dtype, shape),
+            "offsets": None,
+            "init": (initializer, value, seed),
+            "file": self.path,
+            "source": None,
+            "status": frozenset({"added"}),
+        }
+
+    def rename(self, old_name, new_name):
+        row, info = self._find(old_name)
+        self._check_free(new_name)
+        info = dict(info, status=info["status"] | {"renamed"})
+        if row is None:
+            del self.added[old_name]
+        else:
+            self._vacate(old_name)
+            self._claim(new_name, row)
+            if new_name == self.columns.names[row]:
+                self.renamed.pop(row, None)
+            else:
+                self.renamed[row] = new_name
+        self._store(row, new_name, info)
+
+    def delete(self, name):
+        row, info = self._find(name)
+        if row is None:
+            del self.added[name]
+            return
+        self._vacate(name)
+        self.deleted[row] = name
+        self.changed[row] = dict(info, status=info["status"] | {"deleted"})
+
+    def set_values(self, name, values):
+        row, info = self._find(name)
+        if int(np.prod(info["shape"])) != values.size:
+            raise ValueError("Number of values must match tensor size")
+        data = safetensors_io.encode_array(values, info["dtype"])
+        info = dict(info, data=data, status=info["status"] | {"modified"})
+        info.pop("init", None)
+        self._store(row, name, info)
+
+    # 重放结束：同名的待删除行只显示最后删除的一个，名字被有效张量占用时都不显示
+    def finish(self):
+        for row, name in self.deleted.items():
+            self.deleted_names[name] = row
+        for name in list(self.deleted_names):
+            if self.live(name) is not None:
+                del self.deleted_names[name]
+        self.hidden = set(self.deleted).difference(self.deleted_names.values())
+
+
+def _chunks(info):
+    if "data" in info:
+        return iter([info["data"]])
+    initializer, value, seed = info["init"]
+    return safetensors_io.generate_chunks(info["dtype"], info["shape"], initializer, value, seed)
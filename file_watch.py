@@ -0,0 +1,79 @@
+import os
+
+from PyQt5.QtCore import QFileSystemWatcher, QObject, QTimer, pyqtSignal
+
+from model_core import file_key
+
+# 监视打开的模型文件：QFileSystemWatcher（Linux 上是 inotify）及时得到通知，
+# 另外定时比较文件状态，覆盖网络文件系统以及替换成新文件后通知丢失的情况。
+# 训练任务写检查点需要一段时间，文件状态在一个间隔内不再变化后才发出 changed
+
+# 轮询文件状态的间隔（毫秒）
+WATCH_POLL_MS = 2000
+
+# 文件状态保持不变这么久才认为写入已经结束（毫秒）
+WATCH_SETTLE_MS = 500
+
+
+class FileWatcher(QObject):
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.poke)
+        # 替换文件（写临时文件再改名）时旧文件的通知会丢失，所以同时监视所在目录
+        self.watcher.directoryChanged.connect(self.poke)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(WATCH_POLL_MS)
+        self.poll_timer.timeout.connect(self.poll)
+        self.settle_timer = QTimer(self)
+        self.settle_timer.setSingleShot(True)
+        self.settle_timer.setInterval(WATCH_SETTLE_MS)
+        self.settle_timer.timeout.connect(self.settle)
+        self.keys = {}
+        self.pending = None
+
+    def watch(self, paths):
+        self.stop()
+        self.keys = {path: file_key(path) for path in paths}
+        self._add_paths()
+        self.poll_timer.start()
+
+    def stop(self):
+        self.poll_timer.stop()
+        self.settle_timer.stop()
+        self.pending = None
+        watched = self.watcher.files() + self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+
+    def _add_paths(self):
+        paths = set(self.keys) | {os.path.dirname(path) or "." for path in self.keys}
+        missing = [path for path in paths if path not in self.watcher.files() + self.watcher.directories()]
+        if missing:
+            self.watcher.addPaths(missing)
+
+    def poke(self, *_):
+        if self.keys:
+            self.settle_timer.start()
+
+    def poll(self):
+        if not self.settle_timer.isActive() and any(file_key(path) != key for path, key in self.keys.items()):
+            self.settle_timer.start()
+
+    def settle(self):
+        keys = {path: file_key(path) for path in self.keys}
+        if keys == self.keys:
+            # 目录中其它文件的变化
+            self.pending = None
+            return
+        if keys != self.pending or None in keys.values():
+            # 还在写入或正在替换，等下一个间隔
+            self.pending = keys
+            self.settle_timer.start()
+            return
+        self.keys = keys
+        self.pending = None
+        self._add_paths()
+        self.changed.emit()
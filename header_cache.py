@@ -0,0 +1,146 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import safetensors_io
+import tracing
+
+CACHE_MAGIC = b"STHC0001"
+
+# 缓存目录总大小上限，超出时按最近使用时间淘汰
+CACHE_SIZE_LIMIT = 256 * 1024 * 1024
+
+DTYPE_NAMES = list(safetensors_io.DTYPE_SIZES)
+
+# 头部依次为：魔数、JSON 头长度、张量数、元数据/名字/形状三段的字节数
+_HEADER = struct.Struct("<8sQQQQQ")
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "safetensors-viewer", "headers")
+
+
+# 缓存键由路径、大小、修改时间和 inode 组成，文件被改写后自动失效
+def cache_key(path, st=None):
+    st = st or os.stat(path)
+    key = f"{os.path.realpath(path)}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def cache_path(path, st=None):
+    return os.path.join(cache_dir(), cache_key(path, st) + ".bin")
+
+
+def encode_layout(layout):
+    columns = layout.tensors
+    count = len(columns)
+    # 缓存中的 dtype 编号固定为 DTYPE_NAMES，含未知 dtype 的头部不缓存
+    if columns.dtype_names[:len(DTYPE_NAMES)] != DTYPE_NAMES or \
+            (count and int(columns.dtype_codes.max()) >= len(DTYPE_NAMES)):
+        raise KeyError("Unknown dtype in header")
+
+    metadata_bytes = json.dumps(layout.metadata, ensure_ascii=False).encode("utf-8")
+    names_bytes = "\0".join(columns.names).encode("utf-8")
+    return b"".join([
+        _HEADER.pack(CACHE_MAGIC, layout.header_size, count,
+                     len(metadata_bytes), len(names_bytes), columns.dims.size),
+        columns.offsets.astype("<i8").tobytes(), columns.dims.astype("<i8").tobytes(),
+        columns.dtype_codes.tobytes(), columns.ndims.tobytes(),
+        metadata_bytes, names_bytes,
+    ])
+
+
+# 缓存中的各列直接拷贝成张量表的列，不经过逐个张量的字典
+def decode_layout(path, buf):
+    magic, header_size, count, metadata_len, names_len, shape_len = _HEADER.unpack_from(buf, 0)
+    if magic != CACHE_MAGIC:
+        raise ValueError("Not a header cache file")
+
+    pos = _HEADER.size
+    offsets = np.frombuffer(buf, dtype="<i8", count=count * 2, offset=pos).reshape(count, 2).astype(np.int64)
+    pos += count * 16
+    dims = np.frombuffer(buf, dtype="<i8", count=shape_len, offset=pos).astype(np.int64)
+    pos += shape_len * 8
+    dtype_codes = np.frombuffer(buf, dtype=np.uint8, count=count, offset=pos).copy()
+    pos += count
+    ndims = np.frombuffer(buf, dtype=np.uint8, count=count, offset=pos).copy()
+    pos += count
+    metadata = json.loads(bytes(buf[pos:pos + metadata_len]).decode("utf-8"))
+    pos += metadata_len
+    names = bytes(buf[pos:pos + names_len]).decode("utf-8").split("\0") if count else []
+    if len(names) != count or int(ndims.sum()) != shape_len:
+        raise ValueError("Corrupt header cache file")
+
+    tensors = safetensors_io.TensorColumns(names, list(DTYPE_NAMES), dtype_codes, ndims, dims, offsets)
+    return safetensors_io.SafetensorsLayout(path, header_size, metadata, tensors)
+
+
+def load_cached(path, st=None):
+    cached = cache_path(path, st)
+    try:
+        with tracing.span("cache_load", path=path) as span, open(cached, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                span.nbytes = len(buf)
+                layout = decode_layout(path, buf)
+    except (OSError, ValueError, struct.error):
+        return None
+    # 更新修改时间，作为 LRU 淘汰的依据
+    try:
+        os.utime(cached)
+    except OSError:
+        pass
+    return layout
+
+
+def store(layout, st=None):
+    directory = cache_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        cached = cache_path(layout.path, st)
+        tmp_path = cached + f".{os.getpid()}.tmp"
+        with tracing.span("cache_store", path=layout.path) as span, open(tmp_path, "wb") as f:
+            data = encode_layout(layout)
+            span.nbytes = len(data)
+            f.write(data)
+        os.replace(tmp_path, cached)
+        prune()
+    except (OSError, KeyError):
+        pass
+
+
+def prune(limit=CACHE_SIZE_LIMIT):
+    directory = cache_dir()
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".bin"):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+# 读取文件布局：命中缓存时不再解析 JSON 头部
+def read_layout(path):
+    with tracing.span("file_open", path=path) as span:
+        with tracing.span("stat", path=path):
+            st = os.stat(path)
+        layout = load_cached(path, st)
+        span.annotate(cached=layout is not None)
+        if layout is None:
+            layout = safetensors_io.read_layout(path)
+            store(layout, st)
+    return layout
@@ -0,0 +1,300 @@
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import safetensors_io
+import tensor_stats
+import tracing
+
+# 二维权重的缩略热力图：图像的每个像素对应矩阵中的一块，取块内的最大绝对值和均值。
+# 行按步长分轮采样：第一轮每个像素行只读一行，很快得到粗略的图像，之后每轮把步长减半，
+# 直到所有行都读过一遍，图像逐步变得精确。每行都是连续读取，列方向在读出的行内一次归约。
+# 超过二维的张量把前面的维度合并为行
+
+# 图像的最大边长（像素）
+HEATMAP_SIZE = 512
+
+# 每个任务读取的字节数
+HEATMAP_CHUNK_SIZE = 16 * 1024 * 1024
+
+# 直方图只统计前几轮采样到的这么多个值，已经足够反映分布
+HISTOGRAM_SAMPLE = 16 * 1024 * 1024
+HISTOGRAM_BINS = 128
+
+# 摘要中列出的全零行数和最大的列数
+MAX_LISTED = 20
+OUTLIER_COLUMNS = 8
+
+# 颜色表：最大绝对值用从黑到黄的渐变，均值用蓝-白-红的发散色
+MAXABS_COLORS = np.array([[0, 0, 4], [87, 16, 110], [188, 55, 84], [249, 142, 9], [252, 255, 164]], dtype=np.float64)
+MEAN_COLORS = np.array([[33, 102, 172], [247, 247, 247], [178, 24, 43]], dtype=np.float64)
+UNREAD_COLOR = (128, 128, 128)
+NAN_COLOR = (255, 0, 255)
+
+
+def as_matrix(mapped):
+    if mapped.ndim < 2:
+        raise ValueError("A heatmap needs a tensor with at least 2 dimensions")
+    # 整个张量的 memmap 是连续的，reshape 不会复制数据
+    return mapped.reshape(-1, mapped.shape[-1])
+
+
+def _edges(count, bins):
+    return np.linspace(0, count, min(count, bins) + 1).astype(np.int64)
+
+
+# 各轮读取的行：第一轮的步长使每个像素行约有一行，之后每轮读上一轮两行之间的中点
+def sample_passes(rows, bands):
+    stride = 1 << max(0, math.ceil(math.log2(max(rows / max(bands, 1), 1))))
+    yield np.arange(0, rows, stride)
+    while stride > 1:
+        stride //= 2
+        yield np.arange(stride, rows, stride * 2)
+
+
+class HeatmapAccumulator:
+    def __init__(self, rows, cols, size=HEATMAP_SIZE):
+        self.rows = rows
+        self.cols = cols
+        self.row_edges = _edges(rows, size)
+        self.col_edges = _edges(cols, size)
+        height, width = len(self.row_edges) - 1, len(self.col_edges) - 1
+        self.maxabs = np.zeros((height, width), dtype=np.float32)
+        self.sums = np.zeros((height, width), dtype=np.float64)
+        self.band_rows = np.zeros(height, dtype=np.int64)
+        # 未读的行为 NaN，全零行的最大绝对值为 0
+        self.row_maxabs = np.full(rows, np.nan, dtype=np.float32)
+        self.col_maxabs = np.zeros(cols, dtype=np.float32)
+        self.rows_read = 0
+        self.passes = 0
+        self.stats = tensor_stats.StatsAccumulator()
+
+    # 在工作线程中执行：归约一批行，返回 merge() 需要的部分结果
+    def reduce(self, rows, values, with_stats):
+        values = values.astype(np.float32, copy=False)
+        absolute = np.abs(values)
+        # 同一像素行的多行先逐段按列归约（行号是递增的），再在列方向按块归约
+        bands, starts = np.unique(np.searchsorted(self.row_edges, rows, side="right") - 1, return_index=True)
+        if len(bands) == len(rows):
+            band_max, band_sum = absolute, values
+        else:
+            segments = list(zip(starts, np.append(starts[1:], len(rows))))
+            band_max = np.stack([absolute[start:end].max(axis=0) for start, end in segments])
+            band_sum = np.stack([values[start:end].sum(axis=0) for start, end in segments])
+        return {
+            "rows": rows,
+            "row_max": absolute.max(axis=1),
+            "col_max": absolute.max(axis=0),
+            "bands": bands,
+            "band_rows": np.diff(np.append(starts, len(rows))),
+            "block_max": np.maximum.reduceat(band_max, self.col_edges[:-1], axis=1),
+            "block_sum": np.add.reduceat(band_sum, self.col_edges[:-1], axis=1, dtype=np.float64),
+            "stats": tensor_stats.chunk_stats(values) if with_stats else None,
+        }
+
+    def merge(self, part):
+        bands = part["bands"]
+        self.maxabs[bands] = np.maximum(self.maxabs[bands], part["block_max"])
+        self.sums[bands] += part["block_sum"]
+        self.band_rows[bands] += part["band_rows"]
+        self.row_maxabs[part["rows"]] = part["row_max"]
+        np.maximum(self.col_maxabs, part["col_max"], out=self.col_maxabs)
+        self.rows_read += len(part["rows"])
+        if part["stats"] is not None:
+            self.stats.merge(part["stats"])
+
+    def result(self):
+        widths = np.diff(self.col_edges)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sums / (self.band_rows[:, None] * widths[None, :])
+        return {
+            "rows": self.rows,
+            "cols": self.cols,
+            "rows_read": self.rows_read,
+            "passes": self.passes,
+            "complete": self.rows_read >= self.rows,
+            "row_edges": self.row_edges,
+            "col_edges": self.col_edges,
+            "maxabs": self.maxabs.copy(),
+            "mean": mean.astype(np.float32),
+            "read": self.band_rows > 0,
+            "row_maxabs": self.row_maxabs.copy(),
+            "col_maxabs": self.col_maxabs.copy(),
+            "row_profile": np.fmin.reduceat(self.row_maxabs, self.row_edges[:-1]),
+            "col_profile": np.fmin.reduceat(self.col_maxabs, self.col_edges[:-1]),
+            "stats": self.stats.result(),
+            "histogram": self.stats.histogram(HISTOGRAM_BINS),
+        }
+
+
+# 通过内存映射按轮采样并在多个线程中归约，
+# on_partial(result, rows_read, rows) 在第一轮完成时和之后每隔一段时间调用，可抛出异常取消
+def compute_heatmap(path, data_start, info, size=HEATMAP_SIZE, workers=None, on_partial=None):
+    dtype = info["dtype"]
+    matrix = as_matrix(safetensors_io.map_tensor(path, data_start, info))
+    rows, cols = matrix.shape
+    accumulator = HeatmapAccumulator(rows, cols, size)
+    if matrix.size == 0:
+        return accumulator.result()
+
+    row_bytes = cols * safetensors_io.DTYPE_SIZES[dtype]
+    rows_per_job = max(1, HEATMAP_CHUNK_SIZE // row_bytes)
+    passes = list(sample_passes(rows, len(accumulator.row_edges) - 1))
+    first_pass = len(passes[0])
+
+    def jobs():
+        scheduled = 0
+        for number, sample in enumerate(passes):
+            for start in range(0, len(sample), rows_per_job):
+                batch = sample[start:start + rows_per_job]
+                yield number, batch, scheduled * cols < HISTOGRAM_SAMPLE
+                scheduled += len(batch)
+
+    def work(job):
+        _, batch, with_stats = job
+        values = safetensors_io.decode_raw(matrix[batch], dtype)
+        if values.dtype == np.bool_:
+            values = values.view(np.uint8)
+        return accumulator.reduce(batch, values, with_stats)
+
+    with tracing.span("heatmap", nbytes=rows * row_bytes, path=path, passes=len(passes)):
+        workers = workers or os.cpu_count() or 1
+        last_partial = None
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 按窗口提交，各轮大致按顺序完成
+            pending = {}
+            queue = jobs()
+            try:
+                for job in queue:
+                    pending[executor.submit(work, job)] = job
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    future = next(as_completed(pending))
+                    number = pending.pop(future)[0]
+                    accumulator.merge(future.result())
+                    accumulator.passes = max(accumulator.passes, number + 1)
+                    if on_partial is not None and accumulator.rows_read >= first_pass and (
+                            last_partial is None
+                            or time.monotonic() - last_partial >= tensor_stats.PARTIAL_INTERVAL):
+                        last_partial = time.monotonic()
+                        on_partial(accumulator.result(), accumulator.rows_read, rows)
+                    for job in queue:
+                        pending[executor.submit(work, job)] = job
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+    return accumulator.result()
+
+
+def _colorize(values, colors):
+    # values 在 [0, 1] 之间，按颜色表的锚点线性插值
+    anchors = np.linspace(0, 1, len(colors))
+    return np.stack([np.interp(values, anchors, colors[:, channel]) for channel in range(3)], axis=-1)
+
+
+# 把结果渲染成 RGB 图像 (height, width, 3)；mode 为 "maxabs" 或 "mean"。
+# 颜色范围取 99.5 分位数，个别离群值显示为饱和色而不会把其余部分压暗
+def render(result, mode="maxabs"):
+    values = result[mode].astype(np.float64)
+    read = np.broadcast_to(result["read"][:, None], values.shape)
+    finite = read & np.isfinite(values)
+    limit = 1.0
+    if finite.any():
+        limit = float(np.percentile(np.abs(values[finite]), 99.5)) or float(np.abs(values[finite]).max()) or 1.0
+    if mode == "mean":
+        image = _colorize(np.clip(values / limit, -1, 1) * 0.5 + 0.5, MEAN_COLORS)
+    else:
+        image = _colorize(np.clip(values / limit, 0, 1), MAXABS_COLORS)
+    image[~finite] = NAN_COLOR
+    image[~read] = UNREAD_COLOR
+    return np.ascontiguousarray(image.astype(np.uint8))
+
+
+# 行（列）剖面：每个像素取其中各行（列）最大绝对值的最小值。全零的行在块的最大值里会被
+# 同一块的其它行掩盖，在剖面中显示为黑色；未读的行为 NaN，显示为灰色。返回 (n, 3) 的颜色
+def render_profile(values):
+    values = values.astype(np.float64)
+    finite = np.isfinite(values)
+    limit = float(values[finite].max()) if finite.any() else 0.0
+    colors = _colorize(np.clip(values / (limit or 1.0), 0, 1), MAXABS_COLORS)
+    colors[~finite] = UNREAD_COLOR
+    return np.ascontiguousarray(colors.astype(np.uint8))
+
+
+# 直方图的柱状图，计数取对数，少量的离群值也能看到
+def render_histogram(counts, width=512, height=100):
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    if len(counts) == 0 or counts.max() == 0:
+        return image
+    heights = np.log1p(counts.astype(np.float64)) / math.log1p(float(counts.max()))
+    columns = np.minimum(np.arange(width) * len(counts) // width, len(counts) - 1)
+    tops = height - np.round(heights[columns] * (height - 1)).astype(np.int64)
+    mask = np.arange(height)[:, None] >= tops[None, :]
+    image[mask] = (33, 150, 243)
+    return image
+
+
+# 鼠标所在像素对应的行列范围和数值
+def describe_pixel(result, y, x):
+    row_edges, col_edges = result["row_edges"], result["col_edges"]
+    text = f"rows {row_edges[y]:,}-{row_edges[y + 1] - 1:,}, cols {col_edges[x]:,}-{col_edges[x + 1] - 1:,}"
+    if not result["read"][y]:
+        return text + ": not read yet"
+    return text + f": max |x| {result['maxabs'][y, x]:.4g}, mean {result['mean'][y, x]:.4g}"
+
+
+def describe_row_band(result, y):
+    row_edges = result["row_edges"]
+    value = result["row_profile"][y]
+    text = f"rows {row_edges[y]:,}-{row_edges[y + 1] - 1:,}"
+    if not np.isfinite(value):
+        return text + ": not read yet"
+    row = row_edges[y] + int(np.nanargmin(result["row_maxabs"][row_edges[y]:row_edges[y + 1]]))
+    return text + f": weakest row {row:,} has max |x| {value:.4g}"
+
+
+def describe_col_band(result, x):
+    col_edges = result["col_edges"]
+    columns = result["col_maxabs"][col_edges[x]:col_edges[x + 1]]
+    return (f"cols {col_edges[x]:,}-{col_edges[x + 1] - 1:,}: max |x| between {np.nanmin(columns):.4g} "
+            f"(col {col_edges[x] + int(np.nanargmin(columns)):,}) and {np.nanmax(columns):.4g} "
+            f"(col {col_edges[x] + int(np.nanargmax(columns)):,})")
+
+
+def format_summary(result):
+    lines = []
+    if not result["complete"]:
+        lines.append(f"(partial: {result['rows_read']:,} of {result['rows']:,} rows read, pass {result['passes']})")
+
+    dead_rows = np.flatnonzero(result["row_maxabs"] == 0)
+    listed = ", ".join(str(row) for row in dead_rows[:MAX_LISTED]) + (" ..." if len(dead_rows) > MAX_LISTED else "")
+    lines.append(f"All-zero rows: {len(dead_rows):,}" + (f" ({listed})" if len(dead_rows) else ""))
+
+    columns = result["col_maxabs"]
+    if result["complete"]:
+        dead_cols = np.flatnonzero(columns == 0)
+        listed = ", ".join(str(col) for col in dead_cols[:MAX_LISTED]) + (" ..." if len(dead_cols) > MAX_LISTED else "")
+        lines.append(f"All-zero columns: {len(dead_cols):,}" + (f" ({listed})" if len(dead_cols) else ""))
+    nonfinite = np.flatnonzero(~np.isfinite(columns))
+    if len(nonfinite):
+        listed = ", ".join(str(col) for col in nonfinite[:MAX_LISTED]) + (" ..." if len(nonfinite) > MAX_LISTED else "")
+        lines.append(f"Columns with NaN/Inf: {len(nonfinite):,} ({listed})")
+    if np.isfinite(columns).any():
+        median = float(np.median(columns[np.isfinite(columns)]))
+        order = np.argsort(np.where(np.isfinite(columns), columns, -1))[::-1][:OUTLIER_COLUMNS]
+        parts = []
+        for col in order:
+            ratio = f", {columns[col] / median:.1f}x median" if median > 0 else ""
+            parts.append(f"{col} ({columns[col]:.4g}{ratio})")
+        lines.append("Largest columns by max |x|: " + "; ".join(parts))
+
+    stats = result["stats"]
+    if stats["min"] is not None:
+        lines.append(f"Sampled {stats['numel']:,} values: min {stats['min']:.4g}, max {stats['max']:.4g}, "
+                     f"mean {stats['mean']:.4g}, std {stats['std']:.4g}, NaN {stats['nan']:,}, Inf {stats['inf']:,}")
+    return "\n".join(lines)
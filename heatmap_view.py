@@ -0,0 +1,151 @@
+from PyQt5.QtGui import QFont, QImage, QPixmap
+from PyQt5.QtWidgets import QComboBox, QDialog, QGridLayout, QHBoxLayout, QLabel, QPlainTextEdit, QVBoxLayout
+
+import heatmap
+from workers import TaskRunner
+
+# 行、列剖面窄条的宽度（像素）
+PROFILE_WIDTH = 16
+
+MODES = [("Max |x| per block", "maxabs"), ("Mean per block", "mean")]
+
+
+def to_pixmap(image):
+    height, width, _ = image.shape
+    return QPixmap.fromImage(QImage(image.data, width, height, 3 * width, QImage.Format_RGB888).copy())
+
+
+# 拉伸显示的图像，鼠标移动时报告所在像素
+class ImageLabel(QLabel):
+    def __init__(self, on_hover, parent=None):
+        super().__init__(parent)
+        self.on_hover = on_hover
+        self.image_size = None
+        self.setMouseTracking(True)
+        self.setScaledContents(True)
+        self.setMinimumSize(256, 256)
+
+    def set_image(self, image):
+        self.image_size = image.shape[:2]
+        self.setPixmap(to_pixmap(image))
+
+    def mouseMoveEvent(self, event):
+        if self.image_size is not None and self.width() and self.height():
+            height, width = self.image_size
+            y = min(height - 1, max(0, event.y() * height // self.height()))
+            x = min(width - 1, max(0, event.x() * width // self.width()))
+            self.on_hover(y, x)
+        super().mouseMoveEvent(event)
+
+
+# 热力图和直方图：先显示第一轮采样的粗略图像，后台继续读取时逐步刷新
+class HeatmapDialog(QDialog):
+    def __init__(self, name, layout, info, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Heatmap - {name}")
+        self.resize(800, 800)
+        self.name = name
+        self.info = info
+        self.result = None
+
+        main_layout = QVBoxLayout()
+        self.setLayout(main_layout)
+
+        mode_bar = QHBoxLayout()
+        mode_bar.addWidget(QLabel(f"Shape {list(info['shape'])}  {info['dtype']}   Show:"))
+        self.mode_box = QComboBox()
+        for label, _ in MODES:
+            self.mode_box.addItem(label)
+        self.mode_box.currentIndexChanged.connect(self.render)
+        mode_bar.addWidget(self.mode_box)
+        mode_bar.addStretch()
+        main_layout.addLayout(mode_bar)
+
+        # 右侧和下方的窄条是行、列剖面，块的最大值里看不出的全零行、列在这里显示为黑色
+        grid = QGridLayout()
+        grid.setSpacing(2)
+        self.image = ImageLabel(self.show_pixel)
+        grid.addWidget(self.image, 0, 0)
+        self.row_strip = ImageLabel(lambda y, x: self.show_band(heatmap.describe_row_band, y))
+        self.row_strip.setMinimumSize(PROFILE_WIDTH, 256)
+        self.row_strip.setFixedWidth(PROFILE_WIDTH)
+        grid.addWidget(self.row_strip, 0, 1)
+        self.col_strip = ImageLabel(lambda y, x: self.show_band(heatmap.describe_col_band, x))
+        self.col_strip.setMinimumSize(256, PROFILE_WIDTH)
+        self.col_strip.setFixedHeight(PROFILE_WIDTH)
+        grid.addWidget(self.col_strip, 1, 0)
+        main_layout.addLayout(grid, 1)
+        self.pixel_label = QLabel("")
+        main_layout.addWidget(self.pixel_label)
+
+        self.histogram = QLabel()
+        self.histogram.setScaledContents(True)
+        self.histogram.setFixedHeight(100)
+        main_layout.addWidget(self.histogram)
+        self.histogram_range = QLabel("")
+        main_layout.addWidget(self.histogram_range)
+
+        self.summary = QPlainTextEdit()
+        self.summary.setReadOnly(True)
+        self.summary.setFont(QFont("Consolas", 9))
+        self.summary.setMaximumHeight(120)
+        main_layout.addWidget(self.summary)
+
+        self.status = QLabel("Reading...")
+        main_layout.addWidget(self.status)
+
+        self.workers = TaskRunner(self)
+        self.start(layout, info)
+
+    def start(self, layout, info):
+        self.workers.submit("heatmap",
+            lambda task: heatmap.compute_heatmap(layout.path, layout.data_start, info,
+                on_partial=lambda result, done, total: task.report_progress(done, total, result)),
+            on_done=self.show_result,
+            on_error=lambda message: self.status.setText(f"Failed to read tensor: {message}"),
+            on_progress=lambda done, total, result: self.show_result(result))
+
+    def show_result(self, result):
+        self.result = result
+        self.render()
+        self.row_strip.set_image(heatmap.render_profile(result["row_profile"])[:, None, :])
+        self.col_strip.set_image(heatmap.render_profile(result["col_profile"])[None, :, :])
+        counts, edges = result["histogram"]
+        self.histogram.setPixmap(to_pixmap(heatmap.render_histogram(counts)))
+        if len(edges):
+            self.histogram_range.setText(f"Histogram (log scale): {edges[0]:.4g} .. {edges[-1]:.4g}")
+        self.summary.setPlainText(heatmap.format_summary(result))
+        if result["complete"]:
+            self.status.setText(f"All {result['rows']:,} rows read")
+        else:
+            self.status.setText(f"Refining: {result['rows_read']:,} of {result['rows']:,} rows read "
+                                f"(pass {result['passes']}); gray = not read yet, magenta = NaN/Inf")
+
+    def render(self):
+        if self.result is not None:
+            self.image.set_image(heatmap.render(self.result, MODES[self.mode_box.currentIndex()][1]))
+
+    def show_pixel(self, y, x):
+        if self.result is not None:
+            self.pixel_label.setText(heatmap.describe_pixel(self.result, y, x))
+
+    def show_band(self, describe, index):
+        if self.result is not None:
+            self.pixel_label.setText(describe(self.result, index))
+
+    # 文件在外部被改写后调用：内容没变时保留结果，否则重新读取
+    def rebind(self, layout, info, keep, probable=False):
+        self.info = info
+        if not keep:
+            self.status.setText("Reloaded from disk (probably unchanged, sampled), reading..." if probable
+                                else "Reloaded from disk, reading...")
+            self.start(layout, info)
+
+    def detach(self, message):
+        self.workers.cancel_all()
+        self.status.setText(message)
+
+    def done(self, code):
+        # 关闭时停止后台读取
+        self.workers.cancel_all()
+        super().done(code)
@@ -0,0 +1,219 @@
+import copy
+import os
+
+import numpy as np
+
+import header_cache
+import heatmap
+import safetensors_io
+import shards
+import tensor_hash
+import tensor_stats
+import tracing
+import transforms
+import validate
+from edit_journal import EditTransaction
+from tensor_table import TensorTable
+
+# 不依赖 Qt 和 torch 的核心接口，图形界面和命令行共用
+
+
+def tensor_values(info, layouts):
+    # 读取张量的当前值（包括尚未提交的修改），可在工作线程中调用
+    if "data" in info:
+        return safetensors_io.decode_array(info["data"], info["dtype"], info["shape"])
+    if info["source"] is None:
+        initializer, value, seed = info["init"]
+        data = b"".join(safetensors_io.generate_chunks(
+            info["dtype"], info["shape"], initializer, value, seed))
+        return safetensors_io.decode_array(data, info["dtype"], info["shape"])
+    return safetensors_io.read_tensor(layouts[info["file"]], info["source"], info)
+
+
+# 文件的状态键，改写（包括替换成新文件）后会变化；文件不存在时为 None
+def file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+# 单文件或分片模型：打开时只读取头部，事务在第一次修改时才创建
+class Model:
+    def __init__(self, path):
+        self.path = path
+        self.recovered = False
+        with tracing.span("open_model", "model", path=path) as span:
+            if shards.is_sharded(path):
+                self.sharded = shards.ShardedModel(path)
+                self.layouts = self.sharded.layouts
+                self.metadata = self.sharded.metadata
+            else:
+                self.sharded = None
+                # 恢复上次未完成的写入
+                self.recovered = safetensors_io.recover_journal(path)
+                # 读头部之前记录文件状态，读取过程中被改写时下次检查仍能发现
+                key = file_key(path)
+                layout = header_cache.read_layout(path)
+                self.layouts = {path: layout}
+                self.metadata = layout.metadata
+            span.annotate(files=len(self.layouts), tensors=len(self))
+        # 头部描述与文件不符（截断、重叠等）时在打开时就报告，而不是读取数据时才出错
+        self.issues = validate.validate_model(self)
+        self._transaction = None
+        self._table = None
+        self.record_file_keys()
+        if self.sharded is None:
+            self.file_keys[path] = key
+
+    def record_file_keys(self):
+        self.file_keys = {file: file_key(file) for file in self.watch_paths()}
+
+    # 需要监视的文件：索引文件和各分片
+    def watch_paths(self):
+        index_path = self.sharded.index_path if self.sharded is not None else None
+        return ([index_path] if index_path else []) + list(self.layouts)
+
+    # 打开之后被改写的文件
+    def changed_files(self):
+        return [file for file, key in self.file_keys.items() if file_key(file) != key]
+
+    @property
+    def transaction(self):
+        if self._transaction is None:
+            if self.sharded is not None:
+                self._transaction = shards.ShardedTransaction(self.sharded)
+            else:
+                self._transaction = EditTransaction(self.layouts[self.path])
+        return self._transaction
+
+    def __len__(self):
+        return sum(len(layout.tensors) for layout in self.layouts.values())
+
+    # 列式张量表：有待提交的修改时叠加事务视图，否则就是磁盘上的张量表
+    def table(self):
+        if self._transaction:
+            return self.disk_table().with_edits(self.pending_views())
+        return self.disk_table()
+
+    # 由各文件头部的列直接拼成的张量表，布局不变时重复使用
+    def disk_table(self):
+        if self._table is None or self._table.layouts is not self.layouts:
+            self._table = TensorTable(self.layouts)
+        return self._table
+
+    # 按文件顺序遍历 (name, layout, info)，字典按需生成
+    def items(self):
+        for layout in self.layouts.values():
+            for name, info in layout.tensors.items():
+                yield name, layout, info
+
+    # 用整个模型的索引查找，分片模型不必为每个分片再建立索引
+    def locate(self, name):
+        table = self.disk_table()
+        row = table.index.get(name)
+        if row is None:
+            raise KeyError(f"Tensor '{name}' not found")
+        code = int(table.file_codes[row])
+        layout = self.layouts[table.files[code]]
+        return layout, layout.tensors.info(row - int(table.file_starts[code]))
+
+    def read(self, name):
+        layout, info = self.locate(name)
+        return safetensors_io.read_tensor(layout, name, info)
+
+    def stats(self, name, on_partial=None):
+        layout, info = self.locate(name)
+        return tensor_stats.compute_stats(layout.path, layout.data_start, info, on_partial=on_partial)
+
+    def heatmap(self, name, on_partial=None):
+        layout, info = self.locate(name)
+        return heatmap.compute_heatmap(layout.path, layout.data_start, info, on_partial=on_partial)
+
+    def summary(self):
+        table = self.disk_table()
+        counts = np.bincount(table.dtype_codes, minlength=len(table.dtype_names))
+        dtype_bytes = np.zeros(len(table.dtype_names), dtype=np.int64)
+        np.add.at(dtype_bytes, table.dtype_codes, table.sizes)
+        return {
+            "path": self.path,
+            "files": len(self.layouts),
+            "tensors": len(table),
+            "parameters": int(table.numels.sum()),
+            "bytes": int(table.sizes.sum()),
+            "dtypes": {dtype: (int(counts[code]), int(dtype_bytes[code]))
+                       for code, dtype in sorted(enumerate(table.dtype_names), key=lambda item: item[1])
+                       if counts[code]},
+            "metadata": self.metadata,
+        }
+
+    def rename(self, old_name, new_name):
+        self.transaction.rename(old_name, new_name)
+
+    def delete(self, name):
+        self.transaction.delete(name)
+
+    # 在后台保存用的副本：布局字典和事务各自一份，提交副本时界面仍可读取原来的模型
+    def snapshot(self):
+        other = copy.copy(self)
+        other.layouts = dict(self.layouts)
+        if self.sharded is not None:
+            other.sharded = copy.copy(self.sharded)
+            other.sharded.layouts = other.layouts
+        if self._transaction is not None:
+            other._transaction = (self._transaction.copy(other.sharded) if self.sharded is not None
+                                  else self._transaction.copy())
+        other._table = None
+        other.file_keys = dict(self.file_keys)
+        return other
+
+    def pending_views(self):
+        # 有待提交修改的文件 -> 该文件的事务视图
+        transaction = self.transaction
+        if self.sharded is not None:
+            return {file: t.view() for file, t in transaction.transactions.items() if t}
+        return {self.path: transaction.view()} if transaction else {}
+
+    # 原地批量变换（见 transforms），直接写入磁盘，不经过事务
+    def transform(self, names, operation, progress=None, atomic=False):
+        if self._transaction:
+            raise ValueError("Save or discard pending changes before a bulk edit")
+        result = transforms.apply(self, names, operation, progress=progress, atomic=atomic)
+        self.record_file_keys()
+        return result
+
+    def commit(self, progress=None):
+        carried = {path: tensor_hash.carry_forward(path, view) for path, view in self.pending_views().items()}
+        with tracing.span("save", "model", path=self.path, files=len(carried)):
+            layouts = self.transaction.commit(progress=progress)
+        if not isinstance(layouts, dict):
+            layouts = {self.path: layouts}
+        self.layouts = layouts
+        # 分片模型提交时就地替换了 layouts 中的条目，张量表要重新拼接
+        self._table = None
+        self.record_file_keys()
+        for path, hashes in carried.items():
+            if hashes:
+                tensor_hash.save_sidecar(path, hashes)
+        return layouts
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+# 解析 "5GB"、"2GiB"、"1024" 这样的大小
+def parse_size(text):
+    units = {"": 1, "B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+             "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3, "TIB": 1024 ** 4}
+    text = text.strip().upper()
+    number = text.rstrip("KMGTIB")
+    unit = text[len(number):]
+    if unit not in units or not number:
+        raise ValueError(f"Invalid size '{text}'")
+    return int(float(number) * units[unit])
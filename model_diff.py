@@ -0,0 +1,269 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import safetensors_io
+import tensor_hash
+
+# 比较两个模型的张量表：新增、删除以及 dtype/形状发生变化的张量；
+# 两边都有的张量可以进一步分块流式比较数值
+
+# 每个工作线程一次读取的字节数（两边各一块）
+DIFF_CHUNK_SIZE = 16 * 1024 * 1024
+
+# 块内按该元素数分段转换为 float64 计算，临时数组不随块的元素数增长（1 字节的 dtype 一块有 16M 个元素）
+DIFF_BLOCK_ELEMS = 1 << 20
+
+
+def diff_models(a, b, compare_values=False, chunk_size=DIFF_CHUNK_SIZE, workers=None, progress=None):
+    a_tensors = {name: (layout, info) for name, layout, info in a.items()}
+    b_tensors = {name: (layout, info) for name, layout, info in b.items()}
+    added = sorted(name for name in b_tensors if name not in a_tensors)
+    removed = sorted(name for name in a_tensors if name not in b_tensors)
+    changed = []
+    common = []
+    for name, (_, a_info) in a_tensors.items():
+        if name not in b_tensors:
+            continue
+        b_info = b_tensors[name][1]
+        if a_info["dtype"] != b_info["dtype"] or list(a_info["shape"]) != list(b_info["shape"]):
+            changed.append((name, (a_info["dtype"], list(a_info["shape"])),
+                            (b_info["dtype"], list(b_info["shape"]))))
+        else:
+            common.append(name)
+
+    result = {"added": added, "removed": removed, "changed": sorted(changed), "common": common}
+    if compare_values:
+        # 两边旁路文件中哈希相同的张量不必读取
+        a_hashes = _cached_hashes(a)
+        b_hashes = _cached_hashes(b)
+        pairs = []
+        values = {}
+        for name in common:
+            if name in a_hashes and a_hashes[name] == b_hashes.get(name):
+                values[name] = _finish({"identical": True})
+            else:
+                pairs.append((name, a_tensors[name], b_tensors[name]))
+        values.update(compare_tensors(pairs, chunk_size, workers, progress))
+        result["values"] = values
+    return result
+
+
+# 同一模型重新读取头部前后的差异（见 viewer 的监视模式）：除了新增、删除和 dtype/形状变化，
+# 还区分数据位置变了的张量（moved）和留在原处的张量（个数为 kept）；逐列比较两边的张量表
+def header_diff(old, new):
+    old_table = old.table()
+    new_table = new.table()
+    old_rows = np.fromiter((old_table.index.get(name, -1) for name in new_table.names), dtype=np.int64,
+                           count=len(new_table))
+    common = old_rows >= 0
+    new_rows = np.flatnonzero(common)
+    old_rows = old_rows[common]
+    removed = np.ones(len(old_table), dtype=bool)
+    removed[old_rows] = False
+
+    same_shape = ((_recode(new_table.dtype_names, old_table.dtype_names)[new_table.dtype_codes[new_rows]]
+                   == old_table.dtype_codes[old_rows])
+                  & (old_table.ndims[old_rows] == new_table.ndims[new_rows]))
+    # 维数相同的行把各维展开后一次比较
+    rows = np.flatnonzero(same_shape)
+    lengths = new_table.ndims[new_rows[rows]].astype(np.int64)
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    within = np.arange(len(owners)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    differs = (old_table.dims[old_table.dim_starts[old_rows[rows]][owners] + within]
+               != new_table.dims[new_table.dim_starts[new_rows[rows]][owners] + within])
+    same_shape[rows[np.unique(owners[differs])]] = False
+    # 位置比较所在文件和绝对偏移，换了分片的张量即使偏移相同也算移动
+    same_place = ((_recode(new_table.files, old_table.files)[new_table.file_codes[new_rows]]
+                   == old_table.file_codes[old_rows])
+                  & (old_table.positions()[old_rows] == new_table.positions()[new_rows]))
+
+    names = new_table.names
+    return {
+        "added": [names[row] for row in np.flatnonzero(~common).tolist()],
+        "removed": [old_table.names[row] for row in np.flatnonzero(removed).tolist()],
+        "changed": [names[row] for row in new_rows[~same_shape].tolist()],
+        "moved": [names[row] for row in new_rows[same_shape & ~same_place].tolist()],
+        "kept": int(np.count_nonzero(same_shape & same_place)),
+        "metadata": old.metadata != new.metadata,
+    }
+
+
+# new_values 中的编号换成 old_values 中的编号，没有的为 -1
+def _recode(new_values, old_values):
+    codes = {value: code for code, value in enumerate(old_values)}
+    return np.array([codes.get(value, -1) for value in new_values], dtype=np.int64)
+
+
+def has_structure_changes(diff):
+    return bool(diff["added"] or diff["removed"] or diff["changed"] or diff["metadata"])
+
+
+def _cached_hashes(model):
+    hashes = {}
+    for path in model.layouts:
+        hashes.update(tensor_hash.load_sidecar(path))
+    return hashes
+
+
+def _same_storage(a_layout, a_info, b_layout, b_info):
+    # 同一个文件（包括硬链接）中的同一段数据，无需读取
+    try:
+        return (a_layout.data_start + a_info["offsets"][0] == b_layout.data_start + b_info["offsets"][0]
+                and os.path.samefile(a_layout.path, b_layout.path))
+    except OSError:
+        return False
+
+
+def chunk_diff(a_raw, b_raw, dtype):
+    # 原始字节相同时只需计算一次范数，跳过差值计算
+    a_values = safetensors_io.decode_array(a_raw, dtype)
+    identical = a_raw == b_raw
+    b_values = a_values if identical else safetensors_io.decode_array(b_raw, dtype)
+    result = {"identical": identical, "max_abs": 0.0, "sq_a": 0.0, "sq_b": 0.0, "dot": 0.0, "sq_diff": 0.0}
+    for start in range(0, a_values.size, DIFF_BLOCK_ELEMS):
+        a = a_values[start:start + DIFF_BLOCK_ELEMS].astype(np.float64)
+        sq = float(np.dot(a, a))
+        result["sq_a"] += sq
+        if identical:
+            continue
+        b = b_values[start:start + DIFF_BLOCK_ELEMS].astype(np.float64)
+        result["sq_b"] += float(np.dot(b, b))
+        result["dot"] += float(np.dot(a, b))
+        np.subtract(a, b, out=b)
+        result["max_abs"] = max(result["max_abs"], float(np.max(np.abs(b))))
+        result["sq_diff"] += float(np.dot(b, b))
+    if identical:
+        result["sq_b"] = result["dot"] = result["sq_a"]
+    return result
+
+
+def _finish(acc):
+    if acc["identical"]:
+        return {"identical": True, "max_abs": 0.0, "rel_l2": 0.0, "cosine": 1.0}
+    norm_a = math.sqrt(acc["sq_a"])
+    norm_diff = math.sqrt(acc["sq_diff"])
+    denom = math.sqrt(acc["sq_a"] * acc["sq_b"])
+    return {
+        "identical": False,
+        "max_abs": acc["max_abs"],
+        "rel_l2": norm_diff / norm_a if norm_a else math.inf,
+        "cosine": acc["dot"] / denom if denom else None,
+    }
+
+
+# 按块并行比较 (name, (a_layout, a_info), (b_layout, b_info)) 列表中的张量；
+# 所有张量的块共用一个有界的提交窗口，内存占用与模型大小无关。
+# progress(done_bytes, total_bytes) 可抛出异常取消
+def compare_tensors(pairs, chunk_size=DIFF_CHUNK_SIZE, workers=None, progress=None):
+    results = {}
+    accumulators = {}
+    jobs = []
+    for name, (a_layout, a_info), (b_layout, b_info) in pairs:
+        size = a_info["size"]
+        if size == 0 or _same_storage(a_layout, a_info, b_layout, b_info):
+            results[name] = _finish({"identical": True})
+            continue
+        itemsize = safetensors_io.DTYPE_SIZES[a_info["dtype"]]
+        step = max(itemsize, chunk_size - chunk_size % itemsize)
+        a_start = a_layout.data_start + a_info["offsets"][0]
+        b_start = b_layout.data_start + b_info["offsets"][0]
+        starts = range(0, size, step)
+        accumulators[name] = {"pending": len(starts), "identical": True, "max_abs": 0.0,
+                              "sq_a": 0.0, "sq_b": 0.0, "dot": 0.0, "sq_diff": 0.0}
+        for start in starts:
+            length = min(step, size - start)
+            jobs.append((name, a_info["dtype"], a_layout.path, a_start + start,
+                         b_layout.path, b_start + start, length))
+    if not jobs:
+        return results
+
+    paths = {job[2] for job in jobs} | {job[4] for job in jobs}
+    fds = {}
+    try:
+        for path in paths:
+            fds[path] = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+        def work(job):
+            name, dtype, a_path, a_offset, b_path, b_offset, length = job
+            a_raw = os.pread(fds[a_path], length, a_offset)
+            b_raw = os.pread(fds[b_path], length, b_offset)
+            if len(a_raw) != length or len(b_raw) != length:
+                raise ValueError(f"Tensor '{name}' data is truncated")
+            return chunk_diff(a_raw, b_raw, dtype)
+
+        total = sum(job[6] for job in jobs)
+        done = 0
+        workers = workers or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+            pending = {}
+            queue = iter(jobs)
+            try:
+                for job in queue:
+                    pending[executor.submit(work, job)] = job
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    future = next(as_completed(pending))
+                    job = pending.pop(future)
+                    part = future.result()
+                    acc = accumulators[job[0]]
+                    acc["identical"] = acc["identical"] and part["identical"]
+                    acc["max_abs"] = max(acc["max_abs"], part["max_abs"])
+                    for key in ("sq_a", "sq_b", "dot", "sq_diff"):
+                        acc[key] += part[key]
+                    acc["pending"] -= 1
+                    if acc["pending"] == 0:
+                        results[job[0]] = _finish(accumulators.pop(job[0]))
+                    done += job[6]
+                    if progress is not None:
+                        progress(done, total)
+                    for job in queue:
+                        pending[executor.submit(work, job)] = job
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+    return results
+
+
+def has_changes(result):
+    values = result.get("values", {})
+    return bool(result["added"] or result["removed"] or result["changed"]
+                or any(not value["identical"] for value in values.values()))
+
+
+def format_diff(result):
+    lines = []
+    for name in result["added"]:
+        lines.append(f"+ {name}")
+    for name in result["removed"]:
+        lines.append(f"- {name}")
+    for name, (a_dtype, a_shape), (b_dtype, b_shape) in result["changed"]:
+        lines.append(f"~ {name}: {a_dtype}{a_shape} -> {b_dtype}{b_shape}")
+
+    values = result.get("values")
+    modified = 0
+    if values is not None:
+        # 按相对变化从大到小列出数值不同的张量
+        different = [(name, value) for name, value in values.items() if not value["identical"]]
+        different.sort(key=lambda item: -item[1]["rel_l2"])
+        modified = len(different)
+        for name, value in different:
+            cosine = "n/a" if value["cosine"] is None else f"{value['cosine']:.6f}"
+            lines.append(f"* {name}: max_abs={value['max_abs']:.6g} "
+                         f"rel_l2={value['rel_l2']:.6g} cosine={cosine}")
+
+    summary = (f"{len(result['added'])} added, {len(result['removed'])} removed, "
+               f"{len(result['changed'])} changed")
+    if values is not None:
+        summary += f", {modified} modified, {len(values) - modified} identical"
+    else:
+        summary += f", {len(result['common'])} with same dtype and shape"
+    lines.append(summary)
+    return "\n".join(lines)
@@ -0,0 +1,354 @@
+import gc
+
+import numpy as np
+
+import tracing
+
+# 连续的编号子模块（layers.0 … layers.N）结构相同且至少有这么多个时折叠成一组
+REPEAT_MIN = 3
+
+
+# 所有模块的统计量：每个模块一行，依次为参数数、各 dtype 的张量数、各 dtype 的字节数，
+# 已包含子模块；dtype 只取树中出现过的几种。另外记录模块的编号和上级，修改少数张量时局部更新（见 update_module_tree）
+class ModuleStats:
+    def __init__(self, dtype_names, values):
+        self.dtype_names = dtype_names
+        self.values = values
+        # 完整路径 -> 模块编号；编号 -> ModuleNode / 上级编号（根为 -1）/ 深度
+        self.ids = {}
+        self.modules = []
+        self.parents = []
+        self.depths = []
+        # 张量表行号 -> 所在模块的编号（-1 表示不在树中），搜索时按行号过滤（见 ModuleFilter）
+        self.owners = None
+        self._levels = None
+
+    # 按深度分组的 (模块编号, 上级编号) 数组，从最深的一层开始；增加模块后重新计算
+    def levels(self):
+        if self._levels is None:
+            parents = np.asarray(self.parents, dtype=np.int64)
+            depths = np.asarray(self.depths, dtype=np.int64)
+            order = np.argsort(depths, kind="stable")[::-1]
+            splits = np.flatnonzero(np.diff(depths[order])) + 1
+            self._levels = [(level, parents[level]) for level in np.split(order, splits) if depths[level[0]] > 0]
+        return self._levels
+
+    def totals(self, number):
+        width = len(self.dtype_names)
+        row = self.values[number].tolist()
+        return row[0], row[1:1 + width], row[1 + width:]
+
+
+# 模块树的节点：按名字中的点逐级嵌套，统计量在构建时一次算好放在 ModuleStats 中，点击时直接读取
+class ModuleNode:
+    __slots__ = ("name", "path", "entries", "number", "stats", "_signature")
+
+    def __init__(self, name, path, number, stats):
+        self.name = name
+        self.path = path
+        # (name, ModuleNode) 或 (name, 张量表行号)，按首次出现的顺序
+        self.entries = []
+        self.number = number
+        self.stats = stats
+        self._signature = None
+
+    @property
+    def tensors(self):
+        return sum(self.stats.totals(self.number)[1])
+
+    @property
+    def params(self):
+        return self.stats.totals(self.number)[0]
+
+    @property
+    def bytes(self):
+        return sum(self.stats.totals(self.number)[2])
+
+    # dtype -> [张量数, 字节数]
+    @property
+    def dtypes(self):
+        _, counts, sizes = self.stats.totals(self.number)
+        return {dtype: [count, size] for dtype, count, size in zip(self.stats.dtype_names, counts, sizes) if count}
+
+    def signature(self, table):
+        # 子树的结构（相对名字、dtype、形状），用于识别重复块
+        if self._signature is None:
+            keys = table.shape_keys()
+            parts = []
+            for name, item in self.entries:
+                if isinstance(item, ModuleNode):
+                    parts.append((name, item.signature(table)))
+                else:
+                    parts.append((name, keys[item]))
+            self._signature = hash(tuple(parts))
+        return self._signature
+
+
+# 折叠后的一组重复块，统计量为各块之和
+class RepeatGroup:
+    __slots__ = ("name", "path", "members", "tensors", "params", "bytes", "dtypes")
+
+    def __init__(self, parent, members):
+        self.name = f"{members[0].name}..{members[-1].name} (x{len(members)})"
+        self.path = f"{parent.path}.{self.name}" if parent.path else self.name
+        self.members = members
+        self.tensors = sum(member.tensors for member in members)
+        self.params = sum(member.params for member in members)
+        self.bytes = sum(member.bytes for member in members)
+        self.dtypes = {}
+        for member in members:
+            for dtype, (count, size) in member.dtypes.items():
+                counts = self.dtypes.setdefault(dtype, [0, 0])
+                counts[0] += count
+                counts[1] += size
+
+    @property
+    def entries(self):
+        return [(member.name, member) for member in self.members]
+
+
+# 一次遍历张量表构建模块树；统计量先按所在模块和 dtype 在 numpy 数组上求和，再按深度逐层加到上级模块。
+# 待删除的张量保留在树中，但不计入统计
+def build_module_tree(table):
+    stats = ModuleStats([], None)
+    root = ModuleNode("", "", 0, stats)
+    # 模块以完整前缀为键，查找时不必逐级比较；新前缀向上找到已有的模块，再依次创建缺少的各级
+    ids = stats.ids
+    ids[""] = 0
+    modules = stats.modules
+    modules.append(root)
+    stats.parents.append(-1)
+    stats.depths.append(0)
+
+    with tracing.span("tree_build", "model", tensors=len(table)):
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            owners = np.empty(len(table), dtype=np.int64)
+            for row, name in enumerate(table.names):
+                prefix, _, leaf = name.rpartition(".")
+                number = ids.get(prefix)
+                if number is None:
+                    number = _create_module(stats, prefix)
+                modules[number].entries.append((leaf, row))
+                owners[row] = number
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        stats.owners = owners
+        stats.dtype_names, stats.values = _module_values(stats, table, np.arange(len(table), dtype=np.int64))
+    return root
+
+
+# rows 中的张量按所在模块和 dtype 求和，再逐层加到上级模块；待删除的张量不计入。
+# 返回 (dtype 名字, 统计量矩阵)
+def _module_values(stats, table, rows):
+    deleted = [row for row, info in table.edits.items() if "deleted" in info["status"]]
+    if deleted:
+        rows = rows[~np.isin(rows, deleted)]
+    owners = stats.owners[rows]
+    codes, local = np.unique(table.dtype_codes[rows], return_inverse=True)
+    width = len(codes)
+    values = np.zeros((len(stats.modules), 1 + 2 * width), dtype=np.int64)
+    np.add.at(values[:, 0], owners, table.numels[rows])
+    np.add.at(values, (owners, 1 + local), 1)
+    np.add.at(values, (owners, 1 + width + local), table.sizes[rows])
+    _propagate(stats, values)
+    return [table.dtype_names[code] for code in codes.tolist()], values
+
+
+# 从最深的模块开始，每一层整体加到上级模块
+def _propagate(stats, values):
+    for level, parents in stats.levels():
+        np.add.at(values, parents, values[level])
+
+
+# 搜索结果在完整模块树上的过滤：只显示包含匹配张量的模块，统计量只计匹配的张量。
+# 可见性和统计量在 numpy 数组上一次算好，不再为每次查询构建一棵树；各模块的子项在展开时才按过滤条件列出
+class ModuleFilter:
+    def __init__(self, root, table, rows):
+        stats = root.stats
+        rows = np.asarray(rows, dtype=np.int64)
+        with tracing.span("tree_filter", "model", tensors=len(rows)):
+            # 展开时逐个子项检查，集合比逐个取 numpy 数组元素快
+            self.matched = set(rows.tolist())
+            # 待删除的张量也能被搜到，可见性按全部匹配的行计算
+            hits = np.bincount(stats.owners[rows], minlength=len(stats.modules))[:, None]
+            _propagate(stats, hits)
+            self.visible = set(np.flatnonzero(hits[:, 0]).tolist())
+            self.stats = ModuleStats(*_module_values(stats, table, rows))
+            self.root = FilteredModule(root, self)
+
+    def entries(self, module):
+        entries = []
+        for name, item in module.entries:
+            if isinstance(item, ModuleNode):
+                if item.number in self.visible:
+                    entries.append((name, FilteredModule(item, self)))
+            elif item in self.matched:
+                entries.append((name, item))
+        return entries
+
+
+# 过滤后的模块：名字、路径和编号与原来的模块相同，统计量取自过滤结果，子项第一次用到时才列出
+class FilteredModule(ModuleNode):
+    __slots__ = ("source", "filter", "_entries")
+
+    def __init__(self, source, module_filter):
+        self.name = source.name
+        self.path = source.path
+        self.number = source.number
+        self.stats = module_filter.stats
+        self._signature = None
+        self.source = source
+        self.filter = module_filter
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self.filter.entries(self.source)
+        return self._entries
+
+
+# 张量表中少数行变化后（见 TensorTable.changed_rows）在原来的树上更新：这些行从旧名字所在的模块移除，
+# 按新名字放回，统计量只在沿途的模块上增减，不再遍历整个张量表。清空的模块从树中去掉；
+# 返回受影响的模块路径（包括各级上级）
+def update_module_tree(root, old_table, new_table, rows):
+    stats = root.stats
+    touched = set()
+    with tracing.span("tree_update", "model", rows=len(rows)):
+        for row in rows:
+            if row < len(old_table):
+                _remove_row(stats, old_table, row, touched)
+            if row < len(new_table):
+                _insert_row(stats, new_table, row, touched)
+        for number in touched:
+            stats.modules[number]._signature = None
+    return {stats.modules[number].path for number in touched}
+
+
+def _ancestors(stats, number):
+    while number != -1:
+        yield number
+        number = stats.parents[number]
+
+
+# 一行对统计量的贡献：参数数、所在 dtype 的张量数和字节数；待删除的张量不计入
+def _contribution(stats, table, row):
+    if "deleted" in table.status(row):
+        return None
+    dtype = table.dtype(row)
+    if dtype not in stats.dtype_names:
+        # 新出现的 dtype：张量数和字节数各加一列
+        width = len(stats.dtype_names)
+        values = stats.values
+        stats.values = np.concatenate([values[:, :1 + width], np.zeros((len(values), 1), np.int64),
+                                       values[:, 1 + width:], np.zeros((len(values), 1), np.int64)], axis=1)
+        stats.dtype_names.append(dtype)
+    width = len(stats.dtype_names)
+    column = stats.dtype_names.index(dtype)
+    vector = np.zeros(1 + 2 * width, dtype=np.int64)
+    vector[0] = table.numels[row]
+    vector[1 + column] = 1
+    vector[1 + width + column] = table.sizes[row]
+    return vector
+
+
+def _remove_row(stats, table, row, touched):
+    prefix, _, leaf = table.names[row].rpartition(".")
+    number = stats.ids[prefix]
+    node = stats.modules[number]
+    node.entries.remove((leaf, row))
+    stats.owners[row] = -1
+    upward = list(_ancestors(stats, number))
+    touched.update(upward)
+    vector = _contribution(stats, table, row)
+    if vector is not None:
+        stats.values[upward] -= vector
+    # 清空的模块逐级从上级中去掉
+    while not node.entries and number != 0:
+        del stats.ids[node.path]
+        number = stats.parents[number]
+        stats.modules[number].entries.remove((node.name, node))
+        node = stats.modules[number]
+
+
+def _insert_row(stats, table, row, touched):
+    prefix, _, leaf = table.names[row].rpartition(".")
+    number = stats.ids.get(prefix)
+    if number is None:
+        number = _create_module(stats, prefix)
+    entries = stats.modules[number].entries
+    # 与整体构建时一致：张量按行号排在其他张量之间，行号最大的排在最后
+    position = next((i for i, (_, item) in enumerate(entries) if isinstance(item, int) and item > row),
+                    len(entries))
+    entries.insert(position, (leaf, row))
+    if row >= len(stats.owners):
+        stats.owners = np.concatenate([stats.owners, np.full(row + 1 - len(stats.owners), -1, np.int64)])
+    stats.owners[row] = number
+    upward = list(_ancestors(stats, number))
+    touched.update(upward)
+    vector = _contribution(stats, table, row)
+    if vector is not None:
+        stats.values[upward] += vector
+
+
+def _create_module(stats, prefix):
+    missing = []
+    parent = None
+    while parent is None:
+        missing.append(prefix)
+        prefix = prefix.rpartition(".")[0]
+        parent = stats.ids.get(prefix)
+    for path in reversed(missing):
+        name = path.rpartition(".")[2]
+        number = stats.ids[path] = len(stats.modules)
+        node = ModuleNode(name, path, number, stats)
+        stats.modules.append(node)
+        stats.parents.append(parent)
+        stats.depths.append(stats.depths[parent] + 1)
+        stats._levels = None
+        stats.modules[parent].entries.append((name, node))
+        parent = number
+    if stats.values is not None:
+        stats.values = np.concatenate([stats.values, np.zeros((len(missing), stats.values.shape[1]), np.int64)])
+    return parent
+
+
+def _is_block(name, item):
+    return isinstance(item, ModuleNode) and name.isdigit()
+
+
+# 节点在树中显示的子项：编号子模块按数字排序，结构相同的连续编号合并为 RepeatGroup
+def display_entries(node, table):
+    if isinstance(node, RepeatGroup):
+        return node.entries
+    blocks = sorted(((int(name), item) for name, item in node.entries if _is_block(name, item)),
+                    key=lambda block: block[0])
+    grouped = []
+    run = []
+    for number, item in blocks:
+        if run and (number != run[-1][0] + 1 or item.signature(table) != run[0][1].signature(table)):
+            grouped.extend(_collapse(node, run))
+            run = []
+        run.append((number, item))
+    grouped.extend(_collapse(node, run))
+
+    # 编号子模块整体放在第一个编号子模块原来的位置
+    entries = []
+    for name, item in node.entries:
+        if _is_block(name, item):
+            entries.extend(grouped)
+            grouped = []
+        else:
+            entries.append((name, item))
+    return entries
+
+
+def _collapse(parent, run):
+    if len(run) >= REPEAT_MIN:
+        group = RepeatGroup(parent, [item for _, item in run])
+        return [(group.name, group)]
+    return [(item.name, item) for _, item in run]
@@ -0,0 +1,86 @@
+import os
+
+import safetensors_io
+import shards
+
+# 分片文件名与 transformers 的命名保持一致
+SHARD_NAME = "{prefix}-{index:05d}-of-{count:05d}.safetensors"
+DEFAULT_MAX_SHARD_SIZE = 5 * 1024 ** 3
+
+
+# 按数据区顺序列出所有张量的拷贝条目（见 safetensors_io.write_file），读取是顺序的
+def _copy_entries(model):
+    entries = []
+    for path, layout in model.layouts.items():
+        columns = layout.tensors
+        for row in columns.sorted_rows():
+            info = columns.info(row)
+            entries.append((columns.names[row], info["dtype"], info["shape"],
+                            (path, layout.data_start + info["offsets"][0])))
+    return entries
+
+
+def _file_metadata(model):
+    # 分片模型的索引元数据（total_size 等）不属于单个文件
+    return dict(next(iter(model.layouts.values())).metadata)
+
+
+def _check_output(model, out_path):
+    for path in model.layouts:
+        if os.path.exists(out_path) and os.path.samefile(path, out_path):
+            raise ValueError(f"Output {out_path} would overwrite a source file")
+
+
+# 按最大分片大小依次装箱，超过上限的单个张量独占一个分片
+def plan_shards(entries, max_shard_size):
+    groups = [[]]
+    size = 0
+    for entry in entries:
+        nbytes = safetensors_io.tensor_nbytes(entry[1], entry[2])
+        if groups[-1] and size + nbytes > max_shard_size:
+            groups.append([])
+            size = 0
+        groups[-1].append(entry)
+        size += nbytes
+    return groups
+
+
+def _progress_offset(progress, base, total):
+    if progress is None:
+        return None
+    return lambda done, _: progress(base + done, total)
+
+
+# 把单文件或分片模型重新切分到 out_dir，数据用 copy_file_range 直接在文件之间拷贝，不经过解码
+def reshard(model, out_dir, max_shard_size=DEFAULT_MAX_SHARD_SIZE, prefix="model", progress=None):
+    entries = _copy_entries(model)
+    groups = plan_shards(entries, max_shard_size)
+    metadata = _file_metadata(model)
+    os.makedirs(out_dir, exist_ok=True)
+
+    paths = [os.path.join(out_dir, SHARD_NAME.format(prefix=prefix, index=i + 1, count=len(groups)))
+             for i in range(len(groups))]
+    for path in paths:
+        _check_output(model, path)
+
+    total = sum(safetensors_io.tensor_nbytes(entry[1], entry[2]) for entry in entries)
+    layouts = {}
+    done = 0
+    for path, group in zip(paths, groups):
+        layouts[path] = safetensors_io.write_file(path, metadata, group,
+                                                  progress=_progress_offset(progress, done, total))
+        done += layouts[path].data_size
+
+    index_path = os.path.join(out_dir, prefix + shards.INDEX_SUFFIX)
+    # 原来就是分片模型时保留索引中的其它元数据
+    shards.write_index(index_path, layouts, model.metadata if model.sharded is not None else None)
+    return index_path, layouts
+
+
+# 把分片模型合并成一个文件
+def merge(model, out_path, progress=None):
+    _check_output(model, out_path)
+    entries = _copy_entries(model)
+    total = sum(safetensors_io.tensor_nbytes(entry[1], entry[2]) for entry in entries)
+    return safetensors_io.write_file(out_path, _file_metadata(model), entries,
+                                     progress=_progress_offset(progress, 0, total))
@@ -0,0 +1,633 @@
+import json
+import os
+import shutil
+import struct
+from collections.abc import Mapping
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+import tracing
+
+# 流式拷贝的块大小，内存占用与模型大小无关
+COPY_BLOCK_SIZE = 16 * 1024 * 1024
+
+# 头部按 8 字节对齐，不足部分用空格填充（safetensors 规范允许）
+HEADER_ALIGN = 8
+
+# 重写文件时在头部预留的空白，之后追加张量或改名时无需移动数据区
+HEADER_RESERVE = 64 * 1024
+
+INITIALIZERS = ["zeros", "ones", "constant", "normal", "uniform"]
+
+DTYPE_SIZES = {
+    "BOOL": 1,
+    "U8": 1,
+    "I8": 1,
+    "F8_E4M3": 1,
+    "F8_E5M2": 1,
+    "U16": 2,
+    "I16": 2,
+    "F16": 2,
+    "BF16": 2,
+    "U32": 4,
+    "I32": 4,
+    "F32": 4,
+    "U64": 8,
+    "I64": 8,
+    "F64": 8,
+}
+
+# numpy 没有 BF16/F8，这两类在内存中用 float32 表示，读写时再做编解码
+NUMPY_DTYPES = {
+    "BOOL": np.bool_,
+    "U8": np.uint8,
+    "I8": np.int8,
+    "U16": np.uint16,
+    "I16": np.int16,
+    "F16": np.float16,
+    "U32": np.uint32,
+    "I32": np.int32,
+    "F32": np.float32,
+    "U64": np.uint64,
+    "I64": np.int64,
+    "F64": np.float64,
+}
+
+JOURNAL_MAGIC = b"STJ1"
+JOURNAL_END = b"END!"
+
+# 遍历张量表时每次转换成 Python 对象的行数，临时对象的数量与张量数无关
+ITER_BLOCK_ROWS = 65536
+
+
+# 每一维都必须是非负整数，负数会得到负的字节数
+def check_shape(shape):
+    for dim in shape:
+        if isinstance(dim, bool) or not isinstance(dim, (int, np.integer)) or dim < 0:
+            raise ValueError(f"Invalid shape {list(shape)}: dimensions must be non-negative integers")
+
+
+def tensor_nbytes(dtype, shape):
+    check_shape(shape)
+    numel = 1
+    for dim in shape:
+        numel *= dim
+    return numel * DTYPE_SIZES[dtype]
+
+
+def numpy_dtype(dtype):
+    return NUMPY_DTYPES.get(dtype, np.float32)
+
+
+def _f8_table(exp_bits, man_bits, bias, finite_only):
+    # 枚举全部 256 个编码得到对应的 float32 值
+    codes = np.arange(256, dtype=np.uint32)
+    sign = np.where(codes & 0x80, -1.0, 1.0)
+    exp = (codes >> man_bits) & ((1 << exp_bits) - 1)
+    man = codes & ((1 << man_bits) - 1)
+    normal = (1.0 + man / (1 << man_bits)) * np.exp2(exp.astype(np.float64) - bias)
+    subnormal = (man / (1 << man_bits)) * np.exp2(1.0 - bias)
+    values = sign * np.where(exp == 0, subnormal, normal)
+    max_exp = (1 << exp_bits) - 1
+    if finite_only:
+        # E4M3FN：只有 S.1111.111 表示 NaN，没有 Inf
+        values[(exp == max_exp) & (man == (1 << man_bits) - 1)] = np.nan
+    else:
+        values[(exp == max_exp) & (man == 0)] = sign[(exp == max_exp) & (man == 0)] * np.inf
+        values[(exp == max_exp) & (man != 0)] = np.nan
+    return values.astype(np.float32)
+
+
+F8_TABLES = {
+    "F8_E4M3": _f8_table(4, 3, 7, True),
+    "F8_E5M2": _f8_table(5, 2, 15, False),
+}
+
+
+def encode_array(values, dtype):
+    # 把数组转换为磁盘上的 dtype 并返回小端字节
+    values = np.asarray(values)
+    if dtype == "BF16":
+        # 四舍五入到最近偶数后截取 float32 的高 16 位
+        bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+        rounded = bits + 0x7FFF + ((bits >> 16) & 1)
+        rounded = np.where(np.isnan(values.astype(np.float32)), bits | 0x00400000, rounded)
+        return (rounded >> 16).astype("<u2").tobytes()
+    if dtype in F8_TABLES:
+        table = F8_TABLES[dtype]
+        finite = np.flatnonzero(np.isfinite(table))
+        order = finite[np.argsort(table[finite], kind="stable")]
+        flat = values.astype(np.float32).ravel()
+        # 超出范围的值饱和到最大有限值，再在有限值中取最近的编码
+        sorted_values = table[order]
+        clipped = np.clip(flat, sorted_values[0], sorted_values[-1])
+        idx = np.clip(np.searchsorted(sorted_values, clipped), 1, len(order) - 1)
+        lower = sorted_values[idx - 1]
+        upper = sorted_values[idx]
+        codes = np.where(clipped - lower <= upper - clipped, order[idx - 1], order[idx])
+        codes = np.where(np.isnan(flat), np.flatnonzero(np.isnan(table))[0], codes)
+        inf_codes = np.flatnonzero(np.isinf(table))
+        if len(inf_codes):
+            codes = np.where(flat == np.inf, inf_codes[table[inf_codes] > 0][0], codes)
+            codes = np.where(flat == -np.inf, inf_codes[table[inf_codes] < 0][0], codes)
+        return codes.astype(np.uint8).tobytes()
+    return np.ascontiguousarray(values, dtype=np.dtype(NUMPY_DTYPES[dtype]).newbyteorder("<")).tobytes()
+
+
+# 磁盘上的存储类型：BF16/F8 先按无符号整数读取，再用 decode_raw 解码
+def storage_dtype(dtype):
+    if dtype == "BF16":
+        return np.dtype("<u2")
+    if dtype in F8_TABLES:
+        return np.dtype(np.uint8)
+    return np.dtype(NUMPY_DTYPES[dtype]).newbyteorder("<")
+
+
+def decode_raw(raw, dtype):
+    if dtype == "BF16":
+        # 直接把 BF16 写到 float32 的高 16 位，比先转 uint32 再移位少一遍整数运算
+        out = np.zeros(np.shape(raw) + (2,), dtype=np.uint16)
+        out[..., 1] = raw
+        return out.view(np.float32)[..., 0]
+    if dtype in F8_TABLES:
+        return F8_TABLES[dtype][raw]
+    return raw
+
+
+# 把磁盘上的小端字节解码为 numpy 数组，BF16/F8 解码为 float32
+def decode_array(buf, dtype, shape=None):
+    values = decode_raw(np.frombuffer(buf, dtype=storage_dtype(dtype)), dtype)
+    if shape is not None:
+        values = values.reshape(shape)
+    return values
+
+
+# 把张量映射为存储类型的只读 memmap，不读取任何数据
+def map_tensor(path, data_start, info):
+    dtype = storage_dtype(info["dtype"])
+    shape = tuple(info["shape"])
+    if info["size"] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=data_start + info["offsets"][0], shape=shape)
+
+
+def parse_slice(text, ndim):
+    # 解析 numpy 风格的切片，例如 "3, :, 0:100"
+    text = text.strip()
+    if not text:
+        return ()
+    index = []
+    for part in text.split(","):
+        part = part.strip()
+        if part in ("", ":"):
+            index.append(slice(None))
+        elif ":" in part:
+            bounds = [int(p) if p.strip() else None for p in part.split(":")]
+            index.append(slice(*bounds))
+        else:
+            index.append(int(part))
+    if len(index) > ndim:
+        raise ValueError(f"Too many indices for a {ndim}-d tensor")
+    return tuple(index)
+
+
+# 只读取并解码窗口内的数据，内存占用与窗口大小成正比
+def read_window(mapped, dtype, index):
+    return decode_raw(np.ascontiguousarray(mapped[index]), dtype)
+
+
+def read_tensor(layout, name, info=None):
+    if info is None:
+        info = layout.tensors[name]
+    with tracing.span("tensor_read", nbytes=info["size"], tensor=name):
+        with open(layout.path, "rb") as f:
+            f.seek(layout.data_start + info["offsets"][0])
+            buf = f.read(info["size"])
+    return decode_array(buf, info["dtype"], info["shape"])
+
+
+# 单个文件的张量表，按列保存：名字列表、dtype 编号、维数、所有形状拼成的一维数组和数据偏移，
+# 每个张量不再单独保留一个字典。按只读字典使用：name -> {"dtype", "shape", "size", "offsets"}，
+# 字典在取用时才生成；名字到行号的索引在第一次按名字查找时才建立
+class TensorColumns(Mapping):
+    def __init__(self, names, dtype_names, dtype_codes, ndims, dims, offsets):
+        self.names = names
+        # dtype 编号对应的名字，头部中的未知 dtype 追加在 DTYPE_SIZES 之后
+        self.dtype_names = dtype_names
+        self.dtype_codes = dtype_codes
+        self.ndims = ndims
+        self.dims = dims
+        self.dim_starts = np.cumsum(ndims, dtype=np.int64) - ndims
+        self.offsets = offsets
+        self.sizes = offsets[:, 1] - offsets[:, 0]
+        self._index = None
+
+    # tensors 为 name -> 含 dtype、shape 和 offsets_key 的字典（解析后的 JSON 头部或提交时生成的条目）
+    @classmethod
+    def from_infos(cls, tensors, offsets_key="offsets"):
+        names = list(tensors)
+        count = len(names)
+        dtype_names = list(DTYPE_SIZES)
+        # 逐列取出再整体转换，比逐个张量构造数组快得多
+        try:
+            infos = list(tensors.values())
+            dtypes = list(map(itemgetter("dtype"), infos))
+            shapes = list(map(itemgetter("shape"), infos))
+            pairs = list(map(itemgetter(offsets_key), infos))
+            codes = {dtype: code for code, dtype in enumerate(dtype_names)}
+            for dtype in sorted(set(dtypes) - codes.keys(), key=str):
+                codes[dtype] = len(dtype_names)
+                dtype_names.append(dtype)
+            dtype_codes = np.fromiter(map(codes.__getitem__, dtypes), dtype=np.uint8, count=count)
+            ndims = np.fromiter(map(len, shapes), dtype=np.uint8, count=count)
+            dims = np.fromiter(chain.from_iterable(shapes), dtype=np.int64, count=int(ndims.sum()))
+            if np.any(np.fromiter(map(len, pairs), dtype=np.int64, count=count) != 2):
+                raise ValueError("data_offsets must have two entries")
+            offsets = np.fromiter(chain.from_iterable(pairs), dtype=np.int64, count=count * 2).reshape(count, 2)
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            raise ValueError("Malformed data_offsets or shape in the header") from e
+        return cls(names, dtype_names, dtype_codes, ndims, dims, offsets)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = dict(zip(self.names, range(len(self.names))))
+        return self._index
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return self.info(self.index[name])
+
+    def get(self, name, default=None):
+        row = self.index.get(name)
+        return self.info(row) if row is not None else default
+
+    def info(self, row):
+        start = self.dim_starts[row]
+        return {"dtype": self.dtype_names[self.dtype_codes[row]],
+                "shape": self.dims[start:start + self.ndims[row]].tolist(),
+                "size": int(self.sizes[row]), "offsets": self.offsets[row].tolist()}
+
+    # 按行顺序逐块生成字典，不一次性为所有张量创建对象
+    def values(self):
+        dtype_names = self.dtype_names
+        for start in range(0, len(self), ITER_BLOCK_ROWS):
+            end = min(start + ITER_BLOCK_ROWS, len(self))
+            ndims = self.ndims[start:end].tolist()
+            dim_start = int(self.dim_starts[start])
+            dims = self.dims[dim_start:dim_start + sum(ndims)].tolist()
+            pos = 0
+            for code, ndim, pair in zip(self.dtype_codes[start:end].tolist(), ndims,
+                                        self.offsets[start:end].tolist()):
+                yield {"dtype": dtype_names[code], "shape": dims[pos:pos + ndim],
+                       "size": pair[1] - pair[0], "offsets": pair}
+                pos += ndim
+
+    def items(self):
+        return zip(self.names, self.values())
+
+    @property
+    def data_size(self):
+        return int(self.offsets[:, 1].max()) if len(self) else 0
+
+    # 按数据偏移排序的行号和名字
+    def sorted_rows(self):
+        return np.argsort(self.offsets[:, 0], kind="stable").tolist()
+
+    def sorted_names(self):
+        return [self.names[row] for row in self.sorted_rows()]
+
+
+# safetensors 文件的原始布局：8 字节长度 + JSON 头 + 数据区
+class SafetensorsLayout:
+    def __init__(self, path, header_size, metadata, tensors):
+        self.path = path
+        self.header_size = header_size
+        self.metadata = metadata
+        # 张量表（TensorColumns）；给出 name -> {"dtype", "shape", "size", "offsets"} 的字典时转换成列
+        self.tensors = tensors if isinstance(tensors, TensorColumns) else TensorColumns.from_infos(tensors)
+
+    @property
+    def data_start(self):
+        return 8 + self.header_size
+
+    @property
+    def data_size(self):
+        return self.tensors.data_size
+
+    def sorted_names(self):
+        return self.tensors.sorted_names()
+
+
+def read_layout(path):
+    with tracing.span("header_read", path=path) as span:
+        with open(path, "rb") as f:
+            length_bytes = f.read(8)
+            if len(length_bytes) != 8:
+                raise ValueError("File too small to be a safetensors file")
+            header_size = struct.unpack("<Q", length_bytes)[0]
+            header_bytes = f.read(header_size)
+            if len(header_bytes) != header_size:
+                raise ValueError("Header is truncated")
+        span.nbytes = 8 + header_size
+
+    with tracing.span("json_decode", nbytes=header_size, path=path) as span:
+        header = json.loads(header_bytes.decode("utf-8"))
+        metadata = header.pop("__metadata__", {}) or {}
+        # 解析出的字典只在转换成列时使用，之后即可释放
+        tensors = TensorColumns.from_infos(header, "data_offsets")
+        span.annotate(tensors=len(tensors))
+    return SafetensorsLayout(path, header_size, metadata, tensors)
+
+
+def build_header(metadata, tensors, min_size=0):
+    # 按数据偏移顺序写出，和 safetensors 自身的输出保持一致
+    header = {}
+    if metadata:
+        header["__metadata__"] = metadata
+    for name in sorted(tensors, key=lambda n: tensors[n]["offsets"][0]):
+        info = tensors[name]
+        header[name] = {
+            "dtype": info["dtype"],
+            "shape": list(info["shape"]),
+            "data_offsets": list(info["offsets"]),
+        }
+
+    with tracing.span("json_encode", tensors=len(tensors)) as span:
+        header_bytes = json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        span.nbytes = len(header_bytes)
+    size = max(len(header_bytes), min_size)
+    size += -size % HEADER_ALIGN
+    return header_bytes + b" " * (size - len(header_bytes))
+
+
+def copy_range(src_fd, src_offset, dst_fd, dst_offset, length):
+    # 优先使用内核态拷贝（copy_file_range），不支持时退回固定大小的块拷贝
+    if hasattr(os, "copy_file_range"):
+        try:
+            while length > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, min(length, 1 << 30),
+                                            src_offset, dst_offset)
+                if copied == 0:
+                    break
+                src_offset += copied
+                dst_offset += copied
+                length -= copied
+        except OSError:
+            pass
+
+    while length > 0:
+        block = os.pread(src_fd, min(length, COPY_BLOCK_SIZE), src_offset)
+        if not block:
+            raise ValueError("Unexpected end of file while copying tensor data")
+        os.pwrite(dst_fd, block, dst_offset)
+        src_offset += len(block)
+        dst_offset += len(block)
+        length -= len(block)
+
+
+# 按新的头部把保留的张量流式写入临时文件，再原子替换原文件
+# tensors 中的 offsets 指向原文件数据区，写出时重新紧凑排列；
+# 带 "data" 的条目直接写入给定的字节，带 "chunks" 的条目逐块写入生成的数据
+def rewrite_file(layout, tensors, metadata=None, reserve=None, progress=None):
+    if metadata is None:
+        metadata = layout.metadata
+
+    # 重新紧凑排列数据区
+    new_tensors = {}
+    sources = []
+    offset = 0
+    for name in sorted(tensors, key=lambda n: tensors[n]["offsets"][0]):
+        info = tensors[name]
+        source = info.get("data")
+        if source is not None:
+            size = len(source)
+        elif info.get("chunks") is not None:
+            source = info["chunks"]
+            size = tensor_nbytes(info["dtype"], info["shape"])
+        else:
+            source = info["offsets"][0]
+            size = info["offsets"][1] - info["offsets"][0]
+        new_tensors[name] = {
+            "dtype": info["dtype"],
+            "shape": info["shape"],
+            "size": size,
+            "offsets": [offset, offset + size],
+        }
+        sources.append((source, offset, size))
+        offset += size
+
+    if reserve is None:
+        reserve = max(HEADER_RESERVE, layout.header_size // 4)
+    header_bytes = build_header(metadata, new_tensors)
+    header_bytes = build_header(metadata, new_tensors, len(header_bytes) + reserve)
+    data_start = 8 + len(header_bytes)
+
+    with tracing.span("rewrite", nbytes=offset, path=layout.path, tensors=len(new_tensors)):
+        tmp_path = layout.path + ".tmp"
+        src_fd = os.open(layout.path, os.O_RDONLY)
+        try:
+            dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.pwrite(dst_fd, struct.pack("<Q", len(header_bytes)) + header_bytes, 0)
+                done = 0
+                for source, dst_offset, size in sources:
+                    if isinstance(source, int):
+                        copy_range(src_fd, layout.data_start + source,
+                                   dst_fd, data_start + dst_offset, size)
+                    elif isinstance(source, bytes):
+                        os.pwrite(dst_fd, source, data_start + dst_offset)
+                    else:
+                        for chunk in source:
+                            os.pwrite(dst_fd, chunk, data_start + dst_offset)
+                            dst_offset += len(chunk)
+                    done += size
+                    # progress 可以抛出异常来取消，临时文件会被删除，原文件保持不变
+                    if progress is not None:
+                        progress(done, offset)
+                os.ftruncate(dst_fd, data_start + offset)
+                with tracing.span("fsync", path=tmp_path):
+                    os.fsync(dst_fd)
+            finally:
+                os.close(dst_fd)
+            shutil.copymode(layout.path, tmp_path)
+            os.replace(tmp_path, layout.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            os.close(src_fd)
+
+    return SafetensorsLayout(layout.path, len(header_bytes), metadata, new_tensors)
+
+
+# 按预先算好的头部顺序写出新文件，数据只顺序写一遍，内存中最多只有一个块
+# entries 为 (name, dtype, shape, source) 列表：source 是 (源文件路径, 绝对偏移) 时直接拷贝字节，
+# 否则是逐块产生已编码字节的可迭代对象；progress(done, total) 可抛出异常取消
+def write_file(path, metadata, entries, reserve=HEADER_RESERVE, progress=None):
+    tensors = {}
+    offset = 0
+    for name, dtype, shape, _ in entries:
+        if name in tensors:
+            raise ValueError(f"Duplicate tensor name '{name}'")
+        size = tensor_nbytes(dtype, shape)
+        tensors[name] = {"dtype": dtype, "shape": list(shape), "size": size, "offsets": [offset, offset + size]}
+        offset += size
+
+    header_bytes = build_header(metadata, tensors)
+    header_bytes = build_header(metadata, tensors, len(header_bytes) + reserve)
+    data_start = 8 + len(header_bytes)
+
+    with tracing.span("write_file", nbytes=offset, path=path, tensors=len(tensors)):
+        tmp_path = path + ".tmp"
+        src_fds = {}
+        try:
+            dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.pwrite(dst_fd, struct.pack("<Q", len(header_bytes)) + header_bytes, 0)
+                done = 0
+                for name, _, _, source in entries:
+                    dst_offset = data_start + tensors[name]["offsets"][0]
+                    size = tensors[name]["size"]
+                    if isinstance(source, tuple):
+                        src_path, src_offset = source
+                        if src_path not in src_fds:
+                            src_fds[src_path] = os.open(src_path, os.O_RDONLY)
+                        copy_range(src_fds[src_path], src_offset, dst_fd, dst_offset, size)
+                        done += size
+                        if progress is not None:
+                            progress(done, offset)
+                        continue
+                    written = 0
+                    for chunk in source:
+                        os.pwrite(dst_fd, chunk, dst_offset + written)
+                        written += len(chunk)
+                        if progress is not None:
+                            progress(done + written, offset)
+                    if written != size:
+                        raise ValueError(f"Tensor '{name}' produced {written} bytes, expected {size}")
+                    done += size
+                os.ftruncate(dst_fd, data_start + offset)
+                with tracing.span("fsync", path=tmp_path):
+                    os.fsync(dst_fd)
+            finally:
+                os.close(dst_fd)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            for fd in src_fds.values():
+                os.close(fd)
+
+    return SafetensorsLayout(path, len(header_bytes), metadata, tensors)
+
+
+def journal_path(path):
+    return path + ".journal"
+
+
+# 撤销日志：记录原文件大小以及即将被覆盖的字节区间，写完并 fsync 后才修改原文件
+# 原始字节用 copy_range 直接拷进日志，区间再大内存占用也不变
+def write_journal(path, ranges):
+    file_size = os.path.getsize(path)
+    ranges = [(offset, max(0, min(length, file_size - offset))) for offset, length in ranges]
+
+    tmp_path = journal_path(path) + ".tmp"
+    src_fd = os.open(path, os.O_RDONLY)
+    try:
+        dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(dst_fd, JOURNAL_MAGIC + struct.pack("<QQ", file_size, len(ranges)))
+            pos = len(JOURNAL_MAGIC) + 16
+            for offset, length in ranges:
+                os.pwrite(dst_fd, struct.pack("<QQ", offset, length), pos)
+                copy_range(src_fd, offset, dst_fd, pos + 16, length)
+                pos += 16 + length
+            os.pwrite(dst_fd, JOURNAL_END, pos)
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    os.replace(tmp_path, journal_path(path))
+
+
+def commit_journal(path):
+    if os.path.exists(journal_path(path)):
+        os.remove(journal_path(path))
+
+
+# 上次写入中途崩溃时，用撤销日志把文件恢复到修改之前的状态
+def recover_journal(path):
+    journal = journal_path(path)
+    if os.path.exists(journal + ".tmp"):
+        os.remove(journal + ".tmp")
+    if not os.path.exists(journal):
+        return False
+
+    # 只读开头和结尾判断日志是否完整，内容在恢复时再按区间拷贝
+    size = os.path.getsize(journal)
+    with open(journal, "rb") as f:
+        head = f.read(len(JOURNAL_MAGIC) + 16)
+        f.seek(max(0, size - len(JOURNAL_END)))
+        tail = f.read()
+    if len(head) < len(JOURNAL_MAGIC) + 16 or not head.startswith(JOURNAL_MAGIC) or tail != JOURNAL_END:
+        # 日志本身不完整，说明原文件还没有被修改
+        os.remove(journal)
+        return False
+
+    file_size, count = struct.unpack_from("<QQ", head, len(JOURNAL_MAGIC))
+    pos = len(JOURNAL_MAGIC) + 16
+    src_fd = os.open(journal, os.O_RDONLY)
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        for _ in range(count):
+            offset, length = struct.unpack("<QQ", os.pread(src_fd, 16, pos))
+            copy_range(src_fd, pos + 16, fd, offset, length)
+            pos += 16 + length
+        os.ftruncate(fd, file_size)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        os.close(src_fd)
+    os.remove(journal)
+    return True
+
+
+# 按块生成初始化数据，每块都已编码为磁盘 dtype，内存占用与张量大小无关
+def generate_chunks(dtype, shape, initializer="zeros", value=0.0, seed=None):
+    check_shape(shape)
+    numel = 1
+    for dim in shape:
+        numel *= dim
+    chunk_elems = max(1, COPY_BLOCK_SIZE // DTYPE_SIZES[dtype])
+    rng = np.random.default_rng(seed)
+
+    for start in range(0, numel, chunk_elems):
+        count = min(chunk_elems, numel - start)
+        if initializer == "zeros":
+            values = np.zeros(count, dtype=np.float32)
+        elif initializer == "ones":
+            values = np.ones(count, dtype=np.float32)
+        elif initializer == "constant":
+            values = np.full(count, value, dtype=np.float64)
+        elif initializer == "normal":
+            values = rng.standard_normal(count, dtype=np.float32) * value
+        elif initializer == "uniform":
+            values = rng.uniform(-value, value, count).astype(np.float32)
+        else:
+            raise ValueError(f"Unknown initializer '{initializer}'")
+        yield encode_array(values, dtype)
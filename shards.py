@@ -0,0 +1,190 @@
+import copy
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import header_cache
+import safetensors_io
+from edit_journal import EditTransaction
+
+INDEX_SUFFIX = ".safetensors.index.json"
+
+# 网络存储上头部读取主要是延迟，线程数可以明显多于 CPU 核数
+MAX_HEADER_WORKERS = 32
+
+
+def is_sharded(path):
+    return os.path.isdir(path) or path.endswith(INDEX_SUFFIX)
+
+
+# 找到索引文件和所有分片：path 可以是索引文件或者模型目录
+def resolve_shards(path):
+    if os.path.isdir(path):
+        indexes = sorted(glob.glob(os.path.join(path, "*" + INDEX_SUFFIX)))
+        if not indexes:
+            files = sorted(glob.glob(os.path.join(path, "*.safetensors")))
+            if not files:
+                raise ValueError(f"No safetensors files found in {path}")
+            return None, files, {}
+        path = indexes[0]
+
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    base_dir = os.path.dirname(path)
+    weight_map = index.get("weight_map", {})
+    files = sorted({os.path.join(base_dir, name) for name in weight_map.values()})
+    return path, files, index.get("metadata", {}) or {}
+
+
+def _load_layout(path):
+    safetensors_io.recover_journal(path)
+    return header_cache.read_layout(path)
+
+
+# 在线程池中并发解析所有分片的头部，只读取头部，不打开数据
+def load_layouts(files, max_workers=MAX_HEADER_WORKERS):
+    if len(files) == 1:
+        return {files[0]: _load_layout(files[0])}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(files))) as executor:
+        return dict(zip(files, executor.map(_load_layout, files)))
+
+
+class ShardedModel:
+    def __init__(self, path):
+        self.path = path
+        self.index_path, self.files, self.metadata = resolve_shards(path)
+        self.layouts = load_layouts(self.files)
+
+        # 同名张量不能出现在多个分片中；只比较名字，合并的张量表由 Model.table() 按列拼接
+        seen = set()
+        for layout in self.layouts.values():
+            names = layout.tensors.names
+            if not seen.isdisjoint(names):
+                name = next(name for name in names if name in seen)
+                raise ValueError(f"Tensor '{name}' appears in more than one shard")
+            seen.update(names)
+
+
+# 分片模型的事务：每个分片各有一个 EditTransaction，按张量所在分片分派操作
+class ShardedTransaction:
+    def __init__(self, model):
+        self.model = model
+        self.transactions = {file: EditTransaction(layout) for file, layout in model.layouts.items()}
+        # 记录每一步操作落在哪个分片，用于按顺序撤销/重做
+        self.ops = []
+        self.redo_ops = []
+
+    def __bool__(self):
+        return bool(self.ops)
+
+    # 有效张量所在的分片；只查各分片的视图，不合并整个模型的视图
+    def _find(self, name):
+        for file, transaction in self.transactions.items():
+            if transaction.view().live(name) is not None:
+                return file
+        return None
+
+    def _owner(self, name):
+        file = self._find(name)
+        if file is None:
+            raise KeyError(f"Tensor '{name}' not found")
+        return file
+
+    def _check_free(self, name):
+        # 视图中仍保留待删除的张量，它们的名字可以重新使用（与 TransactionView 一致）
+        if self._find(name) is not None:
+            raise ValueError(f"Tensor '{name}' already exists")
+
+    def _push(self, file, change):
+        change(self.transactions[file])
+        self.ops.append(file)
+        self.redo_ops.clear()
+
+    def rename(self, old_name, new_name):
+        self._check_free(new_name)
+        self._push(self._owner(old_name), lambda t: t.rename(old_name, new_name))
+
+    def delete(self, name):
+        self._push(self._owner(name), lambda t: t.delete(name))
+
+    def add(self, name, dtype, shape, initializer="zeros", value=0.0, seed=None):
+        # 新张量追加到最后一个分片
+        self._check_free(name)
+        self._push(self.model.files[-1], lambda t: t.add(name, dtype, shape, initializer, value, seed))
+
+    def set_values(self, name, values):
+        self._push(self._owner(name), lambda t: t.set_values(name, values))
+
+    def can_undo(self):
+        return bool(self.ops)
+
+    def can_redo(self):
+        return bool(self.redo_ops)
+
+    def undo(self):
+        if self.ops:
+            file = self.ops.pop()
+            self.transactions[file].undo()
+            self.redo_ops.append(file)
+
+    def redo(self):
+        if self.redo_ops:
+            file = self.redo_ops.pop()
+            self.transactions[file].redo()
+            self.ops.append(file)
+
+    # model 为对应的 ShardedModel 副本，提交时写入它的 layouts
+    def copy(self, model):
+        other = copy.copy(self)
+        other.model = model
+        other.transactions = {file: transaction.copy() for file, transaction in self.transactions.items()}
+        other.ops = list(self.ops)
+        other.redo_ops = list(self.redo_ops)
+        return other
+
+    def view(self):
+        tensors = {}
+        for file, transaction in self.transactions.items():
+            for name, info in transaction.view().items():
+                # 已删除的条目不能遮住其他分片中同名的张量
+                if name in tensors and "deleted" in info["status"]:
+                    continue
+                tensors[name] = info
+        return tensors
+
+    def commit(self, progress=None):
+        pending = [file for file, transaction in self.transactions.items() if transaction]
+        try:
+            for i, file in enumerate(pending):
+                if progress is not None:
+                    progress(i, len(pending))
+                self.model.layouts[file] = self.transactions[file].commit()
+        finally:
+            # 中途取消时，已提交的分片也要反映到索引中
+            self.ops = [file for file in self.ops if self.transactions[file]]
+            self.redo_ops.clear()
+            if self.model.index_path:
+                self.write_index()
+        return self.model.layouts
+
+    # 根据提交后的头部重新生成 weight_map
+    def write_index(self):
+        write_index(self.model.index_path, self.model.layouts, self.model.metadata)
+
+
+# 根据各分片的头部生成索引文件：weight_map 和 total_size
+def write_index(index_path, layouts, metadata=None):
+    weight_map = {}
+    total_size = 0
+    for file, layout in layouts.items():
+        weight_map.update(dict.fromkeys(layout.tensors.names, os.path.basename(file)))
+        total_size += int(layout.tensors.sizes.sum())
+
+    metadata = dict(metadata or {}, total_size=total_size)
+    index = {"metadata": metadata, "weight_map": dict(sorted(weight_map.items()))}
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, index_path)
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtCore import QAbstractTableModel, Qt
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import (QDialog, QHBoxLayout, QHeaderView, QLabel, QLineEdit,
+                             QPushButton, QTableView, QVBoxLayout)
+
+import safetensors_io
+import tracing
+
+# 每页的行列数和缓存的页数，内存占用只与可见区域有关
+PAGE_ROWS = 256
+PAGE_COLS = 64
+MAX_PAGES = 32
+
+
+# 分页的二维表格模型：只在滚动到时从 memmap 中读取对应的页
+class TensorSliceModel(QAbstractTableModel):
+    def __init__(self, mapped, dtype, parent=None):
+        super().__init__(parent)
+        self.dtype = dtype
+        self.pages = OrderedDict()
+        self.set_view(mapped)
+
+    def set_view(self, mapped, keep_pages=False):
+        self.beginResetModel()
+        # 超过二维时把前面的维度当作行，行表头显示多维下标；
+        # 这里不能 reshape，切片后的 memmap 不连续时 reshape 会复制整个张量
+        if mapped.ndim == 0:
+            mapped = mapped.reshape(1, 1)
+        elif mapped.ndim == 1:
+            mapped = mapped[:, np.newaxis]
+        self.mapped = mapped
+        self.lead_shape = mapped.shape[:-1]
+        self.rows = int(np.prod(self.lead_shape))
+        self.cols = mapped.shape[-1]
+        if not keep_pages:
+            self.pages.clear()
+        self.endResetModel()
+
+    def page(self, page_row, page_col):
+        key = (page_row, page_col)
+        values = self.pages.get(key)
+        if values is None:
+            r0, c0 = page_row * PAGE_ROWS, page_col * PAGE_COLS
+            columns = slice(c0, c0 + PAGE_COLS)
+            if self.mapped.ndim == 2:
+                index = (slice(r0, r0 + PAGE_ROWS), columns)
+            else:
+                rows = np.arange(r0, min(r0 + PAGE_ROWS, self.rows))
+                index = np.unravel_index(rows, self.lead_shape) + (columns,)
+            with tracing.span("page_read", page=key) as span:
+                values = safetensors_io.read_window(self.mapped, self.dtype, index)
+                span.nbytes = values.size * self.mapped.itemsize
+            self.pages[key] = values
+            if len(self.pages) > MAX_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(key)
+        return values
+
+    def rowCount(self, parent=None):
+        return self.rows
+
+    def columnCount(self, parent=None):
+        return self.cols
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            row, col = index.row(), index.column()
+            values = self.page(row // PAGE_ROWS, col // PAGE_COLS)
+            value = values[row % PAGE_ROWS, col % PAGE_COLS]
+            if values.dtype.kind == "f":
+                return f"{value:.6g}"
+            return str(value)
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Vertical and len(self.lead_shape) > 1:
+            return str(tuple(int(i) for i in np.unravel_index(section, self.lead_shape)))
+        return str(section)
+
+
+class SliceViewerDialog(QDialog):
+    def __init__(self, name, layout, info, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"Tensor Data - {name}")
+        self.resize(900, 600)
+        self.name = name
+        self.info = info
+        self.full = safetensors_io.map_tensor(layout.path, layout.data_start, info)
+
+        main_layout = QVBoxLayout()
+        self.setLayout(main_layout)
+
+        # 切片输入框
+        slice_bar = QHBoxLayout()
+        slice_bar.addWidget(QLabel(f"Shape {list(info['shape'])}  {info['dtype']}   Slice:"))
+        self.slice_edit = QLineEdit()
+        self.slice_edit.setPlaceholderText("e.g. 3, :, 0:100")
+        self.slice_edit.returnPressed.connect(self.apply_slice)
+        slice_bar.addWidget(self.slice_edit)
+        apply_button = QPushButton("Apply")
+        apply_button.clicked.connect(self.apply_slice)
+        slice_bar.addWidget(apply_button)
+        main_layout.addLayout(slice_bar)
+
+        self.model = TensorSliceModel(self.full, info["dtype"], self)
+        self.table = QTableView()
+        self.table.setFont(QFont("Consolas", 10))
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.horizontalHeader().setDefaultSectionSize(90)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table.verticalHeader().setDefaultSectionSize(22)
+        main_layout.addWidget(self.table)
+
+        self.status = QLabel("")
+        main_layout.addWidget(self.status)
+        self.update_status()
+
+    def apply_slice(self):
+        try:
+            index = safetensors_io.parse_slice(self.slice_edit.text(), self.full.ndim)
+            self.model.set_view(self.full[index])
+            self.update_status()
+        except Exception as e:
+            self.status.setText(f"Invalid slice: {str(e)}")
+
+    # 文件在外部被改写后重新映射；keep_pages 为真时张量内容没变，已读取的页继续使用
+    def rebind(self, layout, info, keep_pages, probable=False):
+        self.info = info
+        self.full = safetensors_io.map_tensor(layout.path, layout.data_start, info)
+        try:
+            index = safetensors_io.parse_slice(self.slice_edit.text(), self.full.ndim)
+        except ValueError:
+            index = ()
+        self.model.set_view(self.full[index], keep_pages)
+        self.update_status()
+        if not keep_pages:
+            # 抽样指纹相同只说明可能没变，数据仍然重新读取
+            note = " - reloaded from disk (probably unchanged, sampled)" if probable else " - reloaded from disk"
+            self.status.setText(self.status.text() + note)
+
+    def detach(self, message):
+        # 张量已不在文件中或形状变了，保留当前内容但不再读取
+        self.slice_edit.setEnabled(False)
+        self.status.setText(message)
+
+    def update_status(self):
+        rows, cols = self.model.rowCount(), self.model.columnCount()
+        self.status.setText(f"{rows:,} x {cols:,} values (pages of {PAGE_ROWS}x{PAGE_COLS} loaded on demand)")
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import safetensors_io
+
+# 张量按固定大小分块，各块并行计算 BLAKE2b 摘要，张量的哈希是所有块摘要拼接后的摘要；
+# hashlib 在处理大块数据时释放 GIL，多线程可以跑满磁盘带宽
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+HASH_ALGORITHM = "blake2b-128/16MiB"
+DIGEST_SIZE = 16
+
+SIDECAR_SUFFIX = ".hashes.json"
+
+# 抽样指纹：张量的位置加上开头、中间和结尾各这么多字节。只用于在界面上提示文件改写后张量"可能没变"，
+# 局部更新（例如只训练了部分行）会漏掉，不能当作内容哈希保存
+SAMPLE_SIZE = 4096
+
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def read_hash_file(hash_path):
+    with open(hash_path, "r", encoding="utf-8") as f:
+        sidecar = json.load(f)
+    if sidecar.get("algorithm") != HASH_ALGORITHM:
+        raise ValueError(f"Unsupported hash algorithm in {hash_path}")
+    return sidecar
+
+
+# 读取旁路文件中的哈希，文件被修改过或算法不同时视为无效
+def load_sidecar(path):
+    try:
+        sidecar = read_hash_file(sidecar_path(path))
+        if sidecar.get("file") != _file_key(path):
+            return {}
+        return sidecar.get("tensors", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_sidecar(path, hashes):
+    sidecar = {"algorithm": HASH_ALGORITHM, "file": _file_key(path), "tensors": hashes}
+    tmp_path = sidecar_path(path) + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sidecar, f, indent=1)
+        os.replace(tmp_path, sidecar_path(path))
+    except OSError:
+        # 只读目录中不保存缓存
+        pass
+
+
+def sample_digest(fd, data_start, info):
+    start = data_start + info["offsets"][0]
+    size = info["size"]
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    digest.update(f"{start}:{size}:{info['dtype']}:{list(info['shape'])}".encode("utf-8"))
+    if size <= 3 * SAMPLE_SIZE:
+        digest.update(os.pread(fd, size, start))
+    else:
+        for offset in (0, (size - SAMPLE_SIZE) // 2, size - SAMPLE_SIZE):
+            digest.update(os.pread(fd, SAMPLE_SIZE, start + offset))
+    return digest.hexdigest()
+
+
+# 一组张量的抽样指纹：name -> hex，tensors 为 name -> info
+def sample_tensors(path, data_start, tensors):
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        return {name: sample_digest(fd, data_start, info) for name, info in tensors.items()}
+    finally:
+        os.close(fd)
+
+
+def hash_layouts(layouts, workers=None, progress=None, use_cache=True):
+    # layouts: path -> SafetensorsLayout；返回 path -> {name: hex}
+    # progress(done_bytes, total_bytes) 可抛出异常取消
+    results = {}
+    jobs = []
+    digests = {}
+    for path, layout in layouts.items():
+        cached = load_sidecar(path) if use_cache else {}
+        hashes = results[path] = {}
+        for name, info in layout.tensors.items():
+            if name in cached:
+                hashes[name] = cached[name]
+                continue
+            start = layout.data_start + info["offsets"][0]
+            size = info["size"]
+            # 分块大小是哈希定义的一部分，不能随调用改变
+            starts = range(0, size, HASH_CHUNK_SIZE) if size else range(1)
+            digests[(path, name)] = [None] * len(starts)
+            for i, offset in enumerate(starts):
+                jobs.append((path, name, i, start + offset, min(HASH_CHUNK_SIZE, size - offset)))
+
+    if jobs:
+        fds = {}
+        try:
+            for path in {job[0] for job in jobs}:
+                fds[path] = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+            def work(job):
+                path, name, _, offset, length = job
+                data = os.pread(fds[path], length, offset)
+                if len(data) != length:
+                    raise ValueError(f"Tensor '{name}' data is truncated")
+                return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+            total = sum(job[4] for job in jobs)
+            done = 0
+            workers = workers or os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+                # 按窗口提交，排队的块数与模型大小无关
+                pending = {}
+                queue = iter(jobs)
+                try:
+                    for job in queue:
+                        pending[executor.submit(work, job)] = job
+                        if len(pending) >= workers * 2:
+                            break
+                    while pending:
+                        future = next(as_completed(pending))
+                        job = pending.pop(future)
+                        path, name, i = job[:3]
+                        parts = digests[(path, name)]
+                        parts[i] = future.result()
+                        if all(part is not None for part in parts):
+                            results[path][name] = hashlib.blake2b(
+                                b"".join(parts), digest_size=DIGEST_SIZE).hexdigest()
+                            del digests[(path, name)]
+                        done += job[4]
+                        if progress is not None:
+                            progress(done, total)
+                        for job in queue:
+                            pending[executor.submit(work, job)] = job
+                            break
+                finally:
+                    for future in pending:
+                        future.cancel()
+        finally:
+            for fd in fds.values():
+                os.close(fd)
+
+        for path in {job[0] for job in jobs}:
+            save_sidecar(path, results[path])
+    return results
+
+
+# 提交修改前调用：根据事务视图（见 EditTransaction.view）找出内容不变的张量，
+# 提交后沿用它们原来的哈希，只有修改和新增的张量需要重新计算
+def carry_forward(path, view):
+    cached = load_sidecar(path)
+    return {name: cached[info["source"]] for name, info in view.items()
+            if info["source"] in cached and "data" not in info and "deleted" not in info["status"]}
+
+
+# 模型中所有张量的哈希：name -> hex
+def hash_model(model, workers=None, progress=None, use_cache=True):
+    hashes = {}
+    for path_hashes in hash_layouts(model.layouts, workers=workers, progress=progress,
+                                    use_cache=use_cache).values():
+        hashes.update(path_hashes)
+    return hashes
+
+
+# 内容相同的张量分组；头部中指向同一段数据的张量记为 tied，不算作冗余
+def find_duplicates(model, hashes):
+    groups = defaultdict(list)
+    for name, layout, info in model.items():
+        key = (info["dtype"], tuple(info["shape"]), hashes[name])
+        groups[key].append((name, layout.path, tuple(info["offsets"])))
+    duplicates = []
+    for (dtype, shape, digest), members in groups.items():
+        if len(members) < 2:
+            continue
+        shared = defaultdict(list)
+        for name, path, offsets in members:
+            shared[(path, offsets)].append(name)
+        duplicates.append({
+            "names": sorted(name for name, _, _ in members),
+            "dtype": dtype,
+            "shape": list(shape),
+            "hash": digest,
+            # 与组内其它张量共享同一段数据的张量
+            "tied": sorted(name for names in shared.values() if len(names) > 1 for name in names),
+            "wasted": (len(shared) - 1) * safetensors_io.tensor_nbytes(dtype, shape),
+        })
+    duplicates.sort(key=lambda group: -group["wasted"])
+    return duplicates
+
+
+# 与参考哈希比较（例如拷贝前保存的旁路文件），返回不一致、缺失和多出的张量
+def verify(hashes, reference):
+    mismatched = sorted(name for name in hashes if name in reference and hashes[name] != reference[name])
+    missing = sorted(name for name in reference if name not in hashes)
+    extra = sorted(name for name in hashes if name not in reference)
+    return {"mismatched": mismatched, "missing": missing, "extra": extra}
+
+
+def format_duplicates(duplicates):
+    if not duplicates:
+        return "No duplicate tensors"
+    lines = []
+    for group in duplicates:
+        kind = f"{group['wasted']:,} bytes redundant" if group["wasted"] else "tied"
+        lines.append(f"{group['dtype']}{group['shape']} ({kind}):")
+        for name in group["names"]:
+            lines.append(f"  {name}" + ("  [tied]" if name in group["tied"] else ""))
+    return "\n".join(lines)
@@ -0,0 +1,150 @@
+import bisect
+import re
+
+import numpy as np
+
+from model_core import parse_size
+
+# 查询由空格分隔的条件组成，全部满足才算匹配：
+#   layers.1          名字中包含该子串（不区分大小写）
+#   *.q_proj.*        glob，匹配完整名字；只有结尾一个 * 时用前缀索引
+#   /mlp\.\d+/        正则表达式，re: 前缀效果相同
+#   dtype:F16,BF16    dtype 过滤
+#   shape:4096,*      形状，* 匹配任意一维
+#   ndim:2            维数
+#   size>1MB numel>=1000000   大小/元素数比较
+_COMPARE = re.compile(r"^(size|numel)(>=|<=|>|<|=)(.+)$")
+
+
+def _glob_to_regex(pattern):
+    # 开头/结尾的 * 不需要锚定，避免每行都从头回溯
+    head = "" if pattern.startswith("*") else "^"
+    tail = "" if pattern.endswith("*") else "$"
+    pattern = pattern.strip("*")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "*":
+            parts.append("[^\n]*")
+        elif c == "?":
+            parts.append("[^\n]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end < 0:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append(f"[{body}]")
+                i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return head + "".join(parts) + tail
+
+
+# 张量名的搜索索引：所有名字拼成一个字符串用正则一次扫描，排序后的名字用于前缀查找，
+# 属性过滤在 numpy 数组上向量化完成；索引与张量表一一对应，表变化时重新构建
+class SearchIndex:
+    def __init__(self, table):
+        self.table = table
+        names = table.names
+        self.text = "\n".join(names)
+        # 子串搜索不区分大小写，在小写副本上用普通正则扫描比 IGNORECASE 快得多
+        self.lower_text = self.text.lower()
+        lengths = np.fromiter((len(name) + 1 for name in names), dtype=np.int64, count=len(names))
+        self.starts = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(names) else np.zeros(0, np.int64)
+        self.order = sorted(range(len(names)), key=names.__getitem__)
+        self.sorted_names = [names[row] for row in self.order]
+        # 属性过滤直接使用张量表中的列
+        self.sizes = table.sizes
+        self.numels = table.numels
+        self.ndims = table.ndims
+        self.dtype_codes = table.dtype_codes
+
+    def __len__(self):
+        return len(self.table)
+
+    def _regex_rows(self, pattern, text=None):
+        regex = re.compile(pattern, re.MULTILINE)
+        text = self.text if text is None else text
+        positions = []
+        for m in regex.finditer(text):
+            if "\n" not in m.group():
+                positions.append(m.start())
+                continue
+            # 匹配跨越了多个名字（如 \s 或 [^k]* 匹配到换行），不算数；
+            # 这段范围内的名字逐个重新匹配，被跨越的匹配吞掉的真实匹配不会丢失
+            first, last = np.searchsorted(self.starts, [m.start(), m.end() - 1], side="right") - 1
+            for row in range(first, last + 1):
+                start = self.starts[row]
+                end = self.starts[row + 1] - 1 if row + 1 < len(self.starts) else len(text)
+                if regex.search(text, start, end):
+                    positions.append(start)
+        rows = np.searchsorted(self.starts, np.asarray(positions, dtype=np.int64), side="right") - 1
+        return np.unique(rows)
+
+    def _prefix_rows(self, prefix):
+        lo = bisect.bisect_left(self.sorted_names, prefix)
+        hi = bisect.bisect_left(self.sorted_names, prefix + "\U0010ffff")
+        return np.sort(np.asarray(self.order[lo:hi], dtype=np.int64))
+
+    def _name_rows(self, term):
+        if term.startswith("re:"):
+            return self._regex_rows(term[3:])
+        if len(term) > 1 and term.startswith("/") and term.endswith("/"):
+            return self._regex_rows(term[1:-1])
+        if any(c in term for c in "*?["):
+            if term.endswith("*") and not any(c in term[:-1] for c in "*?["):
+                return self._prefix_rows(term[:-1])
+            return self._regex_rows(_glob_to_regex(term))
+        return self._regex_rows(re.escape(term.lower()), self.lower_text)
+
+    def _shape_mask(self, rows, spec):
+        dims = [d.strip() for d in spec.strip("[]()").split(",") if d.strip()]
+        mask = self.ndims[rows] == len(dims)
+        starts = self.table.dim_starts[rows]
+        for i, d in enumerate(dims):
+            if d != "*" and len(self.table.dims):
+                # 维数不符的行已被排除，下标越界时取到的值无关紧要
+                mask &= self.table.dims[np.minimum(starts + i, len(self.table.dims) - 1)] == int(d)
+        return mask
+
+    # 返回匹配的行号（升序的 numpy 数组）；非法查询抛出 ValueError/re.error
+    def query(self, text):
+        rows = None
+        filters = []
+        for term in text.split():
+            key, _, value = term.partition(":")
+            compare = _COMPARE.match(term)
+            if key in ("dtype", "shape", "ndim") and value:
+                filters.append((key, value))
+            elif compare:
+                filters.append(compare.groups())
+            else:
+                found = self._name_rows(term)
+                rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+        if rows is None:
+            rows = np.arange(len(self), dtype=np.int64)
+
+        for item in filters:
+            if not len(rows):
+                break
+            if item[0] == "dtype":
+                names = self.table.dtype_names
+                wanted = [names.index(d) for d in item[1].upper().split(",") if d in names]
+                mask = np.isin(self.dtype_codes[rows], wanted)
+            elif item[0] == "ndim":
+                mask = self.ndims[rows] == int(item[1])
+            elif item[0] == "shape":
+                mask = self._shape_mask(rows, item[1])
+            else:
+                field, op, value = item
+                values = (self.sizes if field == "size" else self.numels)[rows]
+                limit = parse_size(value) if field == "size" else int(float(value))
+                mask = {">": values > limit, "<": values < limit, ">=": values >= limit,
+                        "<=": values <= limit, "=": values == limit}[op]
+            rows = rows[mask]
+        return rows
@@ -0,0 +1,204 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import safetensors_io
+import tracing
+
+# 每个工作线程一次处理的字节数
+STATS_CHUNK_SIZE = 16 * 1024 * 1024
+
+# 块内按该元素数分段转换为 float64 求平方和，临时数组不随块的元素数增长（1 字节的 dtype 一块有 16M 个元素）
+STATS_BLOCK_ELEMS = 1 << 20
+
+# 每个块内部先用细粒度直方图统计，合并时再重新分到最终的区间
+FINE_BINS = 1024
+HISTOGRAM_BINS = 32
+
+# 累积的块直方图超过该数量时压缩成一个
+MAX_PENDING_HISTS = 64
+
+# 部分结果的最小刷新间隔（秒）
+PARTIAL_INTERVAL = 0.1
+
+
+def chunk_stats(values):
+    # 单个块的统计量，合并时使用 Chan 的并行方差公式
+    values = values.ravel()
+    if values.dtype == np.bool_:
+        values = values.view(np.uint8)
+    numel = values.size
+    nan = posinf = neginf = 0
+    if values.dtype.kind == "f":
+        nan = int(np.count_nonzero(np.isnan(values)))
+        posinf = int(np.count_nonzero(values == np.inf))
+        neginf = int(np.count_nonzero(values == -np.inf))
+        if nan or posinf or neginf:
+            values = values[np.isfinite(values)]
+
+    stats = {
+        "numel": numel,
+        "count": values.size,
+        "nan": nan,
+        "posinf": posinf,
+        "neginf": neginf,
+        "zeros": int(values.size - np.count_nonzero(values)),
+        "min": None,
+        "max": None,
+        "mean": 0.0,
+        "m2": 0.0,
+        "sumsq": 0.0,
+        "hist": None,
+    }
+    if values.size == 0:
+        return stats
+
+    lo = float(values.min())
+    hi = float(values.max())
+    mean = float(np.mean(values, dtype=np.float64))
+    m2 = 0.0
+    for start in range(0, values.size, STATS_BLOCK_ELEMS):
+        centered = np.subtract(values[start:start + STATS_BLOCK_ELEMS], mean, dtype=np.float64)
+        m2 += float(np.dot(centered, centered))
+    stats.update(min=lo, max=hi, mean=mean, m2=m2, sumsq=m2 + values.size * mean * mean)
+    if hi > lo:
+        counts, edges = np.histogram(values, bins=FINE_BINS, range=(lo, hi))
+        stats["hist"] = (counts, (edges[:-1] + edges[1:]) / 2)
+    else:
+        stats["hist"] = (np.array([values.size]), np.array([lo]))
+    return stats
+
+
+class StatsAccumulator:
+    def __init__(self, numel=None):
+        self.numel = numel
+        self.seen = 0
+        self.count = 0
+        self.nan = 0
+        self.posinf = 0
+        self.neginf = 0
+        self.zeros = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sumsq = 0.0
+        self.hists = []
+
+    def merge(self, stats):
+        self.seen += stats["numel"]
+        self.nan += stats["nan"]
+        self.posinf += stats["posinf"]
+        self.neginf += stats["neginf"]
+        self.zeros += stats["zeros"]
+        self.sumsq += stats["sumsq"]
+        if stats["count"]:
+            n_a, n_b = self.count, stats["count"]
+            delta = stats["mean"] - self.mean
+            total = n_a + n_b
+            self.mean += delta * n_b / total
+            self.m2 += stats["m2"] + delta * delta * n_a * n_b / total
+            self.count = total
+            self.min = stats["min"] if self.min is None else min(self.min, stats["min"])
+            self.max = stats["max"] if self.max is None else max(self.max, stats["max"])
+            self.hists.append(stats["hist"])
+            if len(self.hists) > MAX_PENDING_HISTS:
+                counts, edges = self.histogram(FINE_BINS)
+                self.hists = [(counts, (edges[:-1] + edges[1:]) / 2)]
+
+    def histogram(self, bins=HISTOGRAM_BINS):
+        if self.min is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        hi = self.max if self.max > self.min else self.min + 1
+        counts = np.zeros(bins, dtype=np.int64)
+        for chunk_counts, centers in self.hists:
+            part, edges = np.histogram(centers, bins=bins, range=(self.min, hi), weights=chunk_counts)
+            counts += part.astype(np.int64)
+        return counts, edges
+
+    def result(self):
+        numel = self.seen
+        return {
+            "numel": numel,
+            "complete": self.numel is None or self.seen >= self.numel,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean if self.count else None,
+            "std": float(np.sqrt(self.m2 / self.count)) if self.count else None,
+            "l2": float(np.sqrt(self.sumsq)),
+            "nan": self.nan,
+            "inf": self.posinf + self.neginf,
+            "zero_fraction": self.zeros / numel if numel else 0.0,
+            "histogram": self.histogram(),
+        }
+
+
+# 通过内存映射分块读取张量并在多个线程中并行统计，
+# on_partial(result, done_bytes, total_bytes) 在每个块合并后调用，可抛出异常取消
+def compute_stats(path, data_start, info, chunk_size=STATS_CHUNK_SIZE, workers=None, on_partial=None):
+    dtype = info["dtype"]
+    itemsize = safetensors_io.DTYPE_SIZES[dtype]
+    size = info["offsets"][1] - info["offsets"][0]
+    accumulator = StatsAccumulator(size // itemsize)
+    if size == 0:
+        return accumulator.result()
+
+    with tracing.span("stats", nbytes=size, path=path):
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=data_start + info["offsets"][0], shape=(size,))
+        chunk_size = max(itemsize, chunk_size - chunk_size % itemsize)
+        ranges = [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+        def work(start, end):
+            return chunk_stats(safetensors_io.decode_array(data[start:end], dtype))
+
+        workers = workers or os.cpu_count() or 1
+        done = 0
+        last_partial = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+            # 按窗口提交，避免为超大张量一次性排入所有块
+            pending = {}
+            queue = iter(ranges)
+            try:
+                for start, end in queue:
+                    pending[executor.submit(work, start, end)] = end - start
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    future = next(as_completed(pending))
+                    done += pending.pop(future)
+                    accumulator.merge(future.result())
+                    if on_partial is not None and time.monotonic() - last_partial >= PARTIAL_INTERVAL:
+                        last_partial = time.monotonic()
+                        on_partial(accumulator.result(), done, size)
+                    for start, end in queue:
+                        pending[executor.submit(work, start, end)] = end - start
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+    return accumulator.result()
+
+
+def format_stats(stats):
+    lines = []
+    if not stats["complete"]:
+        lines.append(f"(partial: {stats['numel']:,} elements processed)")
+    if stats["min"] is not None:
+        lines.append(f"Min: {stats['min']:.6g}")
+        lines.append(f"Max: {stats['max']:.6g}")
+        lines.append(f"Mean: {stats['mean']:.6g}")
+        lines.append(f"Std: {stats['std']:.6g}")
+    lines.append(f"L2 norm: {stats['l2']:.6g}")
+    lines.append(f"NaN: {stats['nan']:,}  Inf: {stats['inf']:,}")
+    lines.append(f"Zero fraction: {stats['zero_fraction']:.4%}")
+
+    counts, edges = stats["histogram"]
+    if len(counts):
+        lines.append("Histogram:")
+        peak = max(int(counts.max()), 1)
+        for i, count in enumerate(counts):
+            bar = "#" * int(round(40 * count / peak))
+            lines.append(f"  {edges[i]:>12.4g} | {bar} {count:,}")
+    return "\n".join(lines)
@@ -0,0 +1,237 @@
+import copy
+import gc
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+import safetensors_io
+import tracing
+
+# dtype 在表中以编号保存，编号与头部缓存一致；头部中的未知 dtype 追加在后面
+DTYPE_NAMES = list(safetensors_io.DTYPE_SIZES)
+
+_NO_STATUS = frozenset()
+
+
+def _numels(ndims, dims):
+    numels = np.ones(len(ndims), dtype=np.int64)
+    np.multiply.at(numels, np.repeat(np.arange(len(ndims)), ndims), dims)
+    return numels
+
+
+# 紧凑的列式张量表：偏移、大小、元素数、dtype 编号和维数各是一个 numpy 数组，所有形状拼成一个一维数组，
+# 名字到行号的哈希索引；树、搜索和重新加载的比较都从这里读取，不再为每个张量保留一个字典。
+# layouts 为 path -> SafetensorsLayout，直接拼接各文件头部的列（见 safetensors_io.TensorColumns），
+# 单个文件时与头部共用同一组数组和索引；待提交的修改由 with_edits 叠加在这张表上
+class TensorTable:
+    def __init__(self, layouts):
+        self.layouts = layouts
+        self.files = list(layouts)
+        self.data_starts = np.array([layout.data_start for layout in layouts.values()], dtype=np.int64)
+        self.dtype_names = list(DTYPE_NAMES)
+        # 行号 -> 事务视图中的字典，只包含有修改状态的行
+        self.edits = {}
+        # 叠加了修改的表指向原来的磁盘表，磁盘表本身为 None
+        self.disk = None
+        self._shape_keys = None
+        count = sum(len(layout.tensors) for layout in layouts.values())
+        with tracing.span("tensor_table", "model", tensors=count):
+            self._concat([layout.tensors for layout in layouts.values()])
+            self.numels = _numels(self.ndims, self.dims)
+
+    # 叠加待提交修改的新表（views 为 path -> TransactionView）：原有的行保持行号，
+    # 重命名、修改和待删除只替换这些行的名字和状态，数组与磁盘表共用；新增的张量追加在最后。
+    # 名字被重新使用的待删除行也保留在表中，索引指向有效的那一行
+    def with_edits(self, views):
+        table = copy.copy(self)
+        table.disk = self
+        table.edits = {}
+        added = []
+        with tracing.span("tensor_table", "model", tensors=len(self), edits=len(views)):
+            starts = {file: int(self.file_starts[code]) for code, file in enumerate(self.files)}
+            if any(view.renamed for view in views.values()):
+                table.names = list(self.names)
+            if any(view.lookup or view.added or view.deleted for view in views.values()):
+                table.index = dict(self.index)
+            for file, view in views.items():
+                start = starts[file]
+                table.edits.update((start + row, info) for row, info in view.changed.items())
+                for row, name in view.renamed.items():
+                    table.names[start + row] = name
+                added.extend(view.added.items())
+            # 先去掉不再有效的名字，再登记改名后的名字：不同分片之间可能交换名字
+            lookups = [(starts[file], name, row) for file, view in views.items() for name, row in view.lookup.items()]
+            for _, name, row in lookups:
+                if row is None:
+                    table.index.pop(name, None)
+            for start, name, row in lookups:
+                if row is not None:
+                    table.index[name] = start + row
+            if added:
+                table._append(added)
+            for file, view in views.items():
+                for name, row in view.deleted_names.items():
+                    table.index.setdefault(name, starts[file] + row)
+        return table
+
+    # 新增的张量：各列追加在已有的行之后
+    def _append(self, added):
+        count = len(self)
+        columns = ("dtype_codes", "ndims", "dims", "sizes", "offsets")
+        existing = {column: getattr(self, column) for column in columns}
+        infos = [info for _, info in added]
+        self.dtype_names = list(self.dtype_names)
+        self._build(infos)
+        numels = _numels(self.ndims, self.dims)
+        for column in columns:
+            setattr(self, column, np.concatenate([existing[column], getattr(self, column)]))
+        self.dim_starts = np.cumsum(self.ndims, dtype=np.int64) - self.ndims
+        self.numels = np.concatenate([self.numels, numels])
+        codes = {file: code for code, file in enumerate(self.files)}
+        self.file_codes = np.concatenate([self.file_codes, np.fromiter(
+            (codes[info["file"]] for info in infos), dtype=np.int32, count=len(infos))])
+        self.names = self.names + [name for name, _ in added]
+        if self._shape_keys is not None:
+            self._shape_keys = self._shape_keys + [self._shape_key(row) for row in range(count, len(self))]
+        for row, (name, info) in enumerate(added, count):
+            self.index[name] = row
+            self.edits[row] = info
+
+    # 与叠加在同一张磁盘表上的另一张表相比，名字、状态、dtype 或形状不同的行；
+    # 不是同一张磁盘表时返回 None
+    def changed_rows(self, other):
+        disk = self.disk or self
+        if (other.disk or other) is not disk:
+            return None
+        rows = set(self.edits) | set(other.edits)
+        rows.update(range(len(disk), max(len(self), len(other))))
+        return sorted(row for row in rows if self._key(row) != other._key(row))
+
+    def _key(self, row):
+        if row >= len(self):
+            return None
+        return self.names[row], self.status(row), self.dtype(row), self.shape(row)
+
+    def _concat(self, columns):
+        counts = [len(column) for column in columns]
+        # 各文件内的行号 = 表中的行号 - 所在文件的起始行
+        self.file_starts = np.cumsum(counts, dtype=np.int64) - counts
+        self.file_codes = np.repeat(np.arange(len(columns), dtype=np.int32), counts)
+        if len(columns) == 1:
+            column = columns[0]
+            self.names = column.names
+            self.index = column.index
+            self.dtype_names = list(column.dtype_names)
+            self.dtype_codes = column.dtype_codes
+            self.ndims = column.ndims
+            self.dims = column.dims
+            self.dim_starts = column.dim_starts
+            self.offsets = column.offsets
+            self.sizes = column.sizes
+            return
+        recoded = []
+        for column in columns:
+            # 各文件的 dtype 编号换成表中的编号
+            for dtype in column.dtype_names:
+                if dtype not in self.dtype_names:
+                    self.dtype_names.append(dtype)
+            lookup = np.array([self.dtype_names.index(dtype) for dtype in column.dtype_names], dtype=np.uint8)
+            recoded.append(lookup[column.dtype_codes])
+        self.names = list(chain.from_iterable(column.names for column in columns))
+        self.index = dict(zip(self.names, range(len(self.names))))
+        self.dtype_codes = np.concatenate(recoded) if columns else np.zeros(0, np.uint8)
+        self.ndims = np.concatenate([column.ndims for column in columns]) if columns else np.zeros(0, np.uint8)
+        self.dims = np.concatenate([column.dims for column in columns]) if columns else np.zeros(0, np.int64)
+        self.dim_starts = np.cumsum(self.ndims, dtype=np.int64) - self.ndims
+        self.offsets = (np.concatenate([column.offsets for column in columns]) if columns
+                        else np.zeros((0, 2), np.int64))
+        self.sizes = self.offsets[:, 1] - self.offsets[:, 0]
+
+    def _build(self, infos):
+        # 逐列取出再整体转换，比逐个张量构造数组快得多
+        count = len(infos)
+        shapes = list(map(itemgetter("shape"), infos))
+        dtypes = list(map(itemgetter("dtype"), infos))
+        codes = {dtype: code for code, dtype in enumerate(self.dtype_names)}
+        for dtype in set(dtypes):
+            if dtype not in codes:
+                codes[dtype] = len(self.dtype_names)
+                self.dtype_names.append(dtype)
+        self.dtype_codes = np.fromiter(map(codes.__getitem__, dtypes), dtype=np.uint8, count=count)
+        self.ndims = np.fromiter(map(len, shapes), dtype=np.uint8, count=count)
+        self.dims = np.fromiter(chain.from_iterable(shapes), dtype=np.int64, count=int(self.ndims.sum()))
+        self.dim_starts = np.cumsum(self.ndims, dtype=np.int64) - self.ndims
+        self.sizes = np.fromiter(map(itemgetter("size"), infos), dtype=np.int64, count=count)
+        # 新增的张量还没有写入文件，偏移为 -1
+        self.offsets = np.fromiter(chain.from_iterable(info["offsets"] or (-1, -1) for info in infos),
+                                   dtype=np.int64, count=count * 2).reshape(count, 2)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def row(self, name):
+        return self.index[name]
+
+    def dtype(self, row):
+        return self.dtype_names[self.dtype_codes[row]]
+
+    def shape(self, row):
+        start = self.dim_starts[row]
+        return tuple(self.dims[start:start + self.ndims[row]].tolist())
+
+    def _shape_key(self, row):
+        return int(self.dtype_codes[row]), self.shape(row)
+
+    # 每行的 (dtype 编号, 形状)，比较模块结构（见 ModuleNode.signature）时使用，第一次用到时整体生成
+    def shape_keys(self):
+        if self._shape_keys is None:
+            dims = self.dims.tolist()
+            ends = np.cumsum(self.ndims, dtype=np.int64).tolist()
+            starts = self.dim_starts.tolist()
+            # 一次创建大量元组时关闭垃圾回收，与 build_module_tree 相同
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                self._shape_keys = list(zip(self.dtype_codes.tolist(),
+                                            (tuple(dims[start:end]) for start, end in zip(starts, ends))))
+            finally:
+                if gc_enabled:
+                    gc.enable()
+        return self._shape_keys
+
+    def status(self, row):
+        info = self.edits.get(row)
+        return info["status"] if info is not None else _NO_STATUS
+
+    # 数据在文件中的绝对位置
+    def positions(self):
+        return self.data_starts[self.file_codes] + self.offsets[:, 0]
+
+    # 与事务视图相同结构的字典（见 EditTransaction.view），每次调用重新生成
+    def info(self, row):
+        info = self.edits.get(row)
+        if info is not None:
+            return info
+        name = self.names[row]
+        return {"dtype": self.dtype(row), "shape": list(self.shape(row)), "size": int(self.sizes[row]),
+                "offsets": self.offsets[row].tolist(), "file": self.files[self.file_codes[row]],
+                "source": name, "status": _NO_STATUS}
+
+    def get(self, name):
+        row = self.index.get(name)
+        return self.info(row) if row is not None else None
+
+    # 名字、dtype 和形状都不变，换成另一张表中的位置（例如文件在外部被改写后数据移动了）
+    def rebind(self, other):
+        order = np.fromiter(map(other.index.__getitem__, self.names), dtype=np.int64, count=len(self))
+        self.layouts = other.layouts
+        self.files = other.files
+        self.data_starts = other.data_starts
+        self.file_codes = other.file_codes[order]
+        self.offsets = other.offsets[order]
+        # 行不再按文件顺序排列，不能再由行号换算文件内的行号
+        self.file_starts = None
@@ -0,0 +1,239 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+
+import safetensors_io
+from edit_journal import EditTransaction
+
+st = pytest.importorskip("safetensors.numpy")
+
+DTYPES = {np.dtype(np.float32): "F32", np.dtype(np.float16): "F16", np.dtype(np.int32): "I32"}
+
+
+def sample_arrays():
+    rng = np.random.default_rng(0)
+    return {
+        "a": rng.standard_normal((4, 3)).astype(np.float32),
+        "b": np.arange(6, dtype=np.int32),
+        "c": rng.standard_normal(5).astype(np.float16),
+    }
+
+
+# 带预留头部空间的文件（与 viewer 保存的文件相同），可以原地提交
+def write_reserved(path, arrays):
+    entries = [(name, DTYPES[a.dtype], list(a.shape), [a.tobytes()]) for name, a in arrays.items()]
+    safetensors_io.write_file(str(path), {"format": "pt"}, entries)
+    return str(path)
+
+
+# safetensors 自身写出的文件头部没有空余，任何变长的修改都要重写
+def write_tight(path, arrays):
+    st.save_file(arrays, str(path))
+    return str(path)
+
+
+def generated(dtype, shape, initializer, value, seed):
+    data = b"".join(safetensors_io.generate_chunks(dtype, shape, initializer, value, seed))
+    return np.frombuffer(data, dtype=safetensors_io.numpy_dtype(dtype)).reshape(shape)
+
+
+def assert_tensors(path, expected):
+    loaded = st.load_file(path)
+    assert sorted(loaded) == sorted(expected)
+    for name, values in expected.items():
+        np.testing.assert_array_equal(loaded[name], values)
+
+
+def test_in_place_commit(tmp_path):
+    arrays = sample_arrays()
+    path = write_reserved(tmp_path / "m.safetensors", arrays)
+    layout = safetensors_io.read_layout(path)
+
+    transaction = EditTransaction(layout)
+    transaction.rename("a", "renamed")
+    transaction.set_values("b", np.arange(6)[::-1])
+    transaction.add("zeros", "F32", (2, 2))
+    transaction.add("noise", "F16", (3,), "normal", 0.5, seed=7)
+    committed = transaction.commit()
+
+    # 头部放得下：长度不变，原有张量的数据没有移动
+    assert committed.header_size == layout.header_size
+    assert committed.tensors["renamed"]["offsets"] == layout.tensors["a"]["offsets"]
+    assert not os.path.exists(safetensors_io.journal_path(path))
+    assert_tensors(path, {
+        "renamed": arrays["a"],
+        "b": np.arange(6, dtype=np.int32)[::-1],
+        "c": arrays["c"],
+        "zeros": np.zeros((2, 2), np.float32),
+        "noise": generated("F16", [3], "normal", 0.5, 7),
+    })
+    assert not transaction
+
+
+def test_rewrite_commit(tmp_path):
+    arrays = sample_arrays()
+    path = write_tight(tmp_path / "m.safetensors", arrays)
+    layout = safetensors_io.read_layout(path)
+
+    transaction = EditTransaction(layout)
+    transaction.delete("a")
+    transaction.rename("b", "a_much_longer_name_that_does_not_fit_in_the_original_header")
+    transaction.set_values("c", np.ones(5))
+    transaction.add("a", "F32", (4,), "constant", 2.5)
+    transaction.commit()
+
+    assert_tensors(path, {
+        "a_much_longer_name_that_does_not_fit_in_the_original_header": arrays["b"],
+        "c": np.ones(5, np.float16),
+        "a": np.full(4, 2.5, np.float32),
+    })
+    # 删除后数据区紧凑排列，没有残留的空洞
+    committed = safetensors_io.read_layout(path)
+    assert committed.data_size == sum(info["size"] for info in committed.tensors.values())
+    assert os.path.getsize(path) == committed.data_start + committed.data_size
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_header_growth_falls_back_to_rewrite(tmp_path):
+    arrays = sample_arrays()
+    path = write_tight(tmp_path / "m.safetensors", arrays)
+    layout = safetensors_io.read_layout(path)
+
+    transaction = EditTransaction(layout)
+    transaction.rename("c", "c" * 200)
+    committed = transaction.commit()
+
+    assert committed.header_size > layout.header_size
+    assert_tensors(path, {"a": arrays["a"], "b": arrays["b"], "c" * 200: arrays["c"]})
+
+
+def test_unaligned_header_commits_in_place(tmp_path):
+    # 其他工具写出的头部长度不一定是 8 的倍数
+    values = np.arange(4, dtype=np.float32)
+    header = json.dumps({"a": {"dtype": "F32", "shape": [4], "data_offsets": [0, 16]}}).encode()
+    header += b" " * (203 - len(header))
+    path = str(tmp_path / "m.safetensors")
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)) + header + values.tobytes())
+
+    transaction = EditTransaction(safetensors_io.read_layout(path))
+    transaction.rename("a", "b")
+    transaction.add("c", "F32", (2,), "ones")
+    committed = transaction.commit()
+
+    assert committed.header_size == 203
+    assert_tensors(path, {"b": values, "c": np.ones(2, np.float32)})
+
+
+def test_recover_after_interrupted_in_place_commit(tmp_path, monkeypatch):
+    arrays = sample_arrays()
+    path = write_reserved(tmp_path / "m.safetensors", arrays)
+    with open(path, "rb") as f:
+        original = f.read()
+
+    transaction = EditTransaction(safetensors_io.read_layout(path))
+    transaction.rename("a", "renamed")
+    transaction.set_values("b", np.zeros(6))
+    transaction.add("extra", "F32", (1024,), "ones")
+
+    # 数据和头部都已写入、日志还没提交时中断
+    def crash(path):
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(safetensors_io, "commit_journal", crash)
+    with pytest.raises(RuntimeError):
+        transaction.commit()
+    monkeypatch.undo()
+
+    assert os.path.exists(safetensors_io.journal_path(path))
+    with open(path, "rb") as f:
+        assert f.read() != original
+
+    assert safetensors_io.recover_journal(path)
+    with open(path, "rb") as f:
+        assert f.read() == original
+    assert not os.path.exists(safetensors_io.journal_path(path))
+    assert_tensors(path, arrays)
+
+
+def test_recover_ignores_incomplete_journal(tmp_path):
+    arrays = sample_arrays()
+    path = write_reserved(tmp_path / "m.safetensors", arrays)
+    layout = safetensors_io.read_layout(path)
+    with open(path, "rb") as f:
+        original = f.read()
+
+    # 日志写到一半中断：原文件还没有被修改，日志直接丢弃
+    safetensors_io.write_journal(path, [(8, layout.header_size)])
+    journal = safetensors_io.journal_path(path)
+    with open(journal, "r+b") as f:
+        f.truncate(os.path.getsize(journal) - len(safetensors_io.JOURNAL_END))
+
+    assert not safetensors_io.recover_journal(path)
+    assert not os.path.exists(journal)
+    with open(path, "rb") as f:
+        assert f.read() == original
+
+
+def test_interrupted_rewrite_keeps_original(tmp_path):
+    arrays = sample_arrays()
+    path = write_tight(tmp_path / "m.safetensors", arrays)
+    with open(path, "rb") as f:
+        original = f.read()
+
+    transaction = EditTransaction(safetensors_io.read_layout(path))
+    transaction.delete("a")
+
+    def cancel(done, total):
+        raise RuntimeError("cancelled")
+
+    with pytest.raises(RuntimeError):
+        transaction.commit(progress=cancel)
+    with open(path, "rb") as f:
+        assert f.read() == original
+    # 事务保持原样，可以再次提交
+    assert transaction
+    transaction.commit()
+    assert_tensors(path, {"b": arrays["b"], "c": arrays["c"]})
+
+
+@pytest.mark.parametrize("shape", [(-2, 3), (2.5,), (True, 4), ("3",)])
+def test_rejects_invalid_shapes(tmp_path, shape):
+    path = write_reserved(tmp_path / "m.safetensors", sample_arrays())
+    with open(path, "rb") as f:
+        original = f.read()
+
+    transaction = EditTransaction(safetensors_io.read_layout(path))
+    with pytest.raises(ValueError):
+        transaction.add("bad", "F32", shape)
+    assert not transaction
+    assert "bad" not in transaction.view()
+
+    with pytest.raises(ValueError):
+        safetensors_io.tensor_nbytes("F32", shape)
+    with pytest.raises(ValueError):
+        next(safetensors_io.generate_chunks("F32", shape))
+
+    transaction.commit()
+    with open(path, "rb") as f:
+        assert f.read() == original
+
+
+def test_rejects_invalid_operations(tmp_path):
+    path = write_reserved(tmp_path / "m.safetensors", sample_arrays())
+    transaction = EditTransaction(safetensors_io.read_layout(path))
+
+    with pytest.raises(KeyError):
+        transaction.rename("missing", "x")
+    with pytest.raises(ValueError):
+        transaction.rename("a", "b")
+    with pytest.raises(ValueError):
+        transaction.add("c", "F32", (1,))
+    with pytest.raises(ValueError):
+        transaction.add("d", "NOPE", (1,))
+    with pytest.raises(ValueError):
+        transaction.set_values("a", np.zeros(5))
+    assert not transaction
@@ -0,0 +1,60 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QFont
+from PyQt5.QtWidgets import (QDockWidget, QPlainTextEdit, QSplitter, QTableWidget, QTableWidgetItem,
+                             QHeaderView)
+
+import tracing
+
+# 面板中最多显示的区间数，更早的从表格顶部移除
+TRACE_PANEL_ROWS = 500
+
+COLUMNS = ["Span", "ms", "Bytes", "Throughput", "Thread", "Details"]
+
+
+# 调试面板：上方是按名字的汇总，下方是最近的区间，由主窗口定时把新记录的区间传进来
+class TracePanel(QDockWidget):
+    def __init__(self, parent=None):
+        super().__init__("Trace", parent)
+        self.setObjectName("trace_panel")
+
+        splitter = QSplitter(Qt.Vertical)
+        self.summary_view = QPlainTextEdit()
+        self.summary_view.setReadOnly(True)
+        self.summary_view.setFont(QFont("Consolas", 9))
+        splitter.addWidget(self.summary_view)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        splitter.addWidget(self.table)
+        self.setWidget(splitter)
+
+    def add_spans(self, spans):
+        for span in spans[-TRACE_PANEL_ROWS:]:
+            row = self.table.rowCount()
+            self.table.insertRow(row)
+            throughput = span.throughput
+            details = ", ".join(f"{key}={value}" for key, value in span.args.items())
+            cells = [
+                span.name,
+                f"{span.duration * 1000:.2f}",
+                f"{span.nbytes:,}" if span.nbytes else "",
+                f"{throughput / 1e6:.1f} MB/s" if throughput is not None else "",
+                span.thread_name,
+                details,
+            ]
+            for column, text in enumerate(cells):
+                self.table.setItem(row, column, QTableWidgetItem(text))
+        overflow = self.table.rowCount() - TRACE_PANEL_ROWS
+        for _ in range(max(0, overflow)):
+            self.table.removeRow(0)
+        if spans:
+            self.table.scrollToBottom()
+        self.summary_view.setPlainText(tracing.format_summary())
+
+    def clear(self):
+        self.table.setRowCount(0)
+        self.summary_view.clear()
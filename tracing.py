@@ -0,0 +1,185 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 可选的耗时记录：打开、读头部、解析 JSON、建树、读张量、统计和重写文件等步骤记为带字节数的区间，
+# 可以在界面的调试面板中实时查看，也可以导出为 Chrome trace（chrome://tracing 或 Perfetto 打开）
+#
+#   with tracing.span("header_read", path=path) as span:
+#       ...
+#       span.nbytes = len(data)
+#
+# 未开启时 span() 返回共享的空对象，开销只有一次函数调用
+
+# 设置了这个环境变量时启动即开始记录
+TRACE_ENV = "SAFETENSORS_VIEWER_TRACE"
+
+# 只保留最近的这么多个区间
+MAX_EVENTS = 100000
+
+_enabled = bool(os.environ.get(TRACE_ENV))
+_events = deque(maxlen=MAX_EVENTS)
+_sequence = itertools.count(1)
+_lock = threading.Lock()
+_origin = time.perf_counter()
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def clear():
+    _events.clear()
+
+
+def _format_bytes(nbytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1000:
+            return f"{nbytes:.1f} {unit}" if unit != "B" else f"{nbytes} B"
+        nbytes /= 1000
+    return f"{nbytes:.1f} TB"
+
+
+class Span:
+    __slots__ = ("name", "category", "args", "nbytes", "start", "end", "thread_id", "thread_name", "seq")
+
+    def __init__(self, name, category, nbytes, args):
+        self.name = name
+        self.category = category
+        self.nbytes = nbytes
+        self.args = args
+        self.start = self.end = None
+
+    def annotate(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        # 序号和入队一起加锁，保证队列按序号排列，增量读取时不会漏掉
+        with _lock:
+            self.seq = next(_sequence)
+            _events.append(self)
+        return False
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    # 字节/秒，没有字节数时为 None
+    @property
+    def throughput(self):
+        if not self.nbytes or self.duration <= 0:
+            return None
+        return self.nbytes / self.duration
+
+    def describe(self):
+        text = f"{self.name} {self.duration * 1000:.1f} ms"
+        if self.nbytes:
+            text += f", {_format_bytes(self.nbytes)}"
+            if self.throughput is not None:
+                text += f" at {_format_bytes(self.throughput)}/s"
+        return text
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    nbytes = property(lambda self: 0, lambda self, value: None)
+
+    def annotate(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, category="io", nbytes=0, **args):
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, category, nbytes, args)
+
+
+# 序号大于 since 的区间（按结束顺序），界面据此增量刷新
+def events(since=0):
+    return [event for event in list(_events) if event.seq > since]
+
+
+# 按名字汇总：次数、总耗时、总字节数
+def summary(spans=None):
+    totals = {}
+    for event in events() if spans is None else spans:
+        total = totals.setdefault(event.name, {"count": 0, "seconds": 0.0, "bytes": 0})
+        total["count"] += 1
+        total["seconds"] += event.duration
+        total["bytes"] += event.nbytes
+    return totals
+
+
+def format_summary(spans=None):
+    lines = [f"{'span':<18} {'count':>7} {'total ms':>11} {'bytes':>11} {'throughput':>13}"]
+    for name, total in sorted(summary(spans).items(), key=lambda item: -item[1]["seconds"]):
+        rate = ""
+        if total["bytes"] and total["seconds"] > 0:
+            rate = _format_bytes(total["bytes"] / total["seconds"]) + "/s"
+        size = _format_bytes(total["bytes"]) if total["bytes"] else ""
+        lines.append(f"{name:<18} {total['count']:>7,} {total['seconds'] * 1000:>11.1f} {size:>11} {rate:>13}")
+    return "\n".join(lines)
+
+
+# Chrome trace-event 格式：每个区间是一个完整事件（ph=X），时间单位为微秒
+def chrome_trace(spans=None):
+    spans = events() if spans is None else spans
+    pid = os.getpid()
+    trace = []
+    threads = {}
+    for event in spans:
+        threads[event.thread_id] = event.thread_name
+        args = dict(event.args)
+        if event.nbytes:
+            args["bytes"] = event.nbytes
+            if event.throughput is not None:
+                args["bytes_per_second"] = round(event.throughput)
+        trace.append({
+            "name": event.name,
+            "cat": event.category,
+            "ph": "X",
+            "ts": round((event.start - _origin) * 1e6, 3),
+            "dur": round(event.duration * 1e6, 3),
+            "pid": pid,
+            "tid": event.thread_id,
+            "args": {key: value if isinstance(value, (int, float, bool)) else str(value)
+                     for key, value in args.items()},
+        })
+    for thread_id, name in threads.items():
+        trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id, "args": {"name": name}})
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def dump_chrome_trace(path, spans=None):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(chrome_trace(spans), f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,249 @@
+import fnmatch
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import numpy as np
+
+import header_cache
+import safetensors_io
+import tensor_hash
+import tracing
+
+# 原地批量变换：通过可写的 memmap 按块读出、计算、写回，dtype 不变，内存占用与张量大小无关；
+# 所有张量的块一起放进线程池并行处理。块按窗口分批写入，每批写入前先把这一批的区间拷进撤销日志，
+# 写完 fsync 后提交：中途中断时只回滚当前这一批，之前的批次保持已修改的状态，额外的磁盘占用不超过一个窗口。
+# atomic=True 时整个操作只有一个窗口，取消或中断时全部回滚，代价是日志要先拷贝全部目标数据
+# （需要同样大小的空闲磁盘空间，读写量翻倍）
+#
+# 操作用元组表示，与 EditTransaction 的操作日志一致：
+#   ("scale", 因子)  ("add", 值)  ("clamp", 下限, 上限)  ("replace_nan", 值)
+#   ("zero", 切片文本)  ("copy", 源张量名)
+OPERATIONS = {
+    "scale": "scale FACTOR",
+    "add": "add VALUE",
+    "clamp": "clamp MIN MAX",
+    "replace_nan": "replace_nan VALUE",
+    "zero": "zero [SLICE]    e.g. zero 0:16, :",
+    "copy": "copy SOURCE_TENSOR",
+}
+
+# 每个块的字节数
+TRANSFORM_CHUNK_SIZE = 16 * 1024 * 1024
+
+# 每批写入（一份撤销日志）覆盖的字节数
+TRANSFORM_WINDOW_SIZE = 256 * 1024 * 1024
+
+FLOAT_DTYPES = {"F64", "F32", "F16", "BF16", "F8_E4M3", "F8_E5M2"}
+
+
+def parse_operation(text):
+    name, _, rest = text.strip().partition(" ")
+    rest = rest.strip()
+    try:
+        if name in ("scale", "add", "replace_nan"):
+            return (name, float(rest))
+        if name == "clamp":
+            low, high = (float(part) for part in rest.replace(",", " ").split())
+            if low > high:
+                raise ValueError(f"clamp: {low} > {high}")
+            return (name, low, high)
+    except ValueError as e:
+        raise ValueError(f"Invalid arguments for '{name}' (usage: {OPERATIONS[name]})") from e
+    if name == "zero":
+        return (name, rest)
+    if name == "copy":
+        if not rest:
+            raise ValueError(f"Usage: {OPERATIONS['copy']}")
+        return (name, rest)
+    raise ValueError(f"Unknown operation '{name}' (expected one of: {', '.join(OPERATIONS)})")
+
+
+def describe(operation):
+    return " ".join(str(part) for part in operation)
+
+
+# 操作能否用于该 dtype：算术操作不用于 BOOL，replace_nan 只用于浮点
+def applicable(operation, dtype):
+    kind = operation[0]
+    if kind in ("zero", "copy"):
+        return True
+    if kind == "replace_nan":
+        return dtype in FLOAT_DTYPES
+    return dtype != "BOOL"
+
+
+def _apply(operation, values):
+    kind = operation[0]
+    if kind == "scale":
+        return values * operation[1]
+    if kind == "add":
+        return values + operation[1]
+    if kind == "clamp":
+        return np.clip(values, operation[1], operation[2])
+    if kind == "replace_nan":
+        return np.where(np.isnan(values), operation[1], values)
+    raise ValueError(f"Unknown operation '{kind}'")
+
+
+def _encode(values, dtype):
+    # 整数类型四舍五入并饱和到取值范围内，浮点类型由 encode_array 处理
+    if dtype in safetensors_io.NUMPY_DTYPES and np.issubdtype(safetensors_io.NUMPY_DTYPES[dtype], np.integer):
+        limits = np.iinfo(safetensors_io.NUMPY_DTYPES[dtype])
+        values = np.clip(np.rint(values), limits.min, limits.max)
+    return np.frombuffer(safetensors_io.encode_array(values, dtype), dtype=safetensors_io.storage_dtype(dtype))
+
+
+def _map(layout, info, mode):
+    numel = math.prod(info["shape"])
+    return np.memmap(layout.path, dtype=safetensors_io.storage_dtype(info["dtype"]), mode=mode,
+                     offset=layout.data_start + info["offsets"][0], shape=(numel,))
+
+
+# 名字匹配 glob 的所有张量
+def select(model, pattern):
+    return [name for name, _, _ in model.items() if fnmatch.fnmatchcase(name, pattern)]
+
+
+# 把块按顺序分成每批不超过 limit 字节的窗口（单个块超过时自成一批）
+def _windows(jobs, limit):
+    window = []
+    size = 0
+    for job in jobs:
+        if window and size + job[5] > limit:
+            yield window
+            window = []
+            size = 0
+        window.append(job)
+        size += job[5]
+    if window:
+        yield window
+
+
+# 对 names 中的张量原地执行 operation，dtype 不适用的张量跳过；返回 {"tensors", "bytes", "skipped"}
+# progress(done_bytes, total_bytes) 可抛出异常取消，当前批次已写入的块立即由撤销日志回滚；
+# atomic=True 时回滚整个操作
+def apply(model, names, operation, workers=None, progress=None, atomic=False):
+    names = set(names)
+    targets = []
+    skipped = []
+    for name in names:
+        layout, info = model.locate(name)
+        if info["size"] and applicable(operation, info["dtype"]):
+            targets.append((name, layout, info))
+        elif info["size"]:
+            skipped.append(name)
+
+    source = None
+    if operation[0] == "copy":
+        source = model.locate(operation[1])
+        if operation[1] in names:
+            raise ValueError("The copy source cannot also be a target")
+        for name, _, info in targets:
+            if list(info["shape"]) != list(source[1]["shape"]):
+                raise ValueError(f"Shape of '{name}' {info['shape']} differs from the source {source[1]['shape']}")
+    index_of = {}
+    if operation[0] == "zero":
+        # 切片先在所有目标上解析一遍，写入前发现错误
+        for name, _, info in targets:
+            index = safetensors_io.parse_slice(operation[1], len(info["shape"]))
+            try:
+                np.broadcast_to(np.uint8(0), info["shape"])[index]
+            except IndexError as e:
+                raise ValueError(f"Invalid slice for '{name}': {e}") from e
+            index_of[name] = index
+
+    # 切片清零每个张量一个任务，其余按块拆分
+    jobs = []
+    for name, layout, info in targets:
+        if operation[0] == "zero":
+            jobs.append((name, layout, info, 0, 0, info["size"]))
+            continue
+        step = max(1, TRANSFORM_CHUNK_SIZE // safetensors_io.DTYPE_SIZES[info["dtype"]])
+        numel = math.prod(info["shape"])
+        for start in range(0, numel, step):
+            end = min(numel, start + step)
+            jobs.append((name, layout, info, start, end, (end - start) * safetensors_io.DTYPE_SIZES[info["dtype"]]))
+
+    by_file = {}
+    for name, layout, info in targets:
+        by_file.setdefault(layout.path, (layout, []))[1].append((name, info))
+    # 未受影响张量的哈希在写入后保留下来
+    changed = {name for name, _, _ in targets}
+    kept_hashes = {path: {name: digest for name, digest in tensor_hash.load_sidecar(path).items()
+                          if name not in changed}
+                   for path in by_file}
+
+    def work(job):
+        name, layout, info, start, end, _ = job
+        mapped = _map(layout, info, "r+")
+        if operation[0] == "zero":
+            mapped.reshape(info["shape"])[index_of[name]] = 0
+        elif operation[0] == "copy":
+            src_layout, src_info = source
+            values = safetensors_io.decode_raw(_map(src_layout, src_info, "r")[start:end], src_info["dtype"])
+            mapped[start:end] = _encode(values, info["dtype"])
+        else:
+            values = safetensors_io.decode_raw(mapped[start:end], info["dtype"])
+            mapped[start:end] = _encode(_apply(operation, values), info["dtype"])
+        mapped.flush()
+
+    total = sum(job[5] for job in jobs)
+    done = 0
+    workers = workers or os.cpu_count() or 1
+    limit = total if atomic else TRANSFORM_WINDOW_SIZE
+    with tracing.span("transform", "model", nbytes=total, operation=describe(operation), tensors=len(targets)), \
+            ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as executor:
+        for window in _windows(jobs, limit):
+            # 只记录这一批会写入的区间（切片清零整个张量作为一个区间）
+            ranges = {}
+            for name, layout, info, start, _, nbytes in window:
+                offset = layout.data_start + info["offsets"][0] + start * safetensors_io.DTYPE_SIZES[info["dtype"]]
+                ranges.setdefault(layout.path, []).append((offset, nbytes))
+            for path, path_ranges in ranges.items():
+                safetensors_io.write_journal(path, path_ranges)
+            try:
+                # 按窗口提交，排队的块数与模型大小无关
+                pending = {}
+                queue = iter(window)
+                try:
+                    for job in queue:
+                        pending[executor.submit(work, job)] = job
+                        if len(pending) >= workers * 2:
+                            break
+                    while pending:
+                        future = next(as_completed(pending))
+                        job = pending.pop(future)
+                        future.result()
+                        done += job[5]
+                        if progress is not None:
+                            progress(done, total)
+                        for job in queue:
+                            pending[executor.submit(work, job)] = job
+                            break
+                finally:
+                    for future in pending:
+                        future.cancel()
+                    # 已经开始的块写完之后才能回滚
+                    wait(pending)
+            except BaseException:
+                # 取消或出错：这一批已经写入的块从撤销日志恢复
+                for path in ranges:
+                    safetensors_io.recover_journal(path)
+                raise
+
+            for path in ranges:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                safetensors_io.commit_journal(path)
+
+        for path, (layout, _) in by_file.items():
+            # 头部没有变，重新写入缓存，下次打开不必再解析
+            header_cache.store(layout)
+            if kept_hashes[path]:
+                tensor_hash.save_sidecar(path, kept_hashes[path])
+
+    return {"tensors": len(targets), "bytes": total, "skipped": skipped}
@@ -0,0 +1,233 @@
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor, QFont
+
+from module_tree import ModuleFilter, RepeatGroup, build_module_tree, display_entries
+
+# 每次 fetchMore 创建的行数，滚动时按需继续创建
+FETCH_BATCH = 256
+
+# 张量数不超过该值时默认展开第一层
+AUTO_EXPAND_LIMIT = 2000
+
+GROUP = "group"
+TENSOR = "tensor"
+METADATA = "metadata"
+METADATA_ITEM = "metadata_item"
+
+HEADERS = ["Layer/Parameter", "Shape", "Type", "Size"]
+
+
+def _contains(module, name):
+    if isinstance(module, RepeatGroup):
+        return any(_contains(member, name) for member in module.members)
+    return name.startswith(module.path + ".")
+
+
+class TreeNode:
+    __slots__ = ("parent", "row", "kind", "name", "payload", "children", "entries")
+
+    def __init__(self, parent, row, kind, name, payload=None, entries=None):
+        self.parent = parent
+        self.row = row
+        self.kind = kind
+        self.name = name
+        # GROUP: ModuleNode/RepeatGroup；TENSOR: 张量表中的行号；METADATA_ITEM: 元数据的值
+        self.payload = payload
+        # entries 是全部子项的轻量描述 (kind, name, payload)，第一次用到时才生成；
+        # children 是已经创建的前若干个节点
+        self.children = []
+        self.entries = entries
+
+
+# 虚拟化的树模型：节点只在展开/滚动到时才创建
+class TensorTreeModel(QAbstractItemModel):
+    def __init__(self, table, metadata=None, parent=None):
+        super().__init__(parent)
+        self.table = table
+        self.metadata = metadata or {}
+        # 搜索结果的行号，None 表示显示全部
+        self.rows = None
+        self.root = TreeNode(None, 0, GROUP, "")
+        # 已经创建的张量节点：行号 -> 节点，局部刷新时用来找到对应的行
+        self.tensor_nodes = {}
+        self.build()
+
+    # modules 为已经构建好的完整模块树（在工作线程中构建，或在原来的树上局部更新过），否则在这里构建；
+    # 有搜索结果时在这棵树上过滤，不再另建一棵树
+    def build(self, modules=None):
+        self.modules = modules if modules is not None else build_module_tree(self.table)
+        shown = self.modules if self.rows is None else ModuleFilter(self.modules, self.table, self.rows).root
+        top = []
+        if self.metadata and self.rows is None:
+            top.append((METADATA, "Metadata", list(self.metadata.items())))
+        top.extend(self._module_entries(shown))
+        self.root = TreeNode(None, 0, GROUP, "", payload=shown, entries=top)
+        self.tensor_nodes = {}
+
+    def reset(self, table, metadata=None, rows=None, modules=None):
+        self.beginResetModel()
+        self.table = table
+        self.metadata = metadata or {}
+        self.rows = rows
+        self.build(modules)
+        self.endResetModel()
+
+    def _module_entries(self, module):
+        return [(TENSOR, name, item) if isinstance(item, int) else (GROUP, name, item)
+                for name, item in display_entries(module, self.table)]
+
+    def entries(self, node):
+        if node.entries is None:
+            if node.kind == GROUP:
+                node.entries = self._module_entries(node.payload)
+            elif node.kind == METADATA:
+                node.entries = [(METADATA_ITEM, key, value) for key, value in node.payload]
+            else:
+                node.entries = []
+        return node.entries
+
+    def _make_child(self, parent, row, entry):
+        kind, name, payload = entry
+        node = TreeNode(parent, row, kind, name, payload=payload)
+        if kind == TENSOR:
+            self.tensor_nodes[payload] = node
+        return node
+
+    # 张量表中这些行的内容变了（结构不变）：只刷新已经创建的对应行
+    def refresh_rows(self, rows):
+        for row in rows:
+            node = self.tensor_nodes.get(row)
+            if node is not None:
+                self.dataChanged.emit(self.createIndex(node.row, 0, node),
+                                      self.createIndex(node.row, len(HEADERS) - 1, node))
+
+    # 节点的键：模块用路径，重新构建后用来恢复展开状态
+    def node_key(self, node):
+        if node.kind == GROUP:
+            return node.payload.path
+        if node.kind == TENSOR:
+            return self.table.names[node.payload]
+        return node.name
+
+    # 按名字找到张量所在的行，沿途创建需要的节点；找不到时返回无效的索引。
+    # 待删除的张量与新张量同名时找的是索引指向的有效的那一行
+    def find(self, name, parent=QModelIndex()):
+        target = self.table.index.get(name)
+        self.fetch_all(parent)
+        for row in range(self.rowCount(parent)):
+            index = self.index(row, 0, parent)
+            node = self.node(index)
+            if node.kind == TENSOR and node.payload == target:
+                return index
+            if node.kind == GROUP and _contains(node.payload, name):
+                found = self.find(name, index)
+                if found.isValid():
+                    return found
+        return QModelIndex()
+
+    def node(self, index):
+        if index.isValid():
+            return index.internalPointer()
+        return self.root
+
+    def full_name(self, node):
+        if node.kind != TENSOR:
+            return None
+        return self.table.names[node.payload]
+
+    # ---- QAbstractItemModel ----
+
+    def index(self, row, column, parent=QModelIndex()):
+        parent_node = self.node(parent)
+        if row < 0 or row >= len(parent_node.children):
+            return QModelIndex()
+        return self.createIndex(row, column, parent_node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent_node = index.internalPointer().parent
+        if parent_node is None or parent_node is self.root:
+            return QModelIndex()
+        return self.createIndex(parent_node.row, 0, parent_node)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(HEADERS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if node.entries is not None:
+            return bool(node.entries)
+        # 不为判断是否有子项而生成子项列表
+        return node.kind in (GROUP, METADATA) and bool(node.payload.entries if node.kind == GROUP else node.payload)
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return len(node.children) < len(self.entries(node))
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        start = len(node.children)
+        batch = self.entries(node)[start:start + FETCH_BATCH]
+        if not batch:
+            return
+        self.beginInsertRows(parent, start, start + len(batch) - 1)
+        node.children.extend(self._make_child(node, start + i, entry) for i, entry in enumerate(batch))
+        self.endInsertRows()
+
+    def fetch_all(self, parent=QModelIndex()):
+        while self.canFetchMore(parent):
+            self.fetchMore(parent)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        column = index.column()
+
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return node.name
+            if node.kind == TENSOR:
+                row = node.payload
+                return [None, str(list(self.table.shape(row))), self.table.dtype(row),
+                        f"{self.table.sizes[row]} bytes"][column]
+            if node.kind == METADATA:
+                return "dict" if column == 2 else ""
+            if node.kind == METADATA_ITEM:
+                return [None, "", str(type(node.payload)), str(node.payload)][column]
+            # 模块直接显示预先算好的统计量
+            return [None, f"{node.payload.tensors} tensors", "", f"{node.payload.bytes} bytes"][column]
+
+        if role == Qt.BackgroundRole and column == 0 and node.kind in (GROUP, METADATA):
+            return QColor("#e3f2fd")
+
+        if node.kind == TENSOR:
+            status = self.table.status(node.payload)
+            if not status:
+                return None
+            # 待提交的修改：新增为绿色，重命名/修改为橙色，待删除为灰色删除线
+            if role == Qt.ForegroundRole:
+                if "deleted" in status:
+                    return QColor("#9E9E9E")
+                if "added" in status:
+                    return QColor("#2E7D32")
+                return QColor("#EF6C00")
+            if role == Qt.FontRole:
+                font = QFont("Consolas", 10)
+                font.setItalic(True)
+                font.setStrikeOut("deleted" in status)
+                return font
+            if role == Qt.ToolTipRole:
+                return "Pending: " + ", ".join(sorted(status))
+        return None
@@ -0,0 +1,236 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+import safetensors_io
+import tensor_hash
+import tracing
+
+# 头部校验：所有张量的偏移、形状和 dtype 放进 numpy 数组一次性检查，打开文件时执行，常见模型只需几毫秒；
+# 深度校验：分块并行读取全部数据，统计 NaN/Inf，并与旁路文件（或给定的参考）中的哈希比较
+#
+# 问题以 (级别, 文件, 张量名, 说明) 表示，级别为 "error" 或 "warning"，与整个文件有关的问题张量名为 None
+
+ERROR = "error"
+WARNING = "warning"
+
+# 同一类问题最多逐个列出的张量数，其余的合并成一条
+MAX_LISTED = 20
+
+FLOAT_DTYPES = {"F64", "F32", "F16", "BF16", "F8_E4M3", "F8_E5M2"}
+
+
+def _report(issues, level, path, names, rows, message):
+    # message 可以是字符串，也可以是 row -> 字符串 的函数
+    rows = np.asarray(rows).tolist()
+    for row in rows[:MAX_LISTED]:
+        issues.append((level, path, names[row], message(row) if callable(message) else message))
+    if len(rows) > MAX_LISTED:
+        text = message(rows[MAX_LISTED]) if callable(message) else message
+        issues.append((level, path, None, f"{len(rows) - MAX_LISTED:,} more tensor(s): {text}"))
+
+
+# 校验单个文件的头部；file_size 默认取磁盘上的大小
+def validate_layout(layout, file_size=None):
+    path = layout.path
+    issues = []
+    if file_size is None:
+        file_size = os.path.getsize(path)
+    data_size = file_size - layout.data_start
+    if data_size < 0:
+        return [(ERROR, path, None, f"File is truncated inside the header ({file_size:,} bytes)")]
+
+    # 头部已经是列式的张量表（见 safetensors_io.TensorColumns），直接在各列上检查
+    columns = layout.tensors
+    names = columns.names
+    count = len(names)
+    if not count:
+        if data_size:
+            issues.append((WARNING, path, None, f"{data_size:,} bytes after the header but no tensors"))
+        return issues
+
+    offsets = columns.offsets
+    ndims = columns.ndims.astype(np.int64)
+    dims = columns.dims
+    dtype_names = columns.dtype_names
+    itemsizes = np.array([safetensors_io.DTYPE_SIZES.get(dtype, 0) for dtype in dtype_names],
+                         dtype=np.int64)[columns.dtype_codes]
+
+    _report(issues, ERROR, path, names, np.flatnonzero(itemsizes == 0),
+            lambda row: f"Unknown dtype '{dtype_names[columns.dtype_codes[row]]}'")
+
+    owners = np.repeat(np.arange(count), ndims)
+    _report(issues, ERROR, path, names, np.unique(owners[dims < 0]), "Negative dimension in shape")
+
+    # 元素数用浮点数再算一遍，超出 int64 的形状单独报告
+    numels = np.ones(count, dtype=np.int64)
+    np.multiply.at(numels, owners, np.maximum(dims, 0))
+    approx = np.ones(count, dtype=np.float64)
+    np.multiply.at(approx, owners, np.maximum(dims, 0).astype(np.float64))
+    huge = approx * np.maximum(itemsizes, 1) >= 2 ** 62
+    _report(issues, ERROR, path, names, np.flatnonzero(huge), "Shape is too large")
+
+    begins, ends = offsets[:, 0], offsets[:, 1]
+    sizes = ends - begins
+    _report(issues, ERROR, path, names, np.flatnonzero((begins < 0) | (sizes < 0)),
+            lambda row: f"Invalid data_offsets [{begins[row]}, {ends[row]}]")
+
+    expected = numels * itemsizes
+    mismatch = (itemsizes > 0) & ~huge & (sizes >= 0) & (sizes != expected)
+    _report(issues, ERROR, path, names, np.flatnonzero(mismatch),
+            lambda row: f"Data is {sizes[row]:,} bytes but {dtype_names[columns.dtype_codes[row]]}{columns.info(row)['shape']} "
+                        f"needs {expected[row]:,}")
+
+    _report(issues, ERROR, path, names, np.flatnonzero(ends > data_size),
+            lambda row: f"Data ends at {ends[row]:,} but the file only holds {data_size:,} bytes of data")
+
+    # 按起始偏移排序后检查相邻区间：重叠是错误，空隙能读取但 safetensors 库会拒绝
+    order = np.argsort(begins, kind="stable")
+    sorted_begins, sorted_ends = begins[order], ends[order]
+    overlap = np.flatnonzero(sorted_begins[1:] < sorted_ends[:-1]) + 1
+    _report(issues, ERROR, path, names, order[overlap],
+            lambda row: "Data overlaps the previous tensor")
+    gaps = np.flatnonzero(sorted_begins[1:] > sorted_ends[:-1]) + 1
+    _report(issues, WARNING, path, names, order[gaps],
+            "Unused bytes before this tensor (rejected by the safetensors library)")
+    if sorted_begins[0] > 0:
+        issues.append((WARNING, path, names[order[0]],
+                       f"Data starts at offset {sorted_begins[0]:,} instead of 0 (rejected by the safetensors library)"))
+
+    data_end = int(ends.max())
+    if data_end > data_size:
+        issues.insert(0, (ERROR, path, None,
+                          f"File is truncated: the header describes {data_end:,} bytes of data, "
+                          f"the file has {data_size:,}"))
+    elif data_end < data_size:
+        issues.append((WARNING, path, None,
+                       f"{data_size - data_end:,} trailing bytes after the last tensor "
+                       f"(rejected by the safetensors library)"))
+    return issues
+
+
+def validate_model(model):
+    issues = []
+    with tracing.span("validate", "model", tensors=len(model)):
+        for layout in model.layouts.values():
+            issues.extend(validate_layout(layout))
+    return issues
+
+
+def has_errors(issues):
+    return any(issue[0] == ERROR for issue in issues)
+
+
+# 深度校验：按哈希的分块方式并行读取，每块同时计算摘要和 NaN/Inf 数量，数据只读一遍；
+# reference 为 name -> hex（例如另一份拷贝的 .hashes.json），默认使用各文件旁路缓存中的哈希
+# progress(done_bytes, total_bytes) 可抛出异常取消
+def deep_check(model, reference=None, workers=None, progress=None):
+    issues = validate_model(model)
+    jobs = []
+    parts = {}
+    expected = {}
+    for path, layout in model.layouts.items():
+        stored = reference if reference is not None else tensor_hash.load_sidecar(path)
+        data_size = os.path.getsize(path) - layout.data_start
+        for name, info in layout.tensors.items():
+            if name in stored:
+                expected[(path, name)] = stored[name]
+            size = info["size"]
+            if info["offsets"][1] > data_size or size < 0 or info["dtype"] not in safetensors_io.DTYPE_SIZES:
+                # 头部校验已经报告过，不再读取
+                continue
+            starts = range(0, size, tensor_hash.HASH_CHUNK_SIZE) if size else range(1)
+            parts[(path, name)] = [None] * len(starts)
+            for i, offset in enumerate(starts):
+                jobs.append((path, name, info["dtype"], i, layout.data_start + info["offsets"][0] + offset,
+                             min(tensor_hash.HASH_CHUNK_SIZE, size - offset)))
+
+    nonfinite = {}
+    hashed = {}
+    fds = {}
+    try:
+        for path in model.layouts:
+            fds[path] = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+
+        def work(job):
+            path, name, dtype, _, offset, length = job
+            data = os.pread(fds[path], length, offset)
+            if len(data) != length:
+                raise ValueError(f"Tensor '{name}' data is truncated")
+            digest = hashlib.blake2b(data, digest_size=tensor_hash.DIGEST_SIZE).digest()
+            nans = infs = 0
+            if dtype in FLOAT_DTYPES and data:
+                values = safetensors_io.decode_array(data, dtype)
+                nans = int(np.count_nonzero(np.isnan(values)))
+                infs = int(np.count_nonzero(np.isinf(values)))
+            return digest, nans, infs
+
+        total = sum(job[5] for job in jobs)
+        done = 0
+        workers = workers or os.cpu_count() or 1
+        with tracing.span("deep_check", "model", nbytes=total), \
+                ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as executor:
+            # 按窗口提交，排队的块数与模型大小无关
+            pending = {}
+            queue = iter(jobs)
+            try:
+                for job in queue:
+                    pending[executor.submit(work, job)] = job
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    future = next(as_completed(pending))
+                    job = pending.pop(future)
+                    path, name, _, i = job[:4]
+                    try:
+                        digest, nans, infs = future.result()
+                    except (OSError, ValueError) as e:
+                        # 同一个张量只报告第一个读不出的块
+                        if parts.pop((path, name), None) is not None:
+                            issues.append((ERROR, path, name, f"Unreadable: {e}"))
+                    else:
+                        if nans or infs:
+                            counts = nonfinite.setdefault((path, name), [0, 0])
+                            counts[0] += nans
+                            counts[1] += infs
+                        chunks = parts.get((path, name))
+                        if chunks is not None:
+                            chunks[i] = digest
+                            if all(chunk is not None for chunk in chunks):
+                                hashed[(path, name)] = hashlib.blake2b(
+                                    b"".join(chunks), digest_size=tensor_hash.DIGEST_SIZE).hexdigest()
+                                del parts[(path, name)]
+                    done += job[5]
+                    if progress is not None:
+                        progress(done, total)
+                    for job in queue:
+                        pending[executor.submit(work, job)] = job
+                        break
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+
+    for (path, name), (nans, infs) in sorted(nonfinite.items()):
+        issues.append((WARNING, path, name, f"{nans:,} NaN and {infs:,} Inf values"))
+    compared = 0
+    for key, digest in sorted(hashed.items()):
+        if key in expected:
+            compared += 1
+            if digest != expected[key]:
+                issues.append((ERROR, key[0], key[1], "Content hash does not match the stored hash"))
+    return {"issues": issues, "tensors": len(model), "bytes": total, "hashes_compared": compared}
+
+
+def format_issues(issues):
+    if not issues:
+        return "No problems found"
+    lines = []
+    for level, path, name, message in issues:
+        where = os.path.basename(path) + (f": {name}" if name is not None else "")
+        lines.append(f"{level}: {where}: {message}")
+    return "\n".join(lines)
@@ -1,20 +1,63 @@
+import gc
 import sys
-import json
-import struct
+import re
+import time
 import numpy as np
-import os
-import shutil
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QTreeWidget, 
-                            QTreeWidgetItem, QSplitter, QTextEdit, 
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QTreeView, 
+                            QSplitter, QTextEdit, 
                             QFileDialog, QVBoxLayout, QWidget, 
                             QHeaderView, QLabel, QHBoxLayout, QStatusBar,
                             QPushButton, QMessageBox, QInputDialog,
-                            QMenu, QAction)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QPalette, QColor
-from safetensors import safe_open
-from safetensors.torch import save_file
-import torch
+                            QMenu, QAction, QProgressBar, QLineEdit, QCheckBox)
+from PyQt5.QtCore import Qt, QTimer, QModelIndex
+from PyQt5.QtGui import QFont
+import safetensors_io
+import convert
+import model_core
+import model_diff
+import reshard
+import tensor_hash
+import tracing
+import transforms
+import validate
+from tensor_table import TensorTable
+from module_tree import RepeatGroup, build_module_tree, update_module_tree
+from tree_model import TensorTreeModel, TENSOR, GROUP, METADATA_ITEM, AUTO_EXPAND_LIMIT
+from workers import TaskRunner
+from file_watch import FileWatcher
+import tensor_stats
+from tensor_search import SearchIndex
+from slice_view import SliceViewerDialog
+from heatmap_view import HeatmapDialog
+from trace_panel import TracePanel
+
+# 输入停顿多久后执行搜索
+SEARCH_DELAY_MS = 150
+
+# 匹配数不超过该值时展开所有匹配的模块
+SEARCH_EXPAND_LIMIT = 200
+
+# 打开时头部有错误，提示框中最多列出的行数
+MAX_ISSUE_LINES = 15
+
+# 会读写打开的文件的后台任务，运行期间的外部改写在结束后统一处理
+FILE_TASKS = ("load", "save", "transform", "reload")
+
+# 记录耗时时刷新状态栏和调试面板的间隔
+TRACE_REFRESH_MS = 500
+
+# 在工作线程中构建完整的模块树，并预先算好各模块的结构签名，展开时折叠重复块不必再遍历子树
+def prepare_modules(table):
+    modules = build_module_tree(table)
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        modules.signature(table)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return modules
+
 
 class SafetensorsViewer(QMainWindow):
     def __init__(self):
@@ -55,8 +98,24 @@ class SafetensorsViewer(QMainWindow):
         self.add_tensor_action.triggered.connect(self.add_tensor)
         self.add_tensor_action.setEnabled(False)
         
+        # 按名字模式批量原地修改数据
+        self.bulk_edit_action = self.toolbar.addAction("Bulk Edit")
+        self.bulk_edit_action.triggered.connect(lambda: self.bulk_edit())
+        self.bulk_edit_action.setEnabled(False)
+        
         self.toolbar.addSeparator()
         
+        # 撤销/重做待提交的修改
+        self.undo_action = self.toolbar.addAction("Undo")
+        self.undo_action.setShortcut("Ctrl+Z")
+        self.undo_action.triggered.connect(self.undo_change)
+        self.undo_action.setEnabled(False)
+        
+        self.redo_action = self.toolbar.addAction("Redo")
+        self.redo_action.setShortcut("Ctrl+Y")
+        self.redo_action.triggered.connect(self.redo_change)
+        self.redo_action.setEnabled(False)
+        
         # 创建状态栏
         self.statusBar = QStatusBar()
         self.setStatusBar(self.statusBar)
@@ -69,6 +128,37 @@ class SafetensorsViewer(QMainWindow):
             }
         """)
         
+        # 后台任务的进度条和取消按钮
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.hide()
+        self.statusBar.addPermanentWidget(self.progress_bar)
+        
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_tasks)
+        self.cancel_button.hide()
+        self.statusBar.addPermanentWidget(self.cancel_button)
+        
+        # 开启耗时记录时显示最近结束的区间
+        self.trace_label = QLabel()
+        self.trace_label.hide()
+        self.statusBar.addPermanentWidget(self.trace_label)
+        self.trace_panel = None
+        self.trace_seq = 0
+        self.trace_timer = QTimer(self)
+        self.trace_timer.setInterval(TRACE_REFRESH_MS)
+        self.trace_timer.timeout.connect(self.refresh_trace)
+        
+        # 文件读写都在后台线程中进行，避免阻塞界面
+        self.workers = TaskRunner(self)
+        self.workers.busy_changed.connect(self.on_busy_changed)
+        self.workers.settled.connect(self.on_task_settled)
+        
+        # 监视模式：文件被改写后只重新读取头部，按差异更新树
+        self.file_watcher = FileWatcher(self)
+        self.file_watcher.changed.connect(self.on_file_changed)
+        
         # 创建水平分割器
         self.h_splitter = QSplitter(Qt.Horizontal)
         self.layout.addWidget(self.h_splitter)
@@ -78,12 +168,26 @@ class SafetensorsViewer(QMainWindow):
         self.left_layout = QVBoxLayout()
         self.left_panel.setLayout(self.left_layout)
         
+        # 搜索框：输入停顿后查询索引并只显示匹配的张量
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Search: name, glob, /regex/, dtype:F16 shape:4096,* size>1MB")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.search_edit.textChanged.connect(self.search_timer.start)
+        self.left_layout.addWidget(self.search_edit)
+        
         # 创建层级树形视图
-        self.tree = QTreeWidget()
-        self.tree.setHeaderLabels(["Layer/Parameter", "Shape", "Type", "Size"])
-        self.tree.header().setSectionResizeMode(QHeaderView.ResizeToContents)
+        # 虚拟化的树：行在展开/滚动时才创建
+        self.tree = QTreeView()
+        self.tree_model = TensorTreeModel(TensorTable({}))
+        self.tree.setModel(self.tree_model)
+        self.tree.setUniformRowHeights(True)
+        self.tree.header().setSectionResizeMode(QHeaderView.Interactive)
         self.tree.setFont(QFont("Consolas", 10))
-        self.tree.itemClicked.connect(self.on_item_clicked)
+        self.tree.clicked.connect(self.on_item_clicked)
         self.left_layout.addWidget(self.tree)
         
         # 右侧面板
@@ -100,6 +204,34 @@ class SafetensorsViewer(QMainWindow):
         self.detail_label.setFont(QFont("Arial", 11, QFont.Bold))
         self.detail_header_layout.addWidget(self.detail_label)
         
+        # 分页查看大张量的数据
+        self.view_data_button = QPushButton("View Data")
+        self.view_data_button.setEnabled(False)
+        self.view_data_button.clicked.connect(self.view_tensor_data)
+        self.view_data_button.setStyleSheet("""
+            QPushButton {
+                background-color: #2196F3;
+                color: white;
+                border: none;
+                padding: 5px 15px;
+                border-radius: 3px;
+            }
+            QPushButton:hover {
+                background-color: #1976D2;
+            }
+            QPushButton:disabled {
+                background-color: #BDBDBD;
+            }
+        """)
+        self.detail_header_layout.addWidget(self.view_data_button)
+        
+        # 二维及以上的张量显示缩略热力图
+        self.heatmap_button = QPushButton("Heatmap")
+        self.heatmap_button.setEnabled(False)
+        self.heatmap_button.clicked.connect(self.show_heatmap)
+        self.heatmap_button.setStyleSheet(self.view_data_button.styleSheet())
+        self.detail_header_layout.addWidget(self.heatmap_button)
+        
         # 添加编辑和保存按钮
         self.edit_button = QPushButton("Edit Value")
         self.edit_button.setEnabled(False)
@@ -161,10 +293,24 @@ class SafetensorsViewer(QMainWindow):
         self.create_menu()
         
         # 初始化变量
-        self.file_data = {}
         self.file_path = ""
+        self.model = None
+        self.search_index = None
+        self.layouts = {}
+        self.metadata = {}
+        self.table = TensorTable({})
+        # 完整的模块树（不含搜索过滤），清空搜索时直接使用
+        self.modules = None
+        self.transaction = None
         self.current_tensor = None
-        self.modified_tensors = {}
+        self.current_values = None
+        self.detail_sections = ["", "", ""]
+        self.data_target = None
+        self.data_dialogs = []
+        # 磁盘上的名字 -> (抽样指纹, 统计结果)，重新加载时只保留所在文件没被改写的
+        self.stats_cache = {}
+        # 文件被改写后抽样指纹仍相同的张量的旧统计，重新计算完成前标为"可能没变"显示
+        self.probable_stats = {}
         
         # 设置样式
         self.setup_style()
@@ -175,12 +321,12 @@ class SafetensorsViewer(QMainWindow):
             QMainWindow {
                 background-color: #f5f5f5;
             }
-            QTreeWidget {
+            QTreeView {
                 background-color: white;
                 border: 1px solid #ddd;
                 border-radius: 4px;
             }
-            QTreeWidget::item:selected {
+            QTreeView::item:selected {
                 background-color: #e3f2fd;
                 color: black;
             }
@@ -212,112 +358,597 @@ class SafetensorsViewer(QMainWindow):
         open_action = file_menu.addAction("Open Model")
         open_action.triggered.connect(self.open_file)
         
+        open_folder_action = file_menu.addAction("Open Model Folder")
+        open_folder_action.triggered.connect(self.open_folder)
+        
+        compare_action = file_menu.addAction("Compare With...")
+        compare_action.triggered.connect(self.compare_with)
+        
+        duplicates_action = file_menu.addAction("Find Duplicate Tensors")
+        duplicates_action.triggered.connect(self.find_duplicates)
+        
+        check_action = file_menu.addAction("Check Integrity")
+        check_action.triggered.connect(self.check_integrity)
+        
+        export_action = file_menu.addAction("Export Converted...")
+        export_action.triggered.connect(self.export_converted)
+        
+        reshard_action = file_menu.addAction("Reshard...")
+        reshard_action.triggered.connect(self.reshard_model)
+        
+        merge_action = file_menu.addAction("Merge Into One File...")
+        merge_action.triggered.connect(self.merge_model)
+        
+        file_menu.addSeparator()
+        self.watch_action = file_menu.addAction("Watch for Changes")
+        self.watch_action.setCheckable(True)
+        self.watch_action.toggled.connect(self.set_watching)
+        
+        reload_action = file_menu.addAction("Reload")
+        reload_action.setShortcut("Ctrl+R")
+        reload_action.triggered.connect(self.reload_file)
+        file_menu.addSeparator()
+        
         exit_action = file_menu.addAction("Exit")
         exit_action.triggered.connect(self.close)
+        
+        # 耗时记录：打开和保存时各步骤的耗时、字节数和吞吐量
+        debug_menu = menubar.addMenu("Debug")
+        self.trace_action = debug_menu.addAction("Record Trace")
+        self.trace_action.setCheckable(True)
+        self.trace_action.toggled.connect(self.set_tracing)
+        
+        trace_panel_action = debug_menu.addAction("Show Trace Panel")
+        trace_panel_action.triggered.connect(self.show_trace_panel)
+        
+        export_trace_action = debug_menu.addAction("Export Chrome Trace...")
+        export_trace_action.triggered.connect(self.export_trace)
+        
+        clear_trace_action = debug_menu.addAction("Clear Trace")
+        clear_trace_action.triggered.connect(self.clear_trace)
+        
+        # 通过环境变量开启时菜单项同步为选中
+        self.trace_action.setChecked(tracing.is_enabled())
+    
+    def set_tracing(self, enabled):
+        tracing.set_enabled(enabled)
+        self.trace_label.setVisible(enabled)
+        if enabled:
+            self.trace_timer.start()
+        else:
+            self.trace_timer.stop()
+            self.refresh_trace()
+    
+    def refresh_trace(self):
+        spans = tracing.events(self.trace_seq)
+        if not spans:
+            return
+        self.trace_seq = spans[-1].seq
+        self.trace_label.setText(f"Trace: {spans[-1].describe()}")
+        if self.trace_panel is not None:
+            self.trace_panel.add_spans(spans)
+    
+    def show_trace_panel(self):
+        if self.trace_panel is None:
+            self.trace_panel = TracePanel(self)
+            self.addDockWidget(Qt.BottomDockWidgetArea, self.trace_panel)
+            # 已经记录的区间也显示出来，之后的由 refresh_trace 追加
+            self.trace_panel.add_spans([span for span in tracing.events() if span.seq <= self.trace_seq])
+        self.trace_panel.show()
+        if not self.trace_action.isChecked():
+            self.trace_action.setChecked(True)
+    
+    def export_trace(self):
+        self.refresh_trace()
+        if not tracing.events():
+            QMessageBox.information(self, "Trace", "No spans recorded. Enable Debug -> Record Trace first.")
+            return
+        out_path, _ = QFileDialog.getSaveFileName(self, "Export Chrome Trace", "trace.json", "JSON Files (*.json)")
+        if not out_path:
+            return
+        try:
+            tracing.dump_chrome_trace(out_path)
+            self.statusBar.showMessage(f"Trace written to {out_path} (open in chrome://tracing or Perfetto)")
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Failed to export trace: {str(e)}")
+    
+    def clear_trace(self):
+        tracing.clear()
+        self.trace_label.clear()
+        if self.trace_panel is not None:
+            self.trace_panel.clear()
     
     def open_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
-            self, "Open Model File", "", "Safetensors Files (*.safetensors)"
+            self, "Open Model File", "",
+            "Safetensors Files (*.safetensors *.safetensors.index.json)"
         )
         
-        if file_path:
+        if file_path and self.confirm_discard_changes():
             self.file_path = file_path
             self.load_file(file_path)
             self.add_tensor_action.setEnabled(True)  # 启用添加张量按钮
     
-    def organize_tensor_tree(self, tensors):
-        # 组织层级结构
-        layers = {}
-        for key, info in tensors.items():
-            if "." in key:
-                layer_name, param_name = key.rsplit(".", 1)
-                if layer_name not in layers:
-                    layers[layer_name] = {}
-                layers[layer_name][param_name] = info
-            else:
-                if "root" not in layers:
-                    layers["root"] = {}
-                layers["root"][key] = info
-        return layers
+    def open_folder(self):
+        # 打开包含分片模型的目录
+        folder = QFileDialog.getExistingDirectory(self, "Open Model Folder")
+        
+        if folder and self.confirm_discard_changes():
+            self.file_path = folder
+            self.load_file(folder)
+            self.add_tensor_action.setEnabled(True)
+    
+    def compare_with(self):
+        if not self.file_path:
+            return
+        other_path, _ = QFileDialog.getOpenFileName(
+            self, "Compare With", "",
+            "Safetensors Files (*.safetensors *.safetensors.index.json)"
+        )
+        if not other_path:
+            return
+        
+        # 比较磁盘上的两个模型（不包括待提交的修改），数据在后台分块流式比较
+        base_path = self.file_path
+        self.statusBar.showMessage(f"Comparing with {other_path.split('/')[-1]}...")
+        self.workers.submit("diff",
+            lambda task: model_diff.diff_models(model_core.Model(base_path), model_core.Model(other_path),
+                compare_values=True, progress=task.report_progress),
+            on_done=lambda result: self.show_diff(other_path, result),
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to compare: {message}"),
+            on_progress=self.show_progress)
+    
+    def show_diff(self, other_path, result):
+        self.text_view.setText(f"Diff: {self.file_path} -> {other_path}\n" + "-" * 50 + "\n"
+                               + model_diff.format_diff(result))
+        self.statusBar.showMessage("Models differ" if model_diff.has_changes(result) else "Models are identical")
+    
+    def find_duplicates(self):
+        if self.model is None:
+            return
+        
+        # 在后台并行哈希所有张量，结果缓存在旁路文件中，再次查找时不需要读取数据
+        model = self.model
+        self.statusBar.showMessage("Hashing tensors...")
+        self.workers.submit("hash",
+            lambda task: tensor_hash.find_duplicates(model, tensor_hash.hash_model(model, progress=task.report_progress)),
+            on_done=lambda duplicates: self.text_view.setText(
+                "Duplicate Tensors\n" + "-" * 50 + "\n" + tensor_hash.format_duplicates(duplicates)),
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to hash tensors: {message}"),
+            on_progress=self.show_progress)
+    
+    def check_integrity(self):
+        if self.model is None:
+            return
+        
+        # 并行读取全部数据：统计 NaN/Inf，并与旁路文件中保存的哈希比较
+        model = self.model
+        self.statusBar.showMessage("Checking tensor data...")
+        self.workers.submit("check",
+            lambda task: validate.deep_check(model, progress=task.report_progress),
+            on_done=self.show_check_result,
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to check model: {message}"),
+            on_progress=self.show_progress)
+    
+    def show_check_result(self, result):
+        issues = result["issues"]
+        self.text_view.setText(
+            f"Integrity Check\n" + "-" * 50 + "\n"
+            f"Scanned {result['tensors']:,} tensors ({model_core.format_size(result['bytes'])}), "
+            f"compared {result['hashes_compared']:,} stored hashes\n\n" + validate.format_issues(issues))
+        if validate.has_errors(issues):
+            self.statusBar.showMessage("Integrity check found errors")
+        else:
+            self.statusBar.showMessage(f"Integrity check passed ({len(issues)} warning(s))")
+    
+    def export_converted(self):
+        if self.model is None:
+            return
+        target, ok = QInputDialog.getItem(self, 'Export Converted', 'Target dtype:', convert.TARGETS, 0, False)
+        if not ok:
+            return
+        pattern, ok = QInputDialog.getText(self, 'Export Converted',
+            'Tensors to convert (glob, empty for all):')
+        if not ok:
+            return
+        out_path, _ = QFileDialog.getSaveFileName(self, "Export To", "", "Safetensors Files (*.safetensors)")
+        if not out_path:
+            return
+        
+        # 逐块读取、转换并顺序写入新文件，导出的是磁盘上已保存的内容
+        model = self.model
+        patterns = [p.strip() for p in pattern.split(",") if p.strip()]
+        self.statusBar.showMessage(f"Exporting to {out_path.split('/')[-1]}...")
+        self.workers.submit("export",
+            lambda task: convert.export(model, out_path, target, patterns, progress=task.report_progress),
+            on_done=lambda layout: self.statusBar.showMessage(
+                f"Exported {len(layout.tensors):,} tensors to {out_path.split('/')[-1]}"),
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to export: {message}"),
+            on_progress=self.show_progress)
+    
+    def reshard_model(self):
+        if self.model is None:
+            return
+        max_size, ok = QInputDialog.getDouble(self, 'Reshard', 'Maximum shard size (GiB):',
+            reshard.DEFAULT_MAX_SHARD_SIZE / 1024 ** 3, 0.001, 1024, 3)
+        if not ok:
+            return
+        out_dir = QFileDialog.getExistingDirectory(self, "Output Folder")
+        if not out_dir:
+            return
+        
+        # 数据在文件之间直接拷贝，不解码张量
+        model = self.model
+        self.statusBar.showMessage(f"Resharding into {out_dir}...")
+        self.workers.submit("reshard",
+            lambda task: reshard.reshard(model, out_dir, int(max_size * 1024 ** 3), progress=task.report_progress),
+            on_done=lambda result: self.statusBar.showMessage(
+                f"Wrote {len(result[1])} shard(s) and {result[0].split('/')[-1]}"),
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to reshard: {message}"),
+            on_progress=self.show_progress)
+    
+    def merge_model(self):
+        if self.model is None:
+            return
+        out_path, _ = QFileDialog.getSaveFileName(self, "Merge Into", "", "Safetensors Files (*.safetensors)")
+        if not out_path:
+            return
+        
+        model = self.model
+        self.statusBar.showMessage(f"Merging into {out_path.split('/')[-1]}...")
+        self.workers.submit("merge",
+            lambda task: reshard.merge(model, out_path, progress=task.report_progress),
+            on_done=lambda layout: self.statusBar.showMessage(
+                f"Merged {len(layout.tensors):,} tensors into {out_path.split('/')[-1]}"),
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to merge: {message}"),
+            on_progress=self.show_progress)
     
     def load_file(self, file_path):
-        self.tree.clear()
         self.text_view.clear()
+        self.stats_cache = {}
+        self.probable_stats = {}
+        self.workers.cancel("preview")
+        self.statusBar.showMessage(f"Loading {file_path.rstrip('/').split('/')[-1]}...")
+        self.workers.submit("load", lambda task: self.read_model(file_path, task),
+            on_done=lambda result: self.on_file_loaded(file_path, result),
+            on_error=lambda message: self.text_view.setText(f"Error loading file: {message}"),
+            on_progress=self.show_progress)
+    
+    def read_model(self, file_path, task):
+        # 在工作线程中执行：读取头部并构建张量表和模块树，张量数据在选中时才打开
+        model = model_core.Model(file_path)
+        task.check_cancelled()
+        table = model.table()
+        task.check_cancelled()
+        return model, table, prepare_modules(table)
+    
+    def on_file_loaded(self, file_path, result):
+        self.model, table, modules = result
+        self.layouts = self.model.layouts
+        self.metadata = self.model.metadata
+        self.transaction = self.model.transaction
+        recovered = self.model.recovered
+        self.current_tensor = None
+        self.populate_tree(table, modules)
+        if self.watch_action.isChecked():
+            self.file_watcher.watch(self.model.watch_paths())
         
-        try:
-            with open(file_path, "rb") as f:
-                length_bytes = f.read(8)
-                header_length = struct.unpack("<Q", length_bytes)[0]
-                
-                header_bytes = f.read(header_length)
-                header = json.loads(header_bytes.decode("utf-8"))
-                
-                metadata = header.get("__metadata__", {})
-                self.file_data = {"metadata": metadata, "tensors": {}}
-                
-                # 添加元数据
-                if metadata:
-                    metadata_item = QTreeWidgetItem(["Metadata", "", "dict", ""])
-                    metadata_item.setBackground(0, QColor("#e3f2fd"))
-                    self.tree.addTopLevelItem(metadata_item)
-                    
-                    for key, value in metadata.items():
-                        metadata_item.addChild(QTreeWidgetItem([key, "", str(type(value)), str(value)]))
-                
-                # 组织并添加张量信息
-                tensors = {}
-                for key, tensor_info in header.items():
-                    if key != "__metadata__":
-                        dtype = tensor_info["dtype"]
-                        shape = tensor_info["shape"]
-                        data_offsets = tensor_info["data_offsets"]
-                        size = data_offsets[1] - data_offsets[0]
-                        
-                        tensors[key] = {
-                            "dtype": dtype,
-                            "shape": shape,
-                            "size": size,
-                            "offsets": data_offsets
-                        }
-                
-                # 组织层级结构
-                layers = self.organize_tensor_tree(tensors)
-                
-                # 添加到树形视图
-                for layer_name, params in layers.items():
-                    layer_item = QTreeWidgetItem([layer_name, "", "", ""])
-                    layer_item.setBackground(0, QColor("#e3f2fd"))
-                    self.tree.addTopLevelItem(layer_item)
-                    
-                    for param_name, info in params.items():
-                        param_item = QTreeWidgetItem([
-                            param_name,
-                            str(info["shape"]),
-                            info["dtype"],
-                            f"{info['size']} bytes"
-                        ])
-                        layer_item.addChild(param_item)
-                        
-                        # 存储张量信息
-                        full_name = f"{layer_name}.{param_name}" if layer_name != "root" else param_name
-                        self.file_data["tensors"][full_name] = info
-                
-                # 展开所有项
-                self.tree.expandAll()
-                
-                # 更新模型信息
-                self.statusBar.showMessage(f"Model Structure - {file_path.split('/')[-1]}")
-                
-        except Exception as e:
-            self.text_view.setText(f"Error loading file: {str(e)}")
+        # 头部与文件不符时提示，截断的下载或损坏的分片在打开时就能发现
+        issues = self.model.issues
+        if validate.has_errors(issues):
+            lines = validate.format_issues(issues).splitlines()
+            QMessageBox.warning(self, "Invalid File",
+                "The header does not match the file contents:\n\n" + "\n".join(lines[:MAX_ISSUE_LINES])
+                + (f"\n... and {len(lines) - MAX_ISSUE_LINES} more" if len(lines) > MAX_ISSUE_LINES else ""))
+        
+        # 更新模型信息
+        if issues:
+            self.statusBar.showMessage(f"{len(issues)} problem(s) found - see File -> Check Integrity")
+        elif recovered:
+            self.statusBar.showMessage("Recovered from an interrupted save")
+        elif len(self.layouts) > 1:
+            self.statusBar.showMessage(
+                f"Model Structure - {file_path.rstrip('/').split('/')[-1]} ({len(self.layouts)} shards)")
+        else:
+            self.statusBar.showMessage(f"Model Structure - {file_path.split('/')[-1]}")
+    
+    def set_watching(self, enabled):
+        if enabled and self.model is not None:
+            self.file_watcher.watch(self.model.watch_paths())
+            # 开启之前已经发生的改写也立即处理
+            if self.model.changed_files():
+                self.on_file_changed()
+        elif not enabled:
+            self.file_watcher.stop()
+    
+    def on_file_changed(self):
+        if self.model is None or not self.model.changed_files():
+            return
+        if any(map(self.workers.is_running, FILE_TASKS)):
+            # 自己的写入或正在读取，结束后会重新检查
+            return
+        if self.transaction:
+            self.statusBar.showMessage(
+                "The file changed on disk - save is blocked; discard the pending changes to reload")
+            return
+        self.reload_file()
+    
+    def reload_file(self):
+        if self.model is None or self.transaction or any(map(self.workers.is_running, FILE_TASKS)):
+            return
+        model = self.model
+        # 需要验证的缓存：统计结果和打开的数据窗口
+        cached = set(self.stats_cache) | {dialog.name for dialog in self.data_dialogs}
+        self.statusBar.showMessage("File changed on disk, reloading header...")
+        self.workers.submit("reload", lambda task: self.read_changes(model, cached, task),
+            on_done=self.on_reloaded,
+            on_error=lambda message: self.statusBar.showMessage(f"Reload failed: {message}"),
+            on_progress=self.show_progress)
+    
+    def read_changes(self, model, cached, task):
+        # 在工作线程中执行：只读取头部（未变的文件命中头部缓存），与当前的张量表比较
+        fresh = model_core.Model(model.path)
+        task.check_cancelled()
+        table = fresh.table()
+        diff = model_diff.header_diff(model, fresh)
+        # 结构变化时树要重新构建，也在这里完成
+        modules = prepare_modules(table) if model_diff.has_structure_changes(diff) else None
+        # 所在文件的状态键没变的张量内容一定没变；改写过的文件中的张量只取抽样指纹，
+        # 相同时仅提示"可能没变"，统计和已读取的数据仍然重新计算
+        changed = {file for file, key in fresh.file_keys.items() if model.file_keys.get(file) != key}
+        kept = set()
+        samples = {}
+        for name in cached:
+            try:
+                old_layout, _ = model.locate(name)
+                layout, info = fresh.locate(name)
+            except KeyError:
+                continue
+            if layout.path == old_layout.path and layout.path not in changed:
+                kept.add(name)
+            else:
+                samples[name] = tensor_hash.sample_tensors(layout.path, layout.data_start, {name: info})[name]
+        return {"model": fresh, "table": table, "modules": modules, "diff": diff, "kept": kept, "samples": samples}
+    
+    def on_reloaded(self, result):
+        diff = result["diff"]
+        kept = result["kept"]
+        samples = result["samples"]
+        selected = self.tree_model.node_key(self.tree_model.node(self.tree.currentIndex())) \
+            if self.tree.currentIndex().isValid() else None
+        self.model = result["model"]
+        self.layouts = self.model.layouts
+        self.metadata = self.model.metadata
+        self.transaction = self.model.transaction
+        self.current_tensor = None
+        self.current_values = None
+        self.probable_stats = {name: entry[1] for name, entry in self.stats_cache.items()
+                               if name not in kept and samples.get(name) == entry[0]}
+        self.stats_cache = {name: entry for name, entry in self.stats_cache.items() if name in kept}
+        
+        if result["modules"] is not None or self.search_edit.text().strip():
+            # 张量增删或形状变化：换成后台构建的树，再恢复展开的模块和选中的行
+            state = self.save_tree_state()
+            self.populate_tree(result["table"], result["modules"])
+            self.restore_tree_state(state)
+        else:
+            # 只有数据位置变化：沿用现有的树，只刷新受影响的行。行的顺序不变时直接换成新表，
+            # 之后的修改仍能在它上面局部更新
+            if result["table"].names == self.table.names:
+                self.table = self.tree_model.table = result["table"]
+                self.search_index = None
+            else:
+                self.table.rebind(result["table"])
+            self.tree_model.refresh_rows(self.table.row(name) for name in diff["moved"])
+        self.update_data_dialogs(kept, samples)
+        
+        index = self.tree_model.find(selected) if selected in self.table else QModelIndex()
+        if index.isValid():
+            self.tree.setCurrentIndex(index)
+            self.on_item_clicked(index)
+        if self.watch_action.isChecked():
+            self.file_watcher.watch(self.model.watch_paths())
+        self.statusBar.showMessage(
+            f"Reloaded: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+            f"{len(diff['changed'])} changed, {len(diff['moved'])} moved, {diff['kept']:,} in place; "
+            f"kept {len(self.stats_cache)} cached stats"
+            + (f", {len(self.probable_stats)} probably unchanged (sampled)" if self.probable_stats else ""))
+    
+    def update_data_dialogs(self, kept, samples):
+        for dialog in self.data_dialogs:
+            try:
+                layout, info = self.model.locate(dialog.name)
+            except KeyError:
+                dialog.detach("The tensor is no longer in the file")
+                continue
+            if info["dtype"] != dialog.info["dtype"] or list(info["shape"]) != list(dialog.info["shape"]):
+                dialog.detach(f"The tensor changed on disk to {info['dtype']}{list(info['shape'])}")
+                continue
+            # 文件没被改写时保留已读取的数据；打开窗口时的抽样指纹记在 dialog.sample 中，只用于提示
+            keep = dialog.name in kept
+            probable = not keep and samples.get(dialog.name) == dialog.sample
+            dialog.sample = samples.get(dialog.name, dialog.sample)
+            dialog.rebind(layout, info, keep, probable)
+    
+    # 展开的模块和滚动位置，用节点的键记录，树重新构建后按键恢复
+    def save_tree_state(self):
+        expanded = set()
+        
+        def visit(parent):
+            for row in range(self.tree_model.rowCount(parent)):
+                index = self.tree_model.index(row, 0, parent)
+                if self.tree.isExpanded(index):
+                    expanded.add(self.tree_model.node_key(self.tree_model.node(index)))
+                    visit(index)
+        
+        visit(QModelIndex())
+        return expanded, self.tree.verticalScrollBar().value()
+    
+    def restore_tree_state(self, state):
+        expanded, scroll = state
+        
+        def visit(parent):
+            self.tree_model.fetch_all(parent)
+            for row in range(self.tree_model.rowCount(parent)):
+                index = self.tree_model.index(row, 0, parent)
+                if self.tree_model.node_key(self.tree_model.node(index)) in expanded:
+                    self.tree.expand(index)
+                    visit(index)
+        
+        if expanded:
+            self.tree.collapseAll()
+            visit(QModelIndex())
+        self.tree.verticalScrollBar().setValue(scroll)
+    
+    def show_progress(self, done, total, message=""):
+        if total:
+            self.progress_bar.setRange(0, 1000)
+            self.progress_bar.setValue(int(done * 1000 // total))
+        else:
+            self.progress_bar.setRange(0, 0)
+        if message:
+            self.statusBar.showMessage(message)
+    
+    def on_busy_changed(self, busy):
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(busy)
+        self.cancel_button.setVisible(busy)
+        self.update_edit_actions()
+    
+    def on_task_settled(self, key):
+        # 任务真正结束（包括取消后仍在写入的）之前不能编辑或再次保存
+        self.update_edit_actions()
+        if key not in FILE_TASKS or self.model is None or any(map(self.workers.is_running, FILE_TASKS)) \
+                or not self.model.changed_files():
+            return
+        if key == "save":
+            # 取消时可能已经写入了（原地提交或部分分片），按磁盘上的内容重新加载
+            self.load_file(self.file_path)
+        elif self.watch_action.isChecked():
+            # 任务运行期间发生的改写被监视器跳过了，这里补上
+            self.on_file_changed()
+    
+    def cancel_tasks(self):
+        self.workers.cancel_all()
+        self.statusBar.showMessage("Cancelled")
+    
+    def populate_tree(self, table=None, modules=None):
+        # 树中显示的是叠加了待提交修改的视图
+        if table is None:
+            table = self.model.table()
+        self.table = table
+        self.modules = modules
+        self.search_index = None
+        with tracing.span("populate_tree", "ui", tensors=len(table)):
+            self.apply_search()
+        self.update_edit_actions()
+    
+    # 修改、撤销和重做之后：只有少数行变化，在现有的模块树上更新这些行，再按键恢复展开状态和滚动位置
+    def refresh_edits(self):
+        table = self.model.table()
+        rows = self.table.changed_rows(table)
+        if rows is None or self.modules is None:
+            self.populate_tree(table)
+            return
+        with tracing.span("refresh_edits", "ui", rows=len(rows)):
+            state = self.save_tree_state()
+            update_module_tree(self.modules, self.table, table, rows)
+            self.table = table
+            self.search_index = None
+            self.apply_search()
+            self.restore_tree_state(state)
+        self.update_edit_actions()
+    
+    def apply_search(self):
+        text = self.search_edit.text().strip()
+        if self.modules is None:
+            self.modules = build_module_tree(self.table)
+        if not text:
+            self.tree_model.reset(self.table, self.metadata, modules=self.modules)
+            # 小模型展开第一层，大模型保持折叠
+            if len(self.table) <= AUTO_EXPAND_LIMIT:
+                self.tree_model.fetch_all()
+                self.tree.expandToDepth(0)
+        else:
+            # 索引在第一次搜索时构建，之后每次输入只查询索引
+            if self.search_index is None:
+                self.search_index = SearchIndex(self.table)
+            start = time.perf_counter()
+            try:
+                rows = self.search_index.query(text)
+            except (ValueError, re.error) as e:
+                self.statusBar.showMessage(f"Invalid search: {str(e)}")
+                return
+            elapsed = time.perf_counter() - start
+            # 在完整的模块树上按匹配的行过滤，不为每次输入重建树
+            self.tree_model.reset(self.table, self.metadata, rows, modules=self.modules)
+            if len(rows) <= SEARCH_EXPAND_LIMIT:
+                self.expand_all()
+            self.statusBar.showMessage(f"{len(rows):,} matching tensor(s) ({elapsed * 1000:.1f} ms)")
+        for column in range(self.tree_model.columnCount()):
+            self.tree.resizeColumnToContents(column)
+    
+    def expand_all(self, parent=QModelIndex()):
+        self.tree_model.fetch_all(parent)
+        for row in range(self.tree_model.rowCount(parent)):
+            index = self.tree_model.index(row, 0, parent)
+            if self.tree_model.node(index).kind == GROUP:
+                self.expand_all(index)
+                self.tree.expand(index)
+    
+    def update_edit_actions(self):
+        # 保存进行中时不允许继续修改事务
+        editable = self.is_editable()
+        pending = editable and bool(self.transaction)
+        self.save_button.setEnabled(pending)
+        self.undo_action.setEnabled(editable and self.transaction.can_undo())
+        self.redo_action.setEnabled(editable and self.transaction.can_redo())
+        self.add_tensor_action.setEnabled(editable)
+        self.bulk_edit_action.setEnabled(editable and not self.workers.is_running("transform"))
+        if not editable:
+            self.edit_button.setEnabled(False)
+        if pending:
+            self.statusBar.showMessage(
+                f"{len(self.transaction.ops)} pending change(s). Click 'Save Changes' to apply.")
+    
+    def is_editable(self):
+        return self.transaction is not None and not self.workers.is_running("save")
+    
+    def undo_change(self):
+        if self.is_editable() and self.transaction.can_undo():
+            self.transaction.undo()
+            self.refresh_edits()
+            self.text_view.clear()
+    
+    def redo_change(self):
+        if self.is_editable() and self.transaction.can_redo():
+            self.transaction.redo()
+            self.refresh_edits()
+            self.text_view.clear()
+    
+    def confirm_discard_changes(self):
+        if not self.transaction:
+            return True
+        reply = QMessageBox.question(self, 'Unsaved Changes',
+            f"Discard {len(self.transaction.ops)} pending change(s)?",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        return reply == QMessageBox.Yes
+    
+    def closeEvent(self, event):
+        if self.confirm_discard_changes():
+            self.workers.cancel_all()
+            self.workers.wait()
+            event.accept()
+        else:
+            event.ignore()
     
     def edit_tensor(self):
-        if not self.current_tensor:
+        if not self.current_tensor or self.current_values is None or not self.is_editable():
             return
             
         try:
-            with safe_open(self.file_path, framework="pt") as f:
-                tensor = f.get_tensor(self.current_tensor)
+            # 使用预览时在后台读取的值
+            tensor = self.current_values
                 
             # 获取当前值
             current_value = tensor.flatten().tolist()
@@ -338,16 +969,16 @@ class SafetensorsViewer(QMainWindow):
                     if len(new_values) != len(current_value):
                         raise ValueError("Number of values must match tensor size")
                         
-                    # 创建新张量
-                    new_tensor = np.array(new_values).reshape(tensor.shape)
+                    # 按磁盘上的 dtype 创建新张量
+                    dtype = self.table.dtype(self.table.row(self.current_tensor))
+                    new_tensor = np.array(new_values, dtype=safetensors_io.numpy_dtype(dtype)).reshape(tensor.shape)
                     
-                    # 存储修改后的张量
-                    self.modified_tensors[self.current_tensor] = new_tensor
+                    # 加入事务日志
+                    self.transaction.set_values(self.current_tensor, new_tensor)
                     
                     # 更新显示
-                    self.save_button.setEnabled(True)
+                    self.refresh_edits()
                     self.text_view.append("\nModified values (not saved):\n" + str(new_tensor))
-                    self.statusBar.showMessage("Tensor modified. Click 'Save Changes' to apply.")
                     
                 except Exception as e:
                     QMessageBox.critical(self, "Error", f"Invalid input: {str(e)}")
@@ -356,116 +987,257 @@ class SafetensorsViewer(QMainWindow):
             QMessageBox.critical(self, "Error", f"Failed to edit tensor: {str(e)}")
 
     def save_changes(self):
-        if not self.modified_tensors:
+        if not self.transaction or not self.is_editable():
+            return
+        if self.model.changed_files():
+            # 修改是基于打开时的头部做的，不能写进已经被改写的文件
+            QMessageBox.warning(self, "File Changed",
+                "The file changed on disk after it was opened. Discard the pending changes and reload.")
             return
             
-        try:
-            # 读取所有现有张量
-            tensors = {}
-            with safe_open(self.file_path, framework="pt") as f:
-                for key in f.keys():
-                    tensors[key] = f.get_tensor(key)
-            
-            # 更新修改的张量
-            for key, tensor in self.modified_tensors.items():
-                tensors[key] = tensor
-            
-            # 创建备份
-            backup_path = self.file_path + ".backup"
-            if not os.path.exists(backup_path):
-                shutil.copy2(self.file_path, backup_path)
-            
-            # 保存修改后的文件
-            save_file(tensors, self.file_path)
-            
-            # 清除修改记录
-            self.modified_tensors.clear()
-            self.save_button.setEnabled(False)
-            
-            QMessageBox.information(self, "Success", 
-                f"Changes saved successfully.\nBackup created at: {backup_path}")
-            
-            # 重新加载文件
-            self.load_file(self.file_path)
+        # 所有待提交的修改在一次处理中写入文件，取消时原文件保持不变
+        self.statusBar.showMessage("Saving changes...")
+        # 提交在副本上进行，后台写入时界面读取的模型和事务保持不变
+        model = self.model.snapshot()
+        self.workers.submit("save", lambda task: model.commit(progress=task.report_progress),
+            on_done=self.on_changes_saved,
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to save changes: {message}"),
+            on_progress=self.show_progress)
+    
+    def on_changes_saved(self, result):
+        QMessageBox.information(self, "Success", "Changes saved successfully.")
+        
+        # 重新加载文件
+        self.load_file(self.file_path)
+
+    def bulk_edit(self, full_name=None):
+        if not self.is_editable() or self.workers.is_running("transform"):
+            return
+        if self.transaction:
+            QMessageBox.warning(self, "Bulk Edit", "Save or discard the pending changes first.")
+            return
             
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to save changes: {str(e)}")
+        # 默认作用于选中的张量，也可以输入 glob 同时修改多个
+        pattern, ok = QInputDialog.getText(self, 'Bulk Edit', 'Tensors (name or glob):',
+            text=full_name or self.current_tensor or "")
+        if not ok or not pattern:
+            return
+        names = transforms.select(self.model, pattern)
+        if not names:
+            QMessageBox.warning(self, "Bulk Edit", f"No tensor matches '{pattern}'")
+            return
+        text, ok = QInputDialog.getText(self, 'Bulk Edit',
+            f"Operation for {len(names):,} tensor(s):\n  " + "\n  ".join(transforms.OPERATIONS.values()))
+        if not ok or not text:
+            return
+        try:
+            operation = transforms.parse_operation(text)
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        confirm = QMessageBox(QMessageBox.Question, 'Bulk Edit',
+            f"Apply '{transforms.describe(operation)}' to {len(names):,} tensor(s)? The file is modified in place.",
+            QMessageBox.Yes | QMessageBox.No, self)
+        confirm.setDefaultButton(QMessageBox.No)
+        # 默认取消时只回滚正在写入的一批；全部回滚需要先把所有目标数据拷进撤销日志
+        atomic_box = QCheckBox("Roll back everything if cancelled (journals all target data first: "
+                               "needs that much free disk space and doubles the I/O)")
+        confirm.setCheckBox(atomic_box)
+        if confirm.exec_() != QMessageBox.Yes:
+            return
+        atomic = atomic_box.isChecked()
+        
+        # 在后台按块并行写回文件，取消时正在写入的一批（atomic 时为全部）从撤销日志恢复
+        model = self.model
+        self.statusBar.showMessage(f"Applying {transforms.describe(operation)}...")
+        self.workers.submit("transform",
+            lambda task: model.transform(names, operation, progress=task.report_progress, atomic=atomic),
+            on_done=self.on_transform_done,
+            on_error=lambda message: QMessageBox.critical(self, "Error", f"Failed to apply: {message}"),
+            on_progress=self.show_progress)
+        self.update_edit_actions()
+    
+    def on_transform_done(self, result):
+        message = f"Modified {result['tensors']:,} tensor(s) ({model_core.format_size(result['bytes'])})"
+        if result["skipped"]:
+            message += f", skipped {len(result['skipped']):,} with an unsupported dtype"
+        # 先重新加载文件，提示框打开期间不会把自己的写入当成外部改写
+        self.load_file(self.file_path)
+        QMessageBox.information(self, "Bulk Edit", message)
 
-    def on_item_clicked(self, item, column):
-        parent = item.parent()
-        if parent is None:  # 层级项
-            info_text = f"Layer: {item.text(0)}\n"
+    def on_item_clicked(self, index):
+        node = self.tree_model.node(index)
+        self.view_data_button.setEnabled(False)
+        self.heatmap_button.setEnabled(False)
+        self.data_target = None
+        if node.kind == GROUP:  # 模块项，统计量在构建模块树时已经算好
+            module = node.payload
+            info_text = f"Module: {module.path}\n"
             info_text += "-" * 50 + "\n"
-            child_count = item.childCount()
-            info_text += f"Parameters count: {child_count}\n"
-            total_size = 0
-            for i in range(child_count):
-                child = item.child(i)
-                param_size = int(child.text(3).split()[0])
-                total_size += param_size
-            info_text += f"Total size: {total_size:,} bytes"
+            if isinstance(module, RepeatGroup):
+                info_text += f"Repeated blocks: {len(module.members)} with identical structure\n"
+            info_text += f"Tensors: {module.tensors:,}\n"
+            info_text += f"Parameters: {module.params:,}\n"
+            info_text += f"Total size: {module.bytes:,} bytes\n"
+            for dtype, (count, size) in sorted(module.dtypes.items()):
+                info_text += f"  {dtype}: {count:,} tensors, {size:,} bytes\n"
             self.text_view.setText(info_text)
             self.edit_button.setEnabled(False)
             self.current_tensor = None
             
-        elif parent.text(0) != "Metadata":  # 参数项
-            layer_name = parent.text(0)
-            param_name = item.text(0)
-            full_name = f"{layer_name}.{param_name}" if layer_name != "root" else param_name
-            tensor_info = self.file_data["tensors"].get(full_name)
+        elif node.kind == TENSOR:  # 参数项
+            full_name = self.tree_model.full_name(node)
+            layer_name, _, param_name = full_name.rpartition(".")
+            tensor_info = self.table.get(full_name)
             
             if tensor_info:
                 info_text = f"Parameter: {param_name}\n"
                 info_text += "-" * 50 + "\n"
-                info_text += f"Layer: {layer_name}\n"
+                info_text += f"Module: {layer_name}\n"
                 info_text += f"Type: {tensor_info['dtype']}\n"
                 info_text += f"Shape: {tensor_info['shape']}\n"
                 info_text += f"Size: {tensor_info['size']:,} bytes\n"
+                if tensor_info["status"]:
+                    info_text += f"Pending: {', '.join(sorted(tensor_info['status']))}\n"
                 
                 # 尝试加载实际张量数据
-                if np.prod(tensor_info["shape"]) <= 100:
-                    try:
-                        from safetensors import safe_open
-                        with safe_open(self.file_path, framework="pt") as f:
-                            tensor = f.get_tensor(full_name)
-                            info_text += f"\nValue Preview:\n{tensor}"
-                            # 允许编辑小张量
-                            self.edit_button.setEnabled(True)
-                            self.current_tensor = full_name
-                    except:
-                        info_text += "\n(Unable to load tensor data)"
-                        self.edit_button.setEnabled(False)
-                        self.current_tensor = None
+                self.edit_button.setEnabled(False)
+                self.current_tensor = None
+                self.current_values = None
+                self.workers.cancel("preview")
+                self.workers.cancel("stats")
+                self.detail_sections = [info_text, "", ""]
+                layouts = self.layouts
+                if "deleted" in tensor_info["status"]:
+                    self.detail_sections[1] = "\n(Tensor will be deleted on save)"
                 else:
-                    info_text += "\n(Tensor too large to preview)"
-                    self.edit_button.setEnabled(False)
-                    self.current_tensor = None
+                    if np.prod(tensor_info["shape"]) <= 100:
+                        # 在后台读取，快速切换选中项时旧的预览会被取消
+                        self.workers.submit("preview",
+                            lambda task: model_core.tensor_values(tensor_info, layouts),
+                            on_done=lambda tensor: self.show_preview(full_name, tensor),
+                            on_error=lambda message: self.set_detail_section(
+                                1, "\n(Unable to load tensor data)"))
+                        self.detail_sections[1] = "\n(Loading preview...)"
+                    else:
+                        self.detail_sections[1] = "\n(Tensor too large to preview)"
+                    
+                    if tensor_info["source"] is not None and "data" not in tensor_info:
+                        layout = layouts[tensor_info["file"]]
+                        _, source_info = self.model.locate(tensor_info["source"])
+                        self.data_target = (full_name, layout, source_info)
+                        self.view_data_button.setEnabled(True)
+                        self.heatmap_button.setEnabled(len(source_info["shape"]) >= 2 and source_info["size"] > 0)
+                        
+                        source = tensor_info["source"]
+                        cached = self.stats_cache.get(source)
+                        if cached is not None:
+                            self.detail_sections[2] = "\n\nStatistics:\n" + tensor_stats.format_stats(cached[1])
+                        else:
+                            # 分块并行统计，部分结果随进度刷新；同时记下抽样指纹，重新加载时据此判断能否沿用
+                            self.workers.submit("stats",
+                                lambda task: (
+                                    tensor_hash.sample_tensors(layout.path, layout.data_start, {source: source_info})[source],
+                                    tensor_stats.compute_stats(
+                                        layout.path, layout.data_start, source_info,
+                                        on_partial=lambda stats, done, total: task.report_progress(done, total, stats))),
+                                on_done=lambda result: self.on_stats_done(source, result),
+                                on_error=lambda message: self.set_detail_section(
+                                    2, f"\n\nStatistics unavailable: {message}"),
+                                on_progress=self.on_stats_progress)
+                            probable = self.probable_stats.get(source)
+                            if probable is not None:
+                                self.detail_sections[2] = ("\n\nStatistics (probably unchanged, sampled bytes match; recomputing...):\n"
+                                                           + tensor_stats.format_stats(probable))
+                            else:
+                                self.detail_sections[2] = "\n\nStatistics:\n(computing...)"
                 
-                self.text_view.setText(info_text)
-        else:  # 元数据项
-            self.text_view.setText(f"Metadata: {item.text(0)} = {item.text(3)}")
+                self.render_details()
+        elif node.kind == METADATA_ITEM:  # 元数据项
+            self.text_view.setText(f"Metadata: {node.name} = {node.payload}")
+            self.edit_button.setEnabled(False)
+            self.current_tensor = None
+        else:  # 元数据分组
+            self.text_view.setText(f"Metadata entries: {len(node.payload)}")
             self.edit_button.setEnabled(False)
             self.current_tensor = None
 
+    def view_tensor_data(self):
+        # 只映射当前可见的页，不加载整个张量
+        self.open_data_dialog(SliceViewerDialog, "tensor data")
+    
+    def show_heatmap(self):
+        # 后台按轮采样，先显示粗略的图像再逐步细化
+        self.open_data_dialog(HeatmapDialog, "heatmap")
+    
+    def open_data_dialog(self, dialog_class, label):
+        if self.data_target is None:
+            return
+        try:
+            name, layout, info = self.data_target
+            dialog = dialog_class(name, layout, info, parent=self)
+            # 打开时的抽样指纹，文件被改写后据此判断已读取的数据能否继续使用
+            dialog.sample = tensor_hash.sample_tensors(layout.path, layout.data_start, {name: info})[name]
+            dialog.finished.connect(lambda _: self.data_dialogs.remove(dialog))
+            self.data_dialogs.append(dialog)
+            dialog.show()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to open {label}: {str(e)}")
+    
+    def render_details(self):
+        self.text_view.setText("".join(self.detail_sections))
+    
+    def set_detail_section(self, section, text):
+        self.detail_sections[section] = text
+        self.render_details()
+    
+    def show_stats(self, stats):
+        self.set_detail_section(2, "\n\nStatistics:\n" + tensor_stats.format_stats(stats))
+    
+    def on_stats_done(self, source, result):
+        self.stats_cache[source] = result
+        self.probable_stats.pop(source, None)
+        self.show_stats(result[1])
+    
+    def on_stats_progress(self, done, total, stats):
+        self.show_progress(done, total)
+        self.show_stats(stats)
+    
+    def show_preview(self, full_name, tensor):
+        self.set_detail_section(1, f"\nValue Preview:\n{tensor}")
+        # 允许编辑小张量
+        self.current_tensor = full_name
+        self.current_values = tensor
+        self.edit_button.setEnabled(self.is_editable())
+
     def contextMenuEvent(self, event):
         # 获取树形视图中的点击位置
-        pos = self.tree.mapFromGlobal(event.globalPos())
-        item = self.tree.itemAt(pos)
+        pos = self.tree.viewport().mapFromGlobal(event.globalPos())
+        index = self.tree.indexAt(pos)
+        node = self.tree_model.node(index) if index.isValid() else None
         
-        if item and item.parent():  # 只对参数项显示右键菜单
+        if node is not None and node.kind == TENSOR:  # 只对参数项显示右键菜单
+            full_name = self.tree_model.full_name(node)
             menu = QMenu(self)
             
             rename_action = QAction("Rename", self)
-            rename_action.triggered.connect(lambda: self.rename_tensor(item))
+            rename_action.triggered.connect(lambda: self.rename_tensor(full_name))
             menu.addAction(rename_action)
             
             delete_action = QAction("Delete", self)
-            delete_action.triggered.connect(lambda: self.delete_tensor(item))
+            delete_action.triggered.connect(lambda: self.delete_tensor(full_name))
             menu.addAction(delete_action)
             
+            bulk_edit_action = QAction("Bulk Edit...", self)
+            bulk_edit_action.triggered.connect(lambda: self.bulk_edit(full_name))
+            menu.addAction(bulk_edit_action)
+            
             menu.exec_(event.globalPos())
 
     def add_tensor(self):
+        if not self.is_editable():
+            return
+            
         try:
             # 获取新张量名称
             name, ok = QInputDialog.getText(self, 'Add New Tensor', 'Enter tensor name:')
@@ -480,37 +1252,37 @@ class SafetensorsViewer(QMainWindow):
                 
             try:
                 shape = tuple(map(int, shape_str.split(',')))
-            except:
-                QMessageBox.critical(self, "Error", "Invalid shape format")
+                safetensors_io.check_shape(shape)
+            except ValueError:
+                QMessageBox.critical(self, "Error", "Invalid shape format: dimensions must be non-negative integers")
                 return
                 
-            # 创建新张量
-            try:
-                # 默认创建零张量
-                new_tensor = torch.zeros(shape)
-                
-                # 读取所有现有张量
-                tensors = {}
-                with safe_open(self.file_path, framework="pt") as f:
-                    for key in f.keys():
-                        tensors[key] = f.get_tensor(key)
-                
-                # 添加新张量
-                tensors[name] = new_tensor
-                
-                # 创建备份
-                backup_path = self.file_path + ".backup"
-                if not os.path.exists(backup_path):
-                    shutil.copy2(self.file_path, backup_path)
+            # 获取数据类型
+            dtype, ok = QInputDialog.getItem(self, 'Tensor Type', 'Select dtype:',
+                list(safetensors_io.DTYPE_SIZES), list(safetensors_io.DTYPE_SIZES).index("F32"), False)
+            if not ok:
+                return
                 
-                # 保存修改后的文件
-                save_file(tensors, self.file_path)
+            # 获取初始化方式
+            initializer, ok = QInputDialog.getItem(self, 'Tensor Initializer', 'Select initializer:',
+                safetensors_io.INITIALIZERS, 0, False)
+            if not ok:
+                return
                 
-                # 重新加载文件
-                self.load_file(self.file_path)
+            value = 0.0
+            if initializer in ("constant", "normal", "uniform"):
+                label = {"constant": "Fill value:", "normal": "Standard deviation:",
+                         "uniform": "Range (-a, a), a ="}[initializer]
+                value, ok = QInputDialog.getDouble(self, 'Initializer Value', label,
+                    0.0 if initializer == "constant" else 0.02, -1e30, 1e30, 6)
+                if not ok:
+                    return
                 
-                QMessageBox.information(self, "Success", 
-                    f"New tensor '{name}' added successfully")
+            # 创建新张量
+            try:
+                # 加入事务日志，保存时只追加新张量的数据
+                self.transaction.add(name, dtype, shape, initializer, value)
+                self.refresh_edits()
                 
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to add tensor: {str(e)}")
@@ -518,13 +1290,11 @@ class SafetensorsViewer(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to add tensor: {str(e)}")
 
-    def rename_tensor(self, item):
-        if not item or not item.parent():
+    def rename_tensor(self, full_old_name):
+        if not full_old_name or not self.is_editable():
             return
             
-        old_name = item.text(0)
-        layer_name = item.parent().text(0)
-        full_old_name = f"{layer_name}.{old_name}" if layer_name != "root" else old_name
+        layer_name, _, old_name = full_old_name.rpartition(".")
         
         # 获取新名称
         new_name, ok = QInputDialog.getText(self, 'Rename Tensor', 
@@ -532,40 +1302,20 @@ class SafetensorsViewer(QMainWindow):
         
         if ok and new_name and new_name != old_name:
             try:
-                # 读取所有张量
-                tensors = {}
-                with safe_open(self.file_path, framework="pt") as f:
-                    for key in f.keys():
-                        tensors[key] = f.get_tensor(key)
+                full_new_name = f"{layer_name}.{new_name}" if layer_name else new_name
                 
-                # 重命名张量
-                if full_old_name in tensors:
-                    tensors[new_name] = tensors.pop(full_old_name)
-                    
-                    # 创建备份
-                    backup_path = self.file_path + ".backup"
-                    if not os.path.exists(backup_path):
-                        shutil.copy2(self.file_path, backup_path)
-                    
-                    # 保存修改后的文件
-                    save_file(tensors, self.file_path)
-                    
-                    # 重新加载文件
-                    self.load_file(self.file_path)
-                    
-                    QMessageBox.information(self, "Success", 
-                        f"Tensor renamed from '{old_name}' to '{new_name}'")
+                # 加入事务日志，保存时只改写头部
+                self.transaction.rename(full_old_name, full_new_name)
+                self.refresh_edits()
                     
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to rename tensor: {str(e)}")
 
-    def delete_tensor(self, item):
-        if not item or not item.parent():
+    def delete_tensor(self, full_name):
+        if not full_name or not self.is_editable():
             return
             
-        name = item.text(0)
-        layer_name = item.parent().text(0)
-        full_name = f"{layer_name}.{name}" if layer_name != "root" else name
+        name = full_name.rpartition(".")[2]
         
         reply = QMessageBox.question(self, 'Delete Tensor',
             f"Are you sure you want to delete tensor '{name}'?",
@@ -573,26 +1323,9 @@ class SafetensorsViewer(QMainWindow):
         
         if reply == QMessageBox.Yes:
             try:
-                # 读取所有张量
-                tensors = {}
-                with safe_open(self.file_path, framework="pt") as f:
-                    for key in f.keys():
-                        if key != full_name:  # 排除要删除的张量
-                            tensors[key] = f.get_tensor(key)
-                
-                # 创建备份
-                backup_path = self.file_path + ".backup"
-                if not os.path.exists(backup_path):
-                    shutil.copy2(self.file_path, backup_path)
-                
-                # 保存修改后的文件
-                save_file(tensors, self.file_path)
-                
-                # 重新加载文件
-                self.load_file(self.file_path)
-                
-                QMessageBox.information(self, "Success", 
-                    f"Tensor '{name}' deleted successfully")
+                # 加入事务日志，保存时流式压缩数据区
+                self.transaction.delete(full_name)
+                self.refresh_edits()
                 
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Failed to delete tensor: {str(e)}")
@@ -0,0 +1,133 @@
+import threading
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class Cancelled(Exception):
+    pass
+
+
+class TaskSignals(QObject):
+    # 信号在工作线程中发出，Qt 自动排队到主线程执行槽函数
+    # progress(done, total, message)：message 可以是文本，也可以是任务的部分结果
+    progress = pyqtSignal(object, object, object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    # run() 返回时总会发出，包括已取消的任务
+    ended = pyqtSignal()
+
+
+# 在线程池中执行的任务，fn 接收任务本身，用于报告进度和检查取消
+class Task(QRunnable):
+    def __init__(self, key, fn):
+        super().__init__()
+        self.key = key
+        self.fn = fn
+        self.signals = TaskSignals()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise Cancelled()
+
+    def report_progress(self, done, total, message=""):
+        self.check_cancelled()
+        self.signals.progress.emit(done, total, message)
+
+    def run(self):
+        try:
+            # 开始前已被取消的任务不再执行
+            if self.is_cancelled():
+                return
+            try:
+                result = self.fn(self)
+            except Cancelled:
+                return
+            except Exception as e:
+                if not self.is_cancelled():
+                    traceback.print_exc()
+                    self.signals.failed.emit(str(e))
+                return
+            if not self.is_cancelled():
+                self.signals.finished.emit(result)
+        finally:
+            self.signals.ended.emit()
+
+
+# 按 key 合并请求：同一 key 提交新任务时取消旧任务，旧任务的结果会被丢弃。
+# 取消只是请求，任务可能还在写文件；is_running 一直为 True，直到 run() 返回并发出 settled
+class TaskRunner(QObject):
+    busy_changed = pyqtSignal(bool)
+    settled = pyqtSignal(str)
+
+    def __init__(self, parent=None, max_threads=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_threads:
+            self.pool.setMaxThreadCount(max_threads)
+        self.tasks = {}
+        # key -> 还没有返回的任务（包括已取消的）
+        self.running = {}
+
+    def submit(self, key, fn, on_done=None, on_error=None, on_progress=None):
+        self.cancel(key)
+        task = Task(key, fn)
+        task.signals.finished.connect(lambda result: self._finish(task, on_done, result))
+        task.signals.failed.connect(lambda message: self._finish(task, on_error, message))
+        task.signals.ended.connect(lambda: self._ended(task))
+        if on_progress is not None:
+            task.signals.progress.connect(
+                lambda done, total, message: self._progress(task, on_progress, done, total, message))
+        self.tasks[key] = task
+        self.running.setdefault(key, set()).add(task)
+        self.pool.start(task)
+        self.busy_changed.emit(True)
+        return task
+
+    def _current(self, task):
+        return self.tasks.get(task.key) is task and not task.is_cancelled()
+
+    def _progress(self, task, callback, done, total, message):
+        if self._current(task):
+            callback(done, total, message)
+
+    def _finish(self, task, callback, value):
+        if not self._current(task):
+            return
+        del self.tasks[task.key]
+        if callback is not None:
+            callback(value)
+        if not self.tasks:
+            self.busy_changed.emit(False)
+
+    def _ended(self, task):
+        tasks = self.running.get(task.key)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self.running[task.key]
+        self.settled.emit(task.key)
+
+    def cancel(self, key):
+        task = self.tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+            if not self.tasks:
+                self.busy_changed.emit(False)
+
+    def cancel_all(self):
+        for key in list(self.tasks):
+            self.cancel(key)
+
+    def is_running(self, key):
+        return key in self.running
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)